@@ -0,0 +1,108 @@
+"""Runs AI move searches in worker processes, off the server's network threads.
+
+Each room has at most one job. A job carries a deadline, and its result is
+handed to a callback only if the job was not cancelled or replaced in the
+meantime. Workers run at a lower CPU priority and map the opening book
+read-only, so all of them share one copy of it.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import evaluation
+import opening_book
+
+_book = None  # The worker process's view of the opening book
+
+
+def _init_worker(book_path, niceness):
+    global _book
+    # Ctrl-C reaches the whole process group; only the server should react and shut the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if niceness:
+        try:
+            os.nice(niceness)  # Searches yield the CPU to the server's own threads
+        except (AttributeError, OSError):
+            pass
+    _book = opening_book.load_book(book_path)
+
+
+def _search_job(game_state, settings, deadline):
+    """Worker side of a job: a book move if there is one, else a search until the deadline"""
+    position = evaluation.Position.from_game_state(game_state)
+    if _book is not None:
+        column = _book.move_for(position)
+        if column is not None and position.can_play(column):
+            return column
+    max_depth, budget, noise = settings
+    # Time spent waiting in the queue counts against the job's deadline
+    budget = min(budget, max(0.0, deadline - time.monotonic()))
+    return evaluation.search(position, max_depth, budget, noise)[0]
+
+
+class AIExecutor:
+    def __init__(self, workers=None, book_path=opening_book.BOOK_PATH, niceness=10, tiers=None):
+        if not workers:
+            workers = max(1, (os.cpu_count() or 2) - 1)
+        # Spawned, not forked: forking the threaded server could copy a held lock
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(book_path, niceness))
+        self.tiers = evaluation.TIERS if tiers is None else tiers  # tier -> (max depth, budget, noise)
+        self.jobs = {}  # room name -> (token, future) of the room's current job
+        self.lock = threading.Lock()
+
+    def submit(self, room_name, token, game_state, tier, on_result, timeout=None):
+        """Search a move for the player to move in game_state.
+
+        token identifies the position the job was made for. on_result(room_name,
+        token, column) is called from a pool thread when the search finishes,
+        unless the job was cancelled or replaced by a newer one first.
+        """
+        settings = self.tiers[tier]
+        budget = settings[1]
+        deadline = time.monotonic() + (timeout if timeout is not None else budget)
+        with self.lock:
+            previous = self.jobs.pop(room_name, None)
+            if previous is not None:
+                previous[1].cancel()
+            future = self.pool.submit(_search_job, game_state, settings, deadline)
+            self.jobs[room_name] = (token, future)
+        future.add_done_callback(lambda done: self._finish(room_name, token, done, on_result))
+
+    def _finish(self, room_name, token, future, on_result):
+        with self.lock:
+            current = self.jobs.get(room_name)
+            if current is None or current[1] is not future:
+                return  # Cancelled or replaced while it ran
+            del self.jobs[room_name]
+        if future.cancelled():
+            return
+        try:
+            column = future.result()
+        except Exception as e:
+            print(f"AI search for room {room_name} failed: {e}")
+            return
+        on_result(room_name, token, column)
+
+    def cancel(self, room_name):
+        """Drop the room's job: a queued job never runs and a running one's result is ignored"""
+        with self.lock:
+            job = self.jobs.pop(room_name, None)
+        if job is not None:
+            job[1].cancel()
+
+    def pending(self):
+        with self.lock:
+            return len(self.jobs)
+
+    def stop(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+        for _, future in jobs:
+            future.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
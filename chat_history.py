@@ -0,0 +1,136 @@
+import hashlib
+import os
+import shutil
+import struct
+import threading
+from collections import OrderedDict, deque
+
+HISTORY_PER_ROOM = 200  # Chat lines remembered per room
+ROOMS_IN_MEMORY = 1000  # Rooms whose history stays in RAM before spilling to disk
+LENGTH = struct.Struct("<I")
+
+
+def encode_line(username, text):
+    """Pack a chat line as one bytes object: utf-8 username, NUL, utf-8 text"""
+    return username.encode("utf-8") + b"\0" + text.encode("utf-8")
+
+
+def decode_line(line):
+    username, _, text = line.partition(b"\0")
+    return username.decode("utf-8"), text.decode("utf-8")
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists but belongs to someone else
+    return True
+
+
+class ChatHistoryStore:
+    """Per-room chat history with an LRU of rooms kept in memory.
+
+    Lines are stored packed as bytes. When more than max_rooms rooms have
+    history in memory, the least recently used room is written to a file in
+    this process's own subdirectory of spill_dir and read back the next time
+    anyone touches it. A server taking over with --takeover shares spill_dir
+    with the draining one, so neither touches the other's files.
+    """
+
+    def __init__(self, spill_dir="chat_history", max_rooms=ROOMS_IN_MEMORY, lines_per_room=HISTORY_PER_ROOM):
+        self.base_dir = spill_dir
+        self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+        self.max_rooms = max_rooms
+        self.lines_per_room = lines_per_room
+        self.rooms = OrderedDict()  # room name -> deque of packed lines, least recent first
+        self.spilled = set()  # Rooms whose history currently lives on disk
+        self.lock = threading.Lock()
+        self.clear_spilled()
+
+    def clear_spilled(self):
+        """Remove history left over from servers that are no longer running, and from our own pid"""
+        try:
+            os.makedirs(self.base_dir, exist_ok=True)
+            for name in os.listdir(self.base_dir):
+                if name.isdigit() and (int(name) == os.getpid() or not process_alive(int(name))):
+                    shutil.rmtree(os.path.join(self.base_dir, name), ignore_errors=True)
+            os.makedirs(self.spill_dir, exist_ok=True)
+        except OSError as e:
+            print(f"Error clearing chat history directory: {e}")
+
+    def close(self):
+        """Delete this process's spilled history; it is not kept across restarts"""
+        with self.lock:
+            self.spilled.clear()
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def path_for(self, room_name):
+        digest = hashlib.sha1(room_name.encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, digest + ".chat")
+
+    def append(self, room_name, username, text):
+        with self.lock:
+            self._lines(room_name).append(encode_line(username, text))
+
+    def backlog(self, room_name):
+        """Return the room's history as a list of (username, text), oldest first"""
+        with self.lock:
+            if room_name not in self.rooms and room_name not in self.spilled:
+                return []
+            return [decode_line(line) for line in self._lines(room_name)]
+
+    def drop(self, room_name):
+        """Forget a room's history, in memory and on disk"""
+        with self.lock:
+            self.rooms.pop(room_name, None)
+            if room_name in self.spilled:
+                self.spilled.discard(room_name)
+                try:
+                    os.remove(self.path_for(room_name))
+                except OSError:
+                    pass
+
+    def _lines(self, room_name):
+        """Return the in-memory deque for a room, loading or creating it"""
+        lines = self.rooms.get(room_name)
+        if lines is not None:
+            self.rooms.move_to_end(room_name)
+            return lines
+        lines = deque(maxlen=self.lines_per_room)
+        if room_name in self.spilled:
+            lines.extend(self._read(room_name))
+            self.spilled.discard(room_name)
+        self.rooms[room_name] = lines
+        while len(self.rooms) > self.max_rooms:
+            idle_room, idle_lines = self.rooms.popitem(last=False)
+            self._write(idle_room, idle_lines)
+        return lines
+
+    def _write(self, room_name, lines):
+        try:
+            with open(self.path_for(room_name), "wb") as f:
+                f.write(b"".join(LENGTH.pack(len(line)) + line for line in lines))
+            self.spilled.add(room_name)
+        except OSError as e:
+            print(f"Error spilling chat history for {room_name}: {e}")
+
+    def _read(self, room_name):
+        path = self.path_for(room_name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.remove(path)
+        except OSError as e:
+            print(f"Error loading chat history for {room_name}: {e}")
+            return []
+        lines = []
+        offset = 0
+        while offset + LENGTH.size <= len(data):
+            (length,) = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            lines.append(bytes(data[offset:offset + length]))
+            offset += length
+        return lines
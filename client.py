@@ -1,14 +1,94 @@
+import os
 import sys
-import pickle
+import time
+import random
+import queue
 import threading
 import socket
-import errno
-import pygame
 from PyQt5.QtWidgets import QSizePolicy, QApplication, QWidget, QVBoxLayout, QTextEdit, QPushButton, QLineEdit, QLabel, QComboBox, QMainWindow, QHBoxLayout, QListWidget, QMessageBox
 from PyQt5.QtCore import Qt, QEvent, QCoreApplication, QTimer
 from PyQt5.QtGui import QColor
+from engine import Connect4Game
+import rules
+from protocol import encode_message, FrameDecoder, ProtocolError
+
+CHAT_HISTORY_LIMIT = 500  # Lines kept in a room's chat window
+RECONNECT_DELAYS = (0.5, 1, 1, 2, 2, 4, 4, 8, 8)  # Seconds between attempts to resume a lost session
+STARTED_AT = time.perf_counter()
+
+# pygame is only imported when the first game starts; the lobby never needs it
+pygame = None
+WINDOW_SIZE = (600, 550)
+FONT_NAME = "calibri"
+FONT_SIZE = 20
+FONT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".connect4_font")
+_font = None
+
+
+def load_pygame():
+    """Import pygame and initialize only the display and font modules"""
+    global pygame
+    if pygame is None:
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+        import pygame as module
+        module.display.init()
+        module.font.init()
+        pygame = module
+    return pygame
+
+
+def resolve_font_path():
+    """Return the font file to use, asking the system font scan only once per machine"""
+    try:
+        with open(FONT_CACHE_PATH, encoding="utf-8") as f:
+            path = f.read().strip()
+        if not path or os.path.exists(path):
+            return path or None  # An empty cache entry means pygame's default font
+    except OSError:
+        pass
+    path = pygame.font.match_font(FONT_NAME)
+    try:
+        with open(FONT_CACHE_PATH, "w", encoding="utf-8") as f:
+            f.write(path or "")
+    except OSError as e:
+        print(f"Error caching font path: {e}")
+    return path
+
+
+def get_font():
+    global _font
+    if _font is None:
+        _font = pygame.font.Font(resolve_font_path(), FONT_SIZE)
+    return _font
+
+
+def show_window(size=WINDOW_SIZE):
+    """Show the game window, creating it on first use and reusing it afterwards"""
+    screen = pygame.display.get_surface()
+    if screen is None or screen.get_size() != size:
+        screen = pygame.display.set_mode(size)
+    else:
+        screen = pygame.display.set_mode(size, getattr(pygame, "SHOWN", 0))
+    pygame.display.set_caption('Connect 4')
+    return screen
+
+
+def hide_window():
+    """Hide the game window without destroying it, so the next game opens instantly"""
+    try:
+        screen = pygame.display.get_surface() if pygame is not None else None
+        if screen is not None:
+            if hasattr(pygame, "HIDDEN"):
+                pygame.display.set_mode(screen.get_size(), pygame.HIDDEN)
+            else:
+                pygame.display.iconify()
+    except pygame.error:
+        pass
+
 
 class Connect4GameUI:
+    """Game view for one room window; reset in place between games, not rebuilt"""
+
     def __init__(self, parent):
         self.parent = parent
         self.CHIP_SIZE = 60
@@ -16,27 +96,52 @@ class Connect4GameUI:
         self.CHIP_OFFSET = 15
         self.BOARD_HEIGHT = 450
         self.CHIP_RADIUS = int(self.CHIP_SIZE / 2)
-        self.ROWS = 6
-        self.COLUMNS = 7
+        self.ROWS = rules.ROWS
+        self.COLUMNS = rules.COLUMNS
+        self.window_size = WINDOW_SIZE
         self.grid = [[None for i in range(self.COLUMNS)] for j in range(self.ROWS)]
         self.current_player_id = 0
         self.players = []
         self.game_over = False
         self.winner = None
+        self.winning_line = None
         self.my_player_id = None
+
+        # Client-side prediction: a local copy of the game that our own moves
+        # are applied to before the server confirms them
+        self.engine = None
+        self.pending_moves = {}  # move sequence number -> column, not yet confirmed
+        self.state_lock = threading.RLock()
         
-        # Initialize pygame
-        pygame.init()
-        pygame.font.init()
-        pygame.display.set_caption('Connect 4')
-        
-        self.screen = pygame.display.set_mode((600, 550))
-        self.font = pygame.font.SysFont('Calibri', 20)
-        self.clock = pygame.time.Clock()
+        # Initialize pygame lazily, reusing the window and font of earlier games
+        load_pygame()
+        self.screen = None
+        self.font = get_font()
+        self.started_at = None  # When start_game was called, until the first frame is shown
         
         # Game state
         self.running = True
         self.my_turn = False
+
+        # The window is shown and hidden by the game loop thread only
+        self.visible = False
+        self.want_visible = False
+        self.wake = threading.Event()
+
+        # Rendering state: only what changed since the last frame is redrawn
+        self.render_lock = threading.Lock()
+        self.full_redraw = True
+        self.status_dirty = True
+        self.dirty_cells = set()
+        self.text_cache = {}  # (text, color) -> rendered surface
+        self.backgrounds = {}  # (rows, columns) -> pre-rendered empty board
+        self.STATUS_RECT = pygame.Rect(0, 0, self.window_size[0], self.OFFSET - 10)  # Strip above the board outline
+        self.STATUS_Y = max(0, (self.STATUS_RECT.height - self.font.get_height()) // 2)
+        self.build_surfaces()
+
+        # One render loop for the lifetime of the room window
+        self.loop_thread = threading.Thread(target=self.game_loop, daemon=True)
+        self.loop_thread.start()
         
     def get_player_color(self, player_id):
         """Get color for player ID"""
@@ -52,57 +157,229 @@ class Connect4GameUI:
         else:
             return "Yellow"
     
+    def set_geometry(self, rows, columns):
+        """Resize the board for a game's geometry; backgrounds are kept per geometry"""
+        if (rows, columns) == (self.ROWS, self.COLUMNS):
+            return
+        step = self.CHIP_SIZE + self.CHIP_OFFSET
+        self.ROWS = rows
+        self.COLUMNS = columns
+        self.BOARD_HEIGHT = 450 + (rows - rules.ROWS) * step
+        self.window_size = (WINDOW_SIZE[0] + (columns - rules.COLUMNS) * step,
+                            WINDOW_SIZE[1] + (rows - rules.ROWS) * step)
+        self.STATUS_RECT = pygame.Rect(0, 0, self.window_size[0], self.OFFSET - 10)
+        self.background = self.backgrounds.get((rows, columns))
+        if self.background is None:
+            self.build_background()
+
+    def build_surfaces(self):
+        """Pre-render the static board and the chip sprites once"""
+        size = self.CHIP_RADIUS * 2 + 2
+        self.chip_surfaces = {}
+        for player_id in (0, 1):
+            surface = pygame.Surface((size, size), pygame.SRCALPHA)
+            pygame.draw.circle(surface, self.get_player_color(player_id),
+                               (size // 2, size // 2), self.CHIP_RADIUS)
+            self.chip_surfaces[player_id] = surface
+        self.highlight_surface = pygame.Surface((size, size), pygame.SRCALPHA)
+        pygame.draw.circle(self.highlight_surface, (0, 200, 0), (size // 2, size // 2), self.CHIP_RADIUS, 5)
+
+        self.build_background()
+
+    def build_background(self):
+        """Pre-render the board outline, empty holes and column numbers"""
+        background = pygame.Surface(self.window_size)
+        background.fill((255, 255, 255))
+        board_width = self.COLUMNS * self.CHIP_SIZE + (self.COLUMNS - 1) * self.CHIP_OFFSET + 20
+        board_height = self.ROWS * self.CHIP_SIZE + (self.ROWS - 1) * self.CHIP_OFFSET + 20
+        pygame.draw.rect(background, (0, 0, 255),
+            [self.OFFSET - 10, self.OFFSET - 10, board_width, board_height], 5)
+        for row in range(self.ROWS):
+            for col in range(self.COLUMNS):
+                pygame.draw.circle(background, (200, 200, 200),
+                                   self.cell_center(row, col), self.CHIP_RADIUS, 2)
+        for i in range(self.COLUMNS):
+            text = self.font.render(str(i + 1), True, (0, 0, 0))
+            x = self.OFFSET + self.CHIP_RADIUS + i * (self.CHIP_SIZE + self.CHIP_OFFSET) - 5
+            background.blit(text, (x, self.OFFSET + self.BOARD_HEIGHT + 10))
+        self.background = self.backgrounds[(self.ROWS, self.COLUMNS)] = background
+
+    def cell_center(self, row, col):
+        x = (self.OFFSET + self.CHIP_RADIUS + self.CHIP_OFFSET * col +
+             self.CHIP_SIZE * col)
+        y = (self.BOARD_HEIGHT - self.CHIP_SIZE * row -
+             self.CHIP_OFFSET * row)
+        return x, y
+
+    def cell_rect(self, row, col):
+        x, y = self.cell_center(row, col)
+        size = self.CHIP_RADIUS * 2 + 2
+        return pygame.Rect(x - size // 2, y - size // 2, size, size)
+
+    def invalidate(self, cells=(), status=False, full=False):
+        """Mark parts of the window for redraw and wake the game loop"""
+        with self.render_lock:
+            self.dirty_cells.update(cells)
+            self.status_dirty = self.status_dirty or status
+            self.full_redraw = self.full_redraw or full
+        self.wake.set()
+        try:
+            pygame.event.post(pygame.event.Event(pygame.USEREVENT))
+        except pygame.error:
+            pass
+
     def start_game(self, game_state):
-        """Initialize the game with server state"""
-        self.grid = game_state["grid"]
-        self.current_player_id = game_state["current_player_id"]
-        self.players = game_state["players"]
-        self.game_over = game_state["game_over"]
-        self.winner = game_state["winner"]
-        
-        # Determine which player ID I am
-        if self.parent.current_user in self.players:
-            self.my_player_id = self.players.index(self.parent.current_user)
-        
-        self.my_turn = (not self.game_over and 
-                       game_state["current_player"] == self.parent.current_user)
-        
-        # Start game loop in a separate thread
-        threading.Thread(target=self.game_loop, daemon=True).start()
+        """Initialize the game with server state and show the window"""
+        with self.state_lock:
+            self.engine = Connect4Game.from_state(self.parent.room_name, game_state)
+            self.pending_moves = {}
+            self.set_geometry(self.engine.ROWS, self.engine.COLUMNS)
+            self.grid = [list(row) for row in self.engine.grid]
+            self.current_player_id = game_state["current_player_id"]
+            self.players = game_state["players"]
+            self.game_over = game_state["game_over"]
+            self.winner = game_state["winner"]
+            self.winning_line = self.engine.winning_line
+            
+            # Determine which player ID I am
+            self.my_player_id = None
+            if self.parent.current_user in self.players:
+                self.my_player_id = self.players.index(self.parent.current_user)
+            
+            self.my_turn = (not self.game_over and 
+                           game_state["current_player"] == self.parent.current_user)
+        self.started_at = time.perf_counter()
+        self.want_visible = True
+        self.invalidate(full=True)
+
+    def reset(self):
+        """Clear the board in place, keeping the window, surfaces and loop"""
+        with self.state_lock:
+            self.engine = None
+            self.pending_moves = {}
+            self.grid = [[None for i in range(self.COLUMNS)] for j in range(self.ROWS)]
+            self.current_player_id = 0
+            self.players = []
+            self.game_over = False
+            self.winner = None
+            self.winning_line = None
+            self.my_player_id = None
+            self.my_turn = False
+        self.invalidate(full=True)
         
     def update_game_state(self, game_state):
-        """Update game state from server"""
-        self.grid = game_state["grid"]
-        self.current_player_id = game_state["current_player_id"]
-        self.game_over = game_state["game_over"]
-        self.winner = game_state["winner"]
+        """Update game state from server, replaying moves it has not seen yet"""
+        with self.state_lock:
+            server_seq = game_state["move_count"]
+            self.pending_moves = {seq: column for seq, column in self.pending_moves.items()
+                                  if seq > server_seq}
+            self.engine = Connect4Game.from_state(self.parent.room_name, game_state)
+            for seq in sorted(self.pending_moves):
+                if self.engine.add_chip(self.parent.current_user, self.pending_moves[seq]) == -1:
+                    # The prediction no longer fits the server's board; drop it
+                    self.pending_moves = {}
+                    self.engine = Connect4Game.from_state(self.parent.room_name, game_state)
+                    break
+            self.apply_engine_state()
+
+    def predict_move(self, column):
+        """Show our own move immediately and send it to the server"""
+        with self.state_lock:
+            if self.engine is None:
+                return
+            row = self.engine.add_chip(self.parent.current_user, column)
+            if row == -1:
+                return
+            seq = self.engine.move_count
+            self.pending_moves[seq] = column
+            self.apply_engine_state()
+        self.parent.send_game_move(column, seq)
+
+    def reject_move(self, move_seq, game_state):
+        """Roll back a prediction the server refused"""
+        with self.state_lock:
+            self.pending_moves.pop(move_seq, None)
+            self.update_game_state(game_state)
+
+    def drop_move(self, move_seq):
+        """Undo our predicted move locally when the server's rate limiter dropped it"""
+        with self.state_lock:
+            if move_seq not in self.pending_moves or self.engine is None or self.engine.move_count != move_seq:
+                return
+            del self.pending_moves[move_seq]
+            self.engine.undo()
+            self.apply_engine_state()
+
+    def take_back(self, game_state):
+        """Show the position after a takeback; predictions made before it no longer apply"""
+        with self.state_lock:
+            self.pending_moves = {}
+            self.update_game_state(game_state)
+
+    def apply_engine_state(self):
+        """Copy the local engine's state into the view and redraw what changed"""
+        old_grid = self.grid
+        self.grid = [list(row) for row in self.engine.grid]
+        self.current_player_id = self.engine.current_player
+        self.game_over = self.engine.game_over
+        self.winner = self.engine.winner
+        old_line = self.winning_line
+        self.winning_line = self.engine.winning_line
         
         self.my_turn = (not self.game_over and 
-                       game_state["current_player"] == self.parent.current_user)
+                       self.engine.players[self.engine.current_player] == self.parent.current_user)
+
+        changed = [(row, col) for row in range(self.ROWS) for col in range(self.COLUMNS)
+                   if old_grid[row][col] != self.grid[row][col]]
+        if self.winning_line != old_line:
+            changed += [tuple(cell) for cell in list(old_line or ()) + list(self.winning_line or ())]
+        self.invalidate(changed, status=True)
         
+    def set_visible(self, visible):
+        """Show or hide the window; called from the game loop thread only"""
+        if visible:
+            self.screen = show_window(self.window_size)
+            self.full_redraw = True
+        else:
+            hide_window()
+        self.visible = visible
+
     def game_loop(self):
-        """Main game loop"""
+        """Main game loop; sleeps until input or a game update arrives"""
         while self.running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-                    pygame.quit()
-                    return
+            if self.want_visible != self.visible or (self.visible and self.screen.get_size() != self.window_size):
+                self.set_visible(self.want_visible)
+            if not self.visible:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+            events = [pygame.event.wait(250)] + pygame.event.get()
+            for event in events:
+                if event.type in (pygame.VIDEOEXPOSE, getattr(pygame, "WINDOWEXPOSED", -1)):
+                    self.full_redraw = True
+                elif event.type == pygame.QUIT:
+                    # Only hide; the next game shows the same window again
+                    self.want_visible = False
+                elif event.type == pygame.KEYUP and event.key == 117 and not self.game_over:
+                    # U key asks for a takeback; checked first so it also works on our own turn
+                    self.parent.send_takeback_request()
                 elif event.type == pygame.KEYUP and self.my_turn and not self.game_over:
-                    # Handle column selection (1-7 keys)
+                    # Handle column selection (number keys)
                     column = event.key - 49  # Convert key to column (1 key = column 0)
                     if 0 <= column < self.COLUMNS:
                         # Validate move locally first
                         if self.is_valid_move(column):
-                            # Send move to server
-                            self.parent.send_game_move(column)
+                            # Show the move right away and send it to the server
+                            self.predict_move(column)
                 elif event.type == pygame.KEYUP and self.game_over:
                     # Handle restart (Y key)
                     if event.key in [121, 122]:  # Y or Z key
                         self.parent.send_restart_game()
             
-            self.draw()
-            self.clock.tick(60)
+            if self.running and self.want_visible:
+                self.draw()
+        if self.visible:
+            self.set_visible(False)
             
     def is_valid_move(self, column):
         """Check if a move is valid locally"""
@@ -111,12 +388,12 @@ class Connect4GameUI:
         # Check if column has space
         return self.grid[self.ROWS-1][column] is None
     
-    def draw(self):
-        """Draw the game board and pieces"""
-        self.screen.fill((255, 255, 255))
-        
-        # Draw current player info
-        if not self.game_over:
+    def status_line(self):
+        """Return the status text and its color for the current state"""
+        if not self.players:
+            text = "Waiting for the next game..."
+            color = (0, 0, 0)
+        elif not self.game_over:
             if self.my_turn:
                 text = f"Your turn - {self.get_player_name(self.my_player_id)}"
                 color = (0, 150, 0)
@@ -128,62 +405,67 @@ class Connect4GameUI:
             if self.winner == self.parent.current_user:
                 text = "You won!"
                 color = (0, 150, 0)
+            elif self.winner is None:
+                text = "Draw!"
+                color = (0, 0, 0)
             else:
                 text = f"{self.winner} won!"
                 color = (150, 0, 0)
-        
-        text_surface = self.font.render(text, True, color)
-        self.screen.blit(text_surface, (20, 10))
-        
-        # Draw the game board
-        self.draw_board()
-        
-        # Draw column numbers
-        for i in range(self.COLUMNS):
-            text = self.font.render(str(i + 1), True, (0, 0, 0))
-            x = self.OFFSET + self.CHIP_RADIUS + i * (self.CHIP_SIZE + self.CHIP_OFFSET) - 5
-            self.screen.blit(text, (x, self.OFFSET + self.BOARD_HEIGHT + 10))
-        
-        pygame.display.flip()
-    
-    def draw_board(self):
-        """Draw the board and all pieces"""
-        # Draw board outline
-        board_width = self.COLUMNS * self.CHIP_SIZE + (self.COLUMNS - 1) * self.CHIP_OFFSET + 20
-        board_height = self.ROWS * self.CHIP_SIZE + (self.ROWS - 1) * self.CHIP_OFFSET + 20
-        pygame.draw.rect(self.screen, (0, 0, 255), 
-            [self.OFFSET - 10, self.OFFSET - 10, board_width, board_height], 5)
-        
-        # Draw all pieces
-        for row in range(self.ROWS):
-            for col in range(self.COLUMNS):
-                if self.grid[row][col] is not None:
-                    player_id = self.grid[row][col]
-                    color = self.get_player_color(player_id)
-                    x = (self.OFFSET + self.CHIP_RADIUS + self.CHIP_OFFSET * col + 
-                         self.CHIP_SIZE * col)
-                    y = (self.BOARD_HEIGHT - self.CHIP_SIZE * row - 
-                         self.CHIP_OFFSET * row)
-                    pygame.draw.circle(self.screen, color, (x, y), self.CHIP_RADIUS)
-        
-        # Draw empty spaces
-        for row in range(self.ROWS):
-            for col in range(self.COLUMNS):
-                if self.grid[row][col] is None:
-                    x = (self.OFFSET + self.CHIP_RADIUS + self.CHIP_OFFSET * col + 
-                         self.CHIP_SIZE * col)
-                    y = (self.BOARD_HEIGHT - self.CHIP_SIZE * row - 
-                         self.CHIP_OFFSET * row)
-                    pygame.draw.circle(self.screen, (200, 200, 200), (x, y), self.CHIP_RADIUS, 2)
+        return text, color
+
+    def render_text(self, text, color):
+        surface = self.text_cache.get((text, color))
+        if surface is None:
+            surface = self.text_cache[(text, color)] = self.font.render(text, True, color)
+        return surface
+
+    def draw(self):
+        """Redraw whatever was invalidated since the last frame"""
+        with self.render_lock:
+            full = self.full_redraw
+            status = self.status_dirty
+            cells = self.dirty_cells
+            self.full_redraw = False
+            self.status_dirty = False
+            self.dirty_cells = set()
+        if not (full or status or cells):
+            return
+
+        if full:
+            self.screen.blit(self.background, (0, 0))
+            cells = [(row, col) for row in range(self.ROWS) for col in range(self.COLUMNS)]
+            status = True
+
+        winning_cells = {tuple(cell) for cell in self.winning_line or ()}
+        rects = []
+        if status:
+            self.screen.blit(self.background, self.STATUS_RECT, self.STATUS_RECT)
+            self.screen.blit(self.render_text(*self.status_line()), (20, self.STATUS_Y))
+            rects.append(self.STATUS_RECT)
+        for row, col in cells:
+            rect = self.cell_rect(row, col)
+            self.screen.blit(self.background, rect, rect)
+            player_id = self.grid[row][col]
+            if player_id is not None:
+                self.screen.blit(self.chip_surfaces[player_id], rect)
+            if (row, col) in winning_cells:
+                self.screen.blit(self.highlight_surface, rect)
+            rects.append(rect)
+
+        if full:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
+        if self.started_at is not None:
+            print(f"First game frame after {(time.perf_counter() - self.started_at) * 1000:.1f} ms")
+            self.started_at = None
     
     def close(self):
-        """Close the game window"""
+        """Stop the game loop and hide the window"""
         self.running = False
-        
-        try:
-            pygame.quit()
-        except:
-            pass
+        self.invalidate()
+        if self.loop_thread is not threading.current_thread():
+            self.loop_thread.join(1.0)
 
 class MessageEvent(QEvent):
     EventType = QEvent.Type(QEvent.registerEventType())
@@ -192,15 +474,137 @@ class MessageEvent(QEvent):
         self.message_type = message_type
         self.data = data
 
+class ClientTransport:
+    """Socket I/O for the GUI client, run on dedicated threads.
+
+    send() only encodes and queues a frame, so the GUI thread never waits on
+    the network and messages sent from different threads cannot interleave.
+    The reader thread decodes frames and posts each message to the receiver
+    as a MessageEvent whose type is looked up in DISPATCH.
+    """
+    DISPATCH = {
+        "Join_Room": "chat",
+        "Sending_Message": "chat",
+        "Chat_Backlog": "chat",
+        "Room_State": "rooms",
+        "Check_Username": "rooms",
+        "Queue_Status": "rooms",
+        "Rating": "rooms",
+        "Leaderboard": "rooms",
+        "Server_Moving": "rooms",
+        "Ready_Update": "game",
+        "Game_Start": "game",
+        "Game_Update": "game",
+        "Game_Over": "game",
+        "Game_Restart": "game",
+        "Move_Rejected": "game",
+        "Takeback_Request": "game",
+        "Takeback": "game",
+        "Rate_Limited": "limit",
+    }
+
+    def __init__(self, receiver, host, port):
+        self.receiver = receiver
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.send_queue = queue.Queue()
+        self.running = False
+        self.writer_started = False
+
+    def start(self):
+        """Connect and start the I/O threads; results arrive as events."""
+        self.running = True
+        threading.Thread(target=self.run_reader, daemon=True).start()
+
+    def post(self, message_type, data):
+        QCoreApplication.postEvent(self.receiver, MessageEvent(message_type, data))
+
+    def send(self, message):
+        """Queue a message for sending. Returns False if the transport is closed."""
+        if not self.running:
+            return False
+        self.send_queue.put(encode_message(message))
+        return True
+
+    def run_reader(self):
+        try:
+            self.socket = socket.create_connection((self.host, self.port))
+        except OSError as e:
+            self.running = False
+            self.post("connect_failed", f"Error connecting to server: {e}")
+            return
+        if not self.running:  # Closed while connecting
+            self.socket.close()
+            return
+        self.post("connected", f"Connected to server at {self.host}:{self.port}")
+        self.writer_started = True
+        threading.Thread(target=self.run_writer, daemon=True).start()
+
+        decoder = FrameDecoder()
+        while self.running:
+            try:
+                data = self.socket.recv(65536)
+                if not data:
+                    if self.running:
+                        self.post("status", "Server disconnected.")
+                    break
+                messages = decoder.feed(data)
+            except (OSError, ProtocolError) as e:
+                if self.running:
+                    self.post("status", f"Error receiving message: {e}")
+                break
+            for message in messages:
+                if not message:
+                    continue
+                print(f"Processing message: {message}")
+                message_type = self.DISPATCH.get(message["Command"])
+                if message_type is None:
+                    self.post("status", f"Unknown command received: {message['Command']}")
+                else:
+                    self.post(message_type, message)
+        if self.running:
+            self.post("disconnected", None)
+
+    def run_writer(self):
+        while True:
+            data = self.send_queue.get()
+            if data is None:
+                break
+            try:
+                self.socket.sendall(data)
+            except OSError as e:
+                if self.running:
+                    self.post("status", f"Error sending message: {e}")
+                    self.post("disconnected", None)
+                break
+        # Everything queued before close() has been flushed
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    def close(self):
+        """Flush queued messages, then close the connection."""
+        if not self.running:
+            return
+        self.running = False
+        if self.writer_started:
+            self.send_queue.put(None)
+        elif self.socket:
+            self.socket.close()
+
 class New_game_room(QMainWindow):  
-    def __init__(self, current_user, room_name, list_of_users, client_socket):
+    def __init__(self, current_user, room_name, list_of_users, transport):
         super().__init__()  
         self.current_user = current_user 
         self.room_name = room_name
         self.list_of_users_in_room = [user for user in (list_of_users or []) if isinstance(user, str)]
-        self.client_socket = client_socket
+        self.transport = transport
         self.ready_users = {}
         self.game_ui = None
+        self.pending_chat = []  # Lines waiting for the next flush_chat
         print(f"Initializing New_game_room for user {self.current_user} in room {self.room_name} with users {self.list_of_users_in_room}")
         self.init_ui()
         self.show()  
@@ -223,6 +627,7 @@ class New_game_room(QMainWindow):
         chat_layout = QVBoxLayout()
         self.text_edit = QTextEdit()
         self.text_edit.setReadOnly(True)
+        self.text_edit.document().setMaximumBlockCount(CHAT_HISTORY_LIMIT)
         self.text_edit.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         self.text_edit.setAlignment(Qt.AlignTop)
         self.text_edit.setStyleSheet("""
@@ -306,6 +711,69 @@ class New_game_room(QMainWindow):
         """)
         input_layout.addWidget(self.ready_button)
 
+        # Takeback button: asks the opponent to let our last move be taken back
+        self.takeback_button = QPushButton("Takeback")
+        self.takeback_button.clicked.connect(self.send_takeback_request)
+        self.takeback_button.setFixedSize(100, 40)
+        self.takeback_button.setStyleSheet("""
+            QPushButton {
+                background-color: #1e90ff;
+                color: #ffffff;
+                border: none;
+                border-radius: 8px;
+                padding: 8px;
+                font-size: 16px;
+                font-family: 'Arial', sans-serif;
+            }
+            QPushButton:hover {
+                background-color: #4682b4;
+            }
+            QPushButton:pressed {
+                background-color: #1c86ee;
+            }
+        """)
+        input_layout.addWidget(self.takeback_button)
+
+        # AI opponent: pick a strength and seat it in the free seat
+        self.ai_tier_selector = QComboBox()
+        self.ai_tier_selector.addItems(["easy", "medium", "hard"])
+        self.ai_tier_selector.setCurrentText("medium")
+        self.ai_tier_selector.setFixedSize(100, 40)
+        self.ai_tier_selector.setStyleSheet("""
+            QComboBox {
+                background-color: #3c3f41;
+                color: #ffffff;
+                border: 1px solid #555555;
+                border-radius: 8px;
+                padding: 8px;
+                font-size: 16px;
+                font-family: 'Arial', sans-serif;
+            }
+        """)
+        input_layout.addWidget(self.ai_tier_selector)
+
+        self.add_ai_button = QPushButton("Add AI")
+        self.add_ai_button.clicked.connect(self.send_add_bot)
+        self.add_ai_button.setFixedSize(100, 40)
+        self.add_ai_button.setStyleSheet("""
+            QPushButton {
+                background-color: #1e90ff;
+                color: #ffffff;
+                border: none;
+                border-radius: 8px;
+                padding: 8px;
+                font-size: 16px;
+                font-family: 'Arial', sans-serif;
+            }
+            QPushButton:hover {
+                background-color: #4682b4;
+            }
+            QPushButton:pressed {
+                background-color: #1c86ee;
+            }
+        """)
+        input_layout.addWidget(self.add_ai_button)
+
         chat_layout.addLayout(input_layout)
         chat_layout.addSpacing(10)
         main_layout.addLayout(chat_layout, stretch=3)
@@ -349,6 +817,27 @@ class New_game_room(QMainWindow):
         user_layout.addStretch()
         main_layout.addLayout(user_layout, stretch=1)
 
+    def append_chat(self, line):
+        """Queue a chat line; all lines added in one event-loop pass are shown together"""
+        if not self.pending_chat:
+            QTimer.singleShot(0, self.flush_chat)
+        self.pending_chat.append(line)
+
+    def flush_chat(self):
+        """Append the queued chat lines with a single repaint"""
+        lines = self.pending_chat[-CHAT_HISTORY_LIMIT:]
+        self.pending_chat = []
+        self.text_edit.setUpdatesEnabled(False)
+        for line in lines:
+            self.text_edit.append(line)
+        self.text_edit.setUpdatesEnabled(True)
+
+    def load_backlog(self, messages):
+        """Show the chat that happened before we joined"""
+        for username, text in messages:
+            self.append_chat(f"{username}: {text}")
+        self.append_chat("--- You joined the room ---")
+
     def update_user_list(self):
         """Update the user list with ready status"""
         self.user_list.clear()
@@ -405,37 +894,31 @@ class New_game_room(QMainWindow):
         
 
         # Send ready status to server
-        if client_menu.client_socket:
-            message = {
-                "Command": "Ready_Status",
-                "Room_Name": self.room_name,
-                "User_Name": self.current_user,
-                "Ready": new_ready
-            }
-            try:
-                data = pickle.dumps(message)
-                client_menu.client_socket.sendall(data)
-            except Exception as e:
-                self.text_edit.append(f"Error sending ready status: {e}")
+        message = {
+            "Command": "Ready_Status",
+            "Room_Name": self.room_name,
+            "User_Name": self.current_user,
+            "Ready": new_ready
+        }
+        if not self.transport.send(message):
+            self.append_chat("Error sending ready status: not connected")
 
     def send_message(self):
         """Send a message to the server"""
         message_text = self.message_input.text().strip()
-        if message_text and client_menu.client_socket:
+        if message_text:
             message = {
                 "Command": "Sending_Message",
                 "Room_Name": self.room_name,
                 "User_Name": self.current_user,
                 "Text": message_text
             }
-            try:
-                data = pickle.dumps(message)
-                client_menu.client_socket.sendall(data)
+            if self.transport.send(message):
                 self.message_input.clear()
-            except Exception as e:
-                self.text_edit.append(f"Error sending message: {e}")
+            else:
+                self.append_chat("Error sending message: not connected")
         else:
-            self.text_edit.append("Please enter a message to send.")
+            self.append_chat("Please enter a message to send.")
 
     def handle_ready_update(self, ready_users):
         """Handle ready status update from server"""
@@ -452,14 +935,15 @@ class New_game_room(QMainWindow):
         # Show ready status in chat
         ready_list = [user for user, ready in ready_users.items() if ready]
         if ready_list:
-            self.text_edit.append(f"Ready players: {', '.join(ready_list)}")
+            self.append_chat(f"Ready players: {', '.join(ready_list)}")
 
     def handle_game_start(self, game_state):
         """Handle game start from server"""
-        self.text_edit.append("Connect 4 game starting!")
+        self.append_chat("Connect 4 game starting!")
         self.ready_button.setEnabled(False)
-        # Create and start game UI
-        self.game_ui = Connect4GameUI(self)
+        # The game view is created once per room window and reused for rematches
+        if self.game_ui is None:
+            self.game_ui = Connect4GameUI(self)
         self.game_ui.start_game(game_state)
 
     def handle_game_update(self, move, game_state):
@@ -469,14 +953,25 @@ class New_game_room(QMainWindow):
         player = move["player"]# This variable should be the username of the player making the move
         
         column = move["column"]
-        self.text_edit.append(f"{player} played column {column + 1}")
+        self.append_chat(f"{player} played column {column + 1}")
         
         if self.game_ui:
             self.game_ui.update_game_state(game_state)
 
+    def handle_move_rejected(self, move_seq, game_state):
+        """Handle the server refusing one of our moves"""
+        self.append_chat("Move rejected by the server.")
+        if self.game_ui:
+            self.game_ui.reject_move(move_seq, game_state)
+
+    def handle_move_dropped(self, room_name, move_seq):
+        """Handle the server's rate limiter dropping one of our moves"""
+        if room_name == self.room_name and self.game_ui:
+            self.game_ui.drop_move(move_seq)
+
     def handle_game_over(self, winner, game_state):
         """Handle game over from server"""
-        self.text_edit.append(f"Game Over! Winner: {winner}")
+        self.append_chat(f"Game Over! Winner: {winner}")
         self.ready_button.setEnabled(True)
         
         #New sending message here to reshow the ready after game over
@@ -488,59 +983,81 @@ class New_game_room(QMainWindow):
                 "User_Name": self.current_user,
                 "Ready": not current_ready
             }
-        try:
-            data = pickle.dumps(message)
-            client_menu.client_socket.sendall(data)
-        except Exception as e:
-            self.text_edit.append(f"Error sending ready status: {e}")
+        if not self.transport.send(message):
+            self.append_chat("Error sending ready status: not connected")
         # Update the ready button color to match the new state
         self.changing_color(not current_ready)
         if self.game_ui:
             self.game_ui.update_game_state(game_state)
 
+    def handle_takeback_request(self, requester):
+        """Ask whether to let the opponent take back their last move"""
+        answer = QMessageBox.question(self, "Takeback", f"{requester} asks to take back their last move. Allow it?",
+                                      QMessageBox.Yes | QMessageBox.No)
+        self.transport.send({
+            "Command": "Takeback_Response",
+            "Room_Name": self.room_name,
+            "User_Name": self.current_user,
+            "Accept": answer == QMessageBox.Yes
+        })
+
+    def handle_takeback(self, requester, accepted, game_state):
+        """Handle the outcome of a takeback request"""
+        if not accepted:
+            self.append_chat(f"Takeback for {requester} was declined.")
+            return
+        self.append_chat(f"{requester} took back a move.")
+        if self.game_ui:
+            self.game_ui.take_back(game_state)
+
     def handle_game_restart(self, ready_users):
         """Handle game restart from server"""
-        self.text_edit.append("Game restarted!")
+        self.append_chat("Game restarted!")
         self.ready_users = ready_users
         self.update_user_list()
         
         if self.game_ui:
-            self.game_ui.close()
-            self.game_ui = None
+            self.game_ui.reset()
 
-    def send_game_move(self, column):
-        """Send a game move to the server"""
-        if client_menu.client_socket:
-            message = {
-                "Command": "Game_Move",
-                "Room_Name": self.room_name,
-                "User_Name": self.current_user,
-                "Column": column
-            }
-            try:
-                data = pickle.dumps(message)
-                client_menu.client_socket.sendall(data)
-            except Exception as e:
-                self.text_edit.append(f"Error sending move: {e}")
+    def send_game_move(self, column, move_seq=None):
+        """Send a game move to the server (called from the game loop thread)"""
+        self.transport.send({
+            "Command": "Game_Move",
+            "Room_Name": self.room_name,
+            "User_Name": self.current_user,
+            "Column": column,
+            "Move_Seq": move_seq
+        })
+
+    def send_add_bot(self):
+        """Ask the server to seat an AI opponent in this room"""
+        self.transport.send({
+            "Command": "Add_Bot",
+            "Room_Name": self.room_name,
+            "User_Name": self.current_user,
+            "Tier": self.ai_tier_selector.currentText()
+        })
+
+    def send_takeback_request(self):
+        """Ask the opponent to allow taking back our last move (GUI or game loop thread)"""
+        self.transport.send({
+            "Command": "Request_Takeback",
+            "Room_Name": self.room_name,
+            "User_Name": self.current_user
+        })
 
     def send_restart_game(self):
-        """Send a game restart request to the server"""
-        if client_menu.client_socket:
-            message = {
-                "Command": "Restart_Game",
-                "Room_Name": self.room_name,
-                "User_Name": self.current_user
-            }
-            try:
-                data = pickle.dumps(message)
-                client_menu.client_socket.sendall(data)
-            except Exception as e:
-                self.text_edit.append(f"Error restarting game: {e}")
+        """Send a game restart request to the server (called from the game loop thread)"""
+        self.transport.send({
+            "Command": "Restart_Game",
+            "Room_Name": self.room_name,
+            "User_Name": self.current_user
+        })
 
     def updating_text_edit(self, message, list_of_users):
         """Update the text edit and user list with a new message."""
         self.list_of_users_in_room = [user for user in (list_of_users or []) if isinstance(user, str)]
-        self.text_edit.append(message)
+        self.append_chat(message)
         self.update_user_list()
         print(f"Updated chat room {self.room_name} with message: {message}, users: {self.list_of_users_in_room}")
 
@@ -548,21 +1065,17 @@ class New_game_room(QMainWindow):
         """Handle window close event."""
         if self.game_ui:
             self.game_ui.close()
+            self.game_ui = None
             
-        if self.client_socket:
-            try:
-                leave_message = {
-                    "Command": "Sending_Message",
-                    "Room_Name": self.room_name,
-                    "User_Name": self.current_user,
-                    "Text": f"{self.current_user} has left the room."
-                }
-                print(f"Sending close Box_chat: {leave_message}")
-                data = pickle.dumps(leave_message)
-                self.client_socket.sendall(data)
-                client_menu.alreadyinroom = False
-            except:
-                pass
+        leave_message = {
+            "Command": "Sending_Message",
+            "Room_Name": self.room_name,
+            "User_Name": self.current_user,
+            "Text": f"{self.current_user} has left the room."
+        }
+        print(f"Sending close Box_chat: {leave_message}")
+        self.transport.send(leave_message)
+        client_menu.alreadyinroom = False
         event.accept()
 
 class ClientMenu(QMainWindow):
@@ -574,11 +1087,14 @@ class ClientMenu(QMainWindow):
         self.username = None  
         self.room_name = None
         self.list_of_available_rooms = []
-        self.client_socket = None
+        self.in_match_queue = False
+        self.transport = None
         self.chatroom = None
-        self.running = True
-        self.is_disconnected = False
+        self.is_disconnected = True
         self.alreadyinroom = False
+        self.reconnect_token = None  # Lets the server give our seats back after a restart
+        self.resuming = False
+        self.reconnect_attempt = 0
         self.init_ui()
     
     def init_ui(self):
@@ -737,6 +1253,31 @@ class ClientMenu(QMainWindow):
         """)
         self.layout.addWidget(self.room_input)
 
+        # Board variant used when creating a room
+        self.variant_selector = QComboBox()
+        self.variant_selector.addItems(list(rules.VARIANTS))
+        self.variant_selector.setFixedHeight(30)
+        self.variant_selector.setStyleSheet("""
+            QComboBox {
+                background-color: #3c3f41;
+                color: #ffffff;
+                border: 1px solid #555555;
+                border-radius: 5px;
+                padding: 5px;
+                font-size: 14px;
+            }
+            QComboBox::drop-down {
+                border: none;
+            }
+            QComboBox QAbstractItemView {
+                background-color: #3c3f41;
+                color: #ffffff;
+                selection-background-color: #1e90ff;
+                border: 1px solid #555555;
+            }
+        """)
+        self.layout.addWidget(self.variant_selector)
+
         # Room action buttons layout
         room_button_layout = QHBoxLayout()
         self.create_room_button = QPushButton("Create Room")
@@ -793,6 +1334,32 @@ class ClientMenu(QMainWindow):
         
         self.layout.addLayout(room_button_layout)
 
+        self.quick_match_button = QPushButton("Quick Match")
+        self.quick_match_button.clicked.connect(self.Queue_for_match)
+        self.quick_match_button.setEnabled(False)
+        self.quick_match_button.setFixedHeight(30)
+        self.quick_match_button.setStyleSheet("""
+            QPushButton {
+                background-color: #28a745;
+                color: #ffffff;
+                border: none;
+                border-radius: 5px;
+                padding: 5px;
+                font-size: 14px;
+            }
+            QPushButton:hover {
+                background-color: #218838;
+            }
+            QPushButton:pressed {
+                background-color: #1e7e34;
+            }
+            QPushButton:disabled {
+                background-color: #555555;
+                color: #888888;
+            }
+        """)
+        self.layout.addWidget(self.quick_match_button)
+
         self.text_edit = QTextEdit()
         self.text_edit.setReadOnly(True)
         self.text_edit.setMinimumHeight(200)
@@ -812,91 +1379,116 @@ class ClientMenu(QMainWindow):
         central_widget.setLayout(self.layout)
 
     def Create_socket(self):
-        """Create socket connection to server"""
+        """Start connecting to the server; the result arrives as an event"""
         check = self.username_input.text().strip()
         if not check:
             self.text_edit.append("Please enter a username to connect.")
             return
         
         self.username = self.username_input.text().strip()
-        if self.client_socket:
-            try:
-                self.client_socket.close()
-            except:
-                pass
-            self.client_socket = None
-        try:
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((self.host, self.port))
-            self.text_edit.append(f"Connected to server at {self.host}:{self.port}")
-            self.connect_button.setEnabled(False)
-            self.disconnect_button.setEnabled(True)
-            self.username_input.setEnabled(False)
-            self.running = True
-            self.is_disconnected = False
-        except Exception as e:
-            self.text_edit.append(f"Error connecting to server: {e}")
-            self.client_socket = None
-            return
-            
+        if self.transport:
+            self.transport.close()
+        self.transport = ClientTransport(self, self.host, self.port)
+        self.is_disconnected = False
+        self.connect_button.setEnabled(False)
+        self.username_input.setEnabled(False)
+        self.text_edit.append(f"Connecting to server at {self.host}:{self.port}...")
+        self.transport.start()
+
+        # Queued until the connection is up
         self.send_message({
             "Command": "Check_Username",
             "User_Name": self.username
         })
-        
-        threading.Thread(target=self.receive_messages, daemon=True).start()
+
+    def on_connected(self, text):
+        """Handle the transport finishing its connection"""
+        self.text_edit.append(text)
+        self.disconnect_button.setEnabled(True)
+
+    def on_connect_failed(self, text):
+        """Handle the transport failing to connect"""
+        self.text_edit.append(text)
+        if self.resuming:
+            self.schedule_reconnect()
+            return
+        self.transport = None
+        self.is_disconnected = True
+        self.connect_button.setEnabled(True)
+        self.username_input.setEnabled(True)
+
+    def connection_lost(self):
+        """Try to resume the session when the server goes away, e.g. for a restart"""
+        if self.is_disconnected or self.reconnect_token is None:
+            self.disconnect()
+            return
+        self.text_edit.append("Lost connection to the server, trying to resume...")
+        if self.transport:
+            self.transport.close()
+        self.resuming = True
+        self.reconnect_attempt = 0
+        self.schedule_reconnect()
+
+    def schedule_reconnect(self):
+        if self.reconnect_attempt >= len(RECONNECT_DELAYS):
+            self.text_edit.append("Could not resume the session.")
+            self.resuming = False
+            self.reconnect_token = None
+            self.disconnect()
+            return
+        # Jitter spreads the reconnects of every client of a restarted server
+        delay = RECONNECT_DELAYS[self.reconnect_attempt] * random.uniform(0.5, 1.5)
+        self.reconnect_attempt += 1
+        QTimer.singleShot(int(delay * 1000), self.resume_session)
+
+    def move_server(self, delay):
+        """Reconnect after delay seconds to the server taking over from the current one"""
+        if self.is_disconnected or self.reconnect_token is None:
+            return
+        self.text_edit.append("The server is being upgraded; moving to the new one...")
+        self.resuming = True
+        self.reconnect_attempt = 0
+        QTimer.singleShot(int(delay * random.uniform(1.0, 1.2) * 1000), self.resume_session)
+
+    def resume_session(self):
+        if not self.resuming or self.is_disconnected:
+            return
+        if self.transport:
+            self.transport.close()
+        self.transport = ClientTransport(self, self.host, self.port)
+        if self.chatroom:
+            self.chatroom.transport = self.transport
+        self.transport.start()
+        self.send_message({
+            "Command": "Check_Username",
+            "User_Name": self.username,
+            "Token": self.reconnect_token
+        })
 
     def disconnect(self):
         """Disconnect from the server."""
         if self.is_disconnected:
             return
-        self.running = False
         self.is_disconnected = True
-        if self.client_socket:
-            try:
-                self.client_socket.close()
-            except:
-                pass
-            self.client_socket = None
+        self.resuming = False
+        self.reconnect_token = None
+        if self.transport:
+            self.transport.close()
+            self.transport = None
         self.connect_button.setEnabled(True)
         self.disconnect_button.setEnabled(False)
         self.username_input.setEnabled(True)
         self.room_selector.setEnabled(False)
         self.create_room_button.setEnabled(False)
         self.join_room_button.setEnabled(False)
+        self.quick_match_button.setEnabled(False)
+        self.in_match_queue = False
+        self.quick_match_button.setText("Quick Match")
         self.text_edit.append("Disconnected from server.")
         if self.chatroom:
             self.chatroom.close()
             self.chatroom = None
 
-    def receive_messages(self):
-        """Receive messages from the server in a separate thread."""
-        while self.running and self.client_socket:
-            try:
-                data = self.client_socket.recv(1048576)
-                if not data:
-                    QCoreApplication.postEvent(self, MessageEvent("status", "Server disconnected."))
-                    self.disconnect()
-                    break
-                message = pickle.loads(data)
-                if message:
-                    print(f"Processing message: {message}")
-                    if message["Command"] in ["Join_Room", "Sending_Message"]:
-                        QCoreApplication.postEvent(self, MessageEvent("chat", message))
-                    elif message["Command"] in ["Room_State", "Check_Username"]:
-                        QCoreApplication.postEvent(self, MessageEvent("rooms", message))
-                    elif message["Command"] in ["Ready_Update", "Game_Start", "Game_Update", "Game_Over", "Game_Restart"]:
-                        QCoreApplication.postEvent(self, MessageEvent("game", message))
-                    else:
-                        QCoreApplication.postEvent(self, MessageEvent("status", f"Unknown command received: {message['Command']}"))
-            except socket.error as e:
-                if self.running and e.errno == errno.WSAEWOULDBLOCK:
-                    continue
-                if self.running:
-                    QCoreApplication.postEvent(self, MessageEvent("status", f"Error receiving message: {e}"))
-                    self.disconnect()
-                break
-
     def customEvent(self, event):
         """Handle custom events for thread-safe UI updates."""
         if event.type() == MessageEvent.EventType:
@@ -908,6 +1500,16 @@ class ClientMenu(QMainWindow):
                 self.process_status_update(event.data)
             elif event.message_type == "game":
                 self.process_game_update(event.data)
+            elif event.message_type == "limit":
+                self.process_status_update(f"Slow down! {event.data['Rejected_Command']} is limited, try again in {event.data['Retry_After']}s.")
+                if event.data.get("Move_Seq") is not None and self.chatroom:
+                    self.chatroom.handle_move_dropped(event.data["Room_Name"], event.data["Move_Seq"])
+            elif event.message_type == "connected":
+                self.on_connected(event.data)
+            elif event.message_type == "connect_failed":
+                self.on_connect_failed(event.data)
+            elif event.message_type == "disconnected":
+                self.connection_lost()
 
     def process_chat_update(self, message):
         """Handle chat message updates."""
@@ -922,9 +1524,13 @@ class ClientMenu(QMainWindow):
                     print(f"Creating New_chat_room for {room_name} with users {list_of_users}")
                     if self.chatroom:
                         self.chatroom.close()
-                    self.chatroom = New_game_room(self.username, room_name, list_of_users, self.client_socket)   
+                    self.chatroom = New_game_room(self.username, room_name, list_of_users, self.transport)   
                     self.alreadyinroom = True
                 
+            elif message["Command"] == "Chat_Backlog":
+                if self.chatroom and self.chatroom.room_name == message["Room_Name"]:
+                    self.chatroom.load_backlog(message["Messages"])
+
             elif message["Command"] == "Sending_Message":
                 room_name = message["Room_Name"]
                 text = message["Text"]
@@ -943,16 +1549,38 @@ class ClientMenu(QMainWindow):
         try:
             if message["Command"] == "Check_Username":
                 self.list_of_users_in_room = message["Users_In_Room"]
+                self.reconnect_token = message.get("Token")
+                if self.resuming:
+                    self.resuming = False
+                    if message.get("Resumed"):
+                        self.text_edit.append("Session resumed.")
+                    elif self.chatroom:
+                        self.text_edit.append("Session expired; your seats were released.")
+                        self.chatroom.close()
+                        self.chatroom = None
+                        self.alreadyinroom = False
+                    else:
+                        self.text_edit.append("Reconnected to the server.")
                 self.text_edit.append(f"Username {self.username} is valid.")
                 self.room_selector.setEnabled(True)
                 self.join_room_button.setEnabled(True)
                 self.create_room_button.setEnabled(True)
+                self.quick_match_button.setEnabled(True)
                 self.room_input.setEnabled(True)
                 self.send_message({
                     "Command": "Request_Room_State",
                     "User_Name": self.username,
                     "Users_In_Room": self.list_of_users_in_room
                 })
+                self.send_message({
+                    "Command": "Request_Rating",
+                    "User_Name": self.username
+                })
+                self.send_message({
+                    "Command": "Request_Leaderboard",
+                    "User_Name": self.username,
+                    "Count": 5
+                })
             elif message["Command"] == "Room_State":
                 new_rooms = set(message["Available_Rooms"])
                 old_rooms = set(self.list_of_available_rooms)
@@ -971,6 +1599,30 @@ class ClientMenu(QMainWindow):
                 self.join_room_button.setEnabled(True)
                 self.create_room_button.setEnabled(True)
                 self.room_input.setEnabled(True)
+            elif message["Command"] == "Server_Moving":
+                self.move_server(message["Delay"])
+            elif message["Command"] == "Queue_Status":
+                status = message["Status"]
+                self.in_match_queue = status == "Queued"
+                self.quick_match_button.setText("Leave Queue" if self.in_match_queue else "Quick Match")
+                if status == "Queued":
+                    self.text_edit.append(f"Searching for an opponent... ({message['Queue_Size']} in queue)")
+                elif status == "Matched":
+                    self.text_edit.append(f"Opponent found! Joining {message['Room_Name']}")
+                elif status == "Full":
+                    self.text_edit.append("The match queue is full; try again in a moment.")
+                else:
+                    self.text_edit.append("Left the match queue.")
+            elif message["Command"] == "Rating":
+                if message["Rank"] is None:
+                    self.text_edit.append(f"Your rating: {message['Rating']} (unranked)")
+                else:
+                    self.text_edit.append(f"Your rating: {message['Rating']} (rank {message['Rank']} of {message['Total_Players']})")
+            elif message["Command"] == "Leaderboard":
+                if message["Entries"]:
+                    self.text_edit.append("Leaderboard:")
+                    for rank, player, rating in message["Entries"]:
+                        self.text_edit.append(f"  {rank}. {player} ({rating})")
                 
         except Exception as e:
             QCoreApplication.postEvent(self, MessageEvent("status", f"Error processing room update: {e}"))
@@ -990,6 +1642,12 @@ class ClientMenu(QMainWindow):
                     self.chatroom.handle_game_over(message["Winner"], message["Game_State"])
                 elif message["Command"] == "Game_Restart":
                     self.chatroom.handle_game_restart(message["Ready_Users"])
+                elif message["Command"] == "Move_Rejected":
+                    self.chatroom.handle_move_rejected(message["Move_Seq"], message["Game_State"])
+                elif message["Command"] == "Takeback_Request":
+                    self.chatroom.handle_takeback_request(message["User_Name"])
+                elif message["Command"] == "Takeback":
+                    self.chatroom.handle_takeback(message["User_Name"], message["Accepted"], message["Game_State"])
         except Exception as e:
             QCoreApplication.postEvent(self, MessageEvent("status", f"Error processing game update: {e}"))
 
@@ -1001,13 +1659,18 @@ class ClientMenu(QMainWindow):
         """Create a new room and send request to server"""
         current_room = self.room_input.text().strip()
         if current_room:
+            variant = self.variant_selector.currentText()
+            rows, columns, connect = rules.VARIANTS[variant]
             message = {
                 "Command": "Create_Room",
                 "Room_Name": current_room,
-                "User_Name": self.username
+                "User_Name": self.username,
+                "Rows": rows,
+                "Columns": columns,
+                "Connect": connect
             }
             self.send_message(message)
-            self.text_edit.append(f"Requested creation of room {current_room}")
+            self.text_edit.append(f"Requested creation of room {current_room} ({variant})")
         else:
             self.text_edit.append("Please enter a room name to create.")
             
@@ -1034,6 +1697,21 @@ class ClientMenu(QMainWindow):
         else:
             self.text_edit.append("Please enter a room name to join.")
      
+    def Queue_for_match(self):
+        """Join or leave the matchmaking queue"""
+        if self.in_match_queue:
+            self.send_message({
+                "Command": "Leave_Queue",
+                "User_Name": self.username
+            })
+        elif self.alreadyinroom:
+            self.text_edit.append("Leave your current room before looking for a match.")
+        else:
+            self.send_message({
+                "Command": "Queue_For_Match",
+                "User_Name": self.username
+            })
+
     def Choose_room(self):
         """Handle room selection from the combo box."""
         selected_room = self.room_selector.currentText()
@@ -1044,23 +1722,9 @@ class ClientMenu(QMainWindow):
             self.join_room_button.setEnabled(False)   
                 
     def send_message(self, message):
-        """Send a message to the server."""
-        if self.client_socket and self.running and not self.is_disconnected:
-            try:
-                self.client_socket.setblocking(True)
-                data = pickle.dumps(message)
-                self.client_socket.sendall(data)
-            except socket.error as e:
-                if e.errno == errno.WSAEWOULDBLOCK:
-                    pass
-                else:
-                    print(f"Error sending message: {e}")
-                    QCoreApplication.postEvent(self, MessageEvent("status", f"Error sending message: {e}"))
-                    self.disconnect()
-            except Exception as e:
-                print(f"Error sending message: {e}")
-                QCoreApplication.postEvent(self, MessageEvent("status", f"Error sending message: {e}"))
-                self.disconnect()
+        """Queue a message for the server; never blocks the GUI."""
+        if self.transport and not self.is_disconnected:
+            self.transport.send(message)
 
     def closeEvent(self, event):
         """Handle window close event."""
@@ -1071,5 +1735,6 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     client_menu = ClientMenu("127.0.0.1", 12345)
     client_menu.show()
+    QTimer.singleShot(0, lambda: print(f"Lobby ready after {(time.perf_counter() - STARTED_AT) * 1000:.1f} ms"))
     sys.exit(app.exec_())
             
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""Server settings from built-in defaults, a TOML file, the environment and command-line flags.
+
+Later layers override earlier ones: defaults, then the TOML file named by
+--config (or C4_CONFIG), then C4_<KEY> environment variables such as
+C4_PORT, then flags such as --port. Every key lives in one TOML section:
+
+    [server]
+    port = 12346
+    log_level = "info"
+
+    [limits.commands]
+    Game_Move = [8.0, 16]
+
+The merged settings are validated before the server binds, so a typo or an
+out-of-range value stops it at startup rather than under load. Paths are
+settings too, so several instances can run side by side from one directory.
+"""
+import os
+import socket
+import tomllib
+
+import evaluation
+import handoff
+import protocol
+import ratelimit
+
+ENV_PREFIX = "C4_"
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LOG_LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+
+# section -> key -> (default, type, minimum); a minimum of None means any value
+SCHEMA = {
+    "server": {
+        "host": ("127.0.0.1", str, None),
+        "port": (12345, int, 0),
+        "backlog": (socket.SOMAXCONN, int, 1),
+        "recv_buffer": (65536, int, 1024),
+        "max_frame_size": (protocol.MAX_FRAME_SIZE, int, 1024),
+        "log_level": ("debug", str, None),
+        "handoff_path": (handoff.HANDOFF_PATH, str, None),
+    },
+    "workers": {
+        "ai_workers": (0, int, 0),  # 0 uses every core but one
+        "ai_niceness": (10, int, 0),
+    },
+    "queue": {
+        "max_queued": (0, int, 0),  # Players waiting for a quick match; 0 means no limit
+        "bucket_width": (50, int, 1),
+        "base_range": (100, int, 0),
+        "widen_rate": (25.0, float, 0),
+        "max_range": (800, int, 0),
+        "tick_interval": (0.25, float, 0.01),
+    },
+    "limits": {
+        "connection_rate": (ratelimit.DEFAULT_CONNECTION_LIMIT[0], float, 0.001),
+        "connection_burst": (ratelimit.DEFAULT_CONNECTION_LIMIT[1], int, 1),
+    },
+    "persistence": {
+        "ratings_path": ("ratings.dat", str, None),
+        "rating_period": (2.0, float, 0.01),
+        "rating_snapshot_interval": (60.0, float, 0.01),
+        "snapshot_path": ("rooms.snapshot", str, None),
+        "snapshot_interval": (2.0, float, 0.01),
+        "chat_history_dir": ("chat_history", str, None),
+    },
+    "tracing": {
+        "slow_request_ms": (50.0, float, 0),  # Requests slower than this are logged; 0 turns it off
+        "trace_path": ("", str, None),  # Chrome trace JSON written on shutdown; empty means none
+        "trace_max_events": (200000, int, 1000),
+    },
+    "ai": {},
+}
+for _tier, (_depth, _budget, _noise) in evaluation.TIERS.items():
+    SCHEMA["ai"][f"{_tier}_depth"] = (_depth, int, 1)
+    SCHEMA["ai"][f"{_tier}_budget"] = (_budget, float, 0.0001)  # Seconds per move
+
+# Keys are unique across sections, so flags and environment variables need no section prefix
+KEY_SECTIONS = {key: section for section, keys in SCHEMA.items() for key in keys}
+assert len(KEY_SECTIONS) == sum(len(keys) for keys in SCHEMA.values())
+
+
+class ConfigError(ValueError):
+    """Raised when a setting is unknown, has the wrong type or is out of range"""
+
+
+def defaults():
+    """The built-in settings as {section: {key: value}}"""
+    settings = {section: {key: spec[0] for key, spec in keys.items()} for section, keys in SCHEMA.items()}
+    settings["limits"]["commands"] = dict(ratelimit.DEFAULT_COMMAND_LIMITS)
+    return settings
+
+
+def convert(key, value, source):
+    """Check one value against the schema, parsing it first if it came in as text"""
+    default, kind, minimum = SCHEMA[KEY_SECTIONS[key]][key]
+    if isinstance(value, str) and kind is not str:
+        try:
+            value = kind(value)
+        except ValueError:
+            raise ConfigError(f"{source}: {key} must be {kind.__name__}, got {value!r}") from None
+    if kind is float and isinstance(value, int) and not isinstance(value, bool):
+        value = float(value)
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise ConfigError(f"{source}: {key} must be {kind.__name__}, got {value!r}")
+    if minimum is not None and value < minimum:
+        raise ConfigError(f"{source}: {key} must be at least {minimum}, got {value}")
+    return value
+
+
+def convert_commands(table, source):
+    """Validate [limits.commands], a table of command name -> [rate, burst]"""
+    if not isinstance(table, dict):
+        raise ConfigError(f"{source}: limits.commands must be a table")
+    limits = {}
+    for command, limit in table.items():
+        if command not in ratelimit.DEFAULT_COMMAND_LIMITS:
+            raise ConfigError(f"{source}: unknown command {command!r} in limits.commands")
+        if (not isinstance(limit, list) or len(limit) != 2
+                or not all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in limit)
+                or limit[0] <= 0 or limit[1] < 1):
+            raise ConfigError(f"{source}: limits.commands.{command} must be [rate > 0, burst >= 1]")
+        limits[command] = (float(limit[0]), int(limit[1]))
+    return limits
+
+
+def read_file(path, settings):
+    """Merge a TOML file into settings"""
+    try:
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    except OSError as e:
+        raise ConfigError(f"Cannot read config file {path}: {e}") from None
+    except tomllib.TOMLDecodeError as e:
+        raise ConfigError(f"{path}: {e}") from None
+    for section, values in data.items():
+        if section not in SCHEMA or not isinstance(values, dict):
+            raise ConfigError(f"{path}: unknown section [{section}]")
+        for key, value in values.items():
+            if section == "limits" and key == "commands":
+                settings["limits"]["commands"].update(convert_commands(value, path))
+            elif KEY_SECTIONS.get(key) != section:
+                raise ConfigError(f"{path}: unknown setting {key!r} in [{section}]")
+            else:
+                settings[section][key] = convert(key, value, path)
+
+
+def add_arguments(parser):
+    """Add --config and one flag per setting to an argparse parser"""
+    parser.add_argument("--config", help="TOML file of settings (default: $C4_CONFIG)")
+    for key, section in KEY_SECTIONS.items():
+        parser.add_argument("--" + key.replace("_", "-"), dest=key, metavar=key.upper(),
+                            help=f"[{section}] {key} (default: {SCHEMA[section][key][0]})")
+
+
+def load_config(args=None, environ=None):
+    """Merge defaults, the config file, the environment and parsed flags; raises ConfigError"""
+    environ = os.environ if environ is None else environ
+    settings = defaults()
+    path = getattr(args, "config", None) or environ.get(ENV_PREFIX + "CONFIG")
+    if path:
+        read_file(path, settings)
+    for key, section in KEY_SECTIONS.items():
+        name = ENV_PREFIX + key.upper()
+        if name in environ:
+            settings[section][key] = convert(key, environ[name], name)
+    for key, section in KEY_SECTIONS.items():
+        value = getattr(args, key, None)
+        if value is not None:
+            settings[section][key] = convert(key, value, "--" + key.replace("_", "-"))
+    validate(settings)
+    return settings
+
+
+def validate(settings):
+    """Checks that involve more than one setting or a fixed set of choices"""
+    server = settings["server"]
+    if server["port"] > 65535:
+        raise ConfigError(f"port must be at most 65535, got {server['port']}")
+    if server["log_level"] not in LOG_LEVELS:
+        raise ConfigError(f"log_level must be one of {', '.join(LOG_LEVELS)}, got {server['log_level']!r}")
+    queue = settings["queue"]
+    if queue["base_range"] > queue["max_range"]:
+        raise ConfigError("base_range must not be larger than max_range")
+    if queue["bucket_width"] > queue["base_range"]:
+        # Players sharing a bucket are paired without a range check
+        raise ConfigError("bucket_width must not be larger than base_range")
+    persistence = settings["persistence"]
+    paths = [server["handoff_path"], persistence["ratings_path"], persistence["snapshot_path"],
+             persistence["chat_history_dir"]]
+    if settings["tracing"]["trace_path"]:
+        paths.append(settings["tracing"]["trace_path"])
+    if len(set(paths)) != len(paths):
+        raise ConfigError("handoff_path, ratings_path, snapshot_path, chat_history_dir and trace_path must differ")
+
+
+def connection_limit(settings):
+    return (settings["limits"]["connection_rate"], settings["limits"]["connection_burst"])
+
+
+def ai_tiers(settings):
+    """evaluation.TIERS with the configured depths and budgets"""
+    ai = settings["ai"]
+    return {tier: (ai[f"{tier}_depth"], ai[f"{tier}_budget"], noise)
+            for tier, (_, _, noise) in evaluation.TIERS.items()}
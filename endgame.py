@@ -0,0 +1,219 @@
+"""Endgame table: win/draw/loss for positions with few empty cells.
+
+Every position reachable from the seed positions with at most K empty cells
+is solved by walking its whole subtree, which is small that close to a full
+board. The table is a sorted array of canonical Zobrist keys followed by the
+results packed four to a byte, so a probe is a binary search over an mmap.
+Results are for the side to move; mirror images share an entry because the
+result does not depend on orientation.
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+import time
+
+import rules
+import zobrist
+
+MAGIC = b"C4EG"
+HEADER = struct.Struct("<4sBBBBI")  # magic, rows, columns, connect, max empty cells, position count
+KEY = struct.Struct("<Q")
+TABLE_PATH = "endgame.dat"
+MAX_POSITIONS = 2000000
+
+# Two-bit results; 0 never appears in a table
+LOSS = 1
+DRAW = 2
+WIN = 3
+
+
+class EndgameTable:
+    def __init__(self, path=TABLE_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, rows, columns, connect, self.max_empty, self.count = HEADER.unpack_from(self.data, 0)
+        self.results_offset = HEADER.size + self.count * KEY.size
+        if magic != MAGIC or len(self.data) != self.results_offset + (self.count + 3) // 4:
+            self.data.close()
+            raise ValueError(f"{path} is not an endgame table")
+        self.rules = rules.get_rules(rows, columns, connect)
+        self.min_moves = self.rules.cells - self.max_empty  # Positions with fewer chips are never stored
+
+    def probe(self, canonical):
+        """LOSS, DRAW or WIN for the side to move, or 0 if the position is not in the table"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            key = KEY.unpack_from(self.data, HEADER.size + middle * KEY.size)[0]
+            if key < canonical:
+                low = middle + 1
+            elif key > canonical:
+                high = middle
+            else:
+                return (self.data[self.results_offset + middle // 4] >> (2 * (middle % 4))) & 3
+        return 0
+
+    def close(self):
+        self.data.close()
+
+
+def load_table(path=TABLE_PATH):
+    """Open the table if it exists; a missing or broken table just means no probes"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return EndgameTable(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Error loading endgame table {path}: {e}")
+        return None
+
+
+class Builder:
+    """Solves whole subtrees near a full board, remembering every position it visits"""
+
+    def __init__(self, geometry, max_empty, max_positions=MAX_POSITIONS):
+        self.rules = geometry
+        self.max_empty = max_empty
+        self.max_positions = max_positions
+        self.results = {}  # canonical key -> result
+        self.column_masks = [((1 << geometry.rows) - 1) << (col * geometry.height)
+                             for col in range(geometry.columns)]
+        table = zobrist.get_table(geometry)
+        self.cell_keys = table.cell_keys
+        self.mirror_keys = table.mirror_keys
+
+    def add_game(self, columns):
+        """Add the subtree below the position K cells short of full in a game given as columns.
+
+        Returns False once the position limit is reached.
+        """
+        geometry = self.rules
+        if len(self.results) >= self.max_positions:
+            return False
+        moves_needed = geometry.cells - self.max_empty
+        if len(columns) < moves_needed:
+            return True
+        current = mask = key = mirror_key = 0
+        player_id = 0
+        for col in columns[:moves_needed]:
+            move = (mask + (1 << (col * geometry.height))) & self.column_masks[col]
+            if not move or geometry.has_line(current | move):
+                return True  # Illegal or finished before reaching the endgame
+            index = (mask & self.column_masks[col]).bit_count() * geometry.columns + col
+            key ^= self.cell_keys[player_id][index]
+            mirror_key ^= self.mirror_keys[player_id][index]
+            current, mask, player_id = current ^ mask, mask | move, 1 - player_id
+        self.solve(current, mask, player_id, key, mirror_key)
+        return True
+
+    def solve(self, current, mask, player_id, key, mirror_key):
+        canonical = key if key < mirror_key else mirror_key
+        result = self.results.get(canonical)
+        if result:
+            return result
+        geometry = self.rules
+        possible = (mask + geometry.bottom_mask) & geometry.board_mask
+        best = LOSS
+        # Every child is visited, even after a win is found, so the table holds all of them
+        for col in range(geometry.columns):
+            move = possible & self.column_masks[col]
+            if not move:
+                continue
+            if geometry.has_line(current | move):
+                best = WIN
+                continue
+            child_mask = mask | move
+            if child_mask == geometry.board_mask:
+                value = DRAW
+            else:
+                index = (mask & self.column_masks[col]).bit_count() * geometry.columns + col
+                value = 4 - self.solve(current ^ mask, child_mask, 1 - player_id,
+                                       key ^ self.cell_keys[player_id][index],
+                                       mirror_key ^ self.mirror_keys[player_id][index])
+            if value > best:
+                best = value
+        self.results[canonical] = best
+        return best
+
+    def size(self):
+        """Bytes the table takes on disk"""
+        count = len(self.results)
+        return HEADER.size + count * KEY.size + (count + 3) // 4
+
+    def write(self, path):
+        keys = sorted(self.results)
+        packed = bytearray((len(keys) + 3) // 4)
+        for i, key in enumerate(keys):
+            packed[i // 4] |= self.results[key] << (2 * (i % 4))
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.rules.rows, self.rules.columns, self.rules.connect,
+                                self.max_empty, len(keys)))
+            f.write(struct.pack(f"<{len(keys)}Q", *keys))
+            f.write(packed)
+        os.replace(temp_path, path)
+
+
+def random_games(count, seed=1, geometry=rules.STANDARD):
+    """Games that avoid winning moves for as long as possible, so most of them run long"""
+    rng = random.Random(seed)
+    height = geometry.height
+    for _ in range(count):
+        current = mask = 0
+        columns = []
+        while True:
+            playable = []
+            for col in range(geometry.columns):
+                move = (mask + (1 << (col * height))) & (((1 << geometry.rows) - 1) << (col * height))
+                if move and not geometry.has_line(current | move):
+                    playable.append((col, move))
+            if not playable:
+                break
+            col, move = rng.choice(playable)
+            columns.append(col)
+            current, mask = current ^ mask, mask | move
+        yield columns
+
+
+def read_games(path):
+    """Stored games, one per line as 1-based columns like "4453..." """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield [int(char) - 1 for char in line]
+
+
+def build_table(path=TABLE_PATH, max_empty=6, games=None, max_positions=MAX_POSITIONS, geometry=rules.STANDARD):
+    """Solve the endgames of games (random ones by default); returns (positions, bytes)
+
+    The table is written to path unless path is None.
+    """
+    builder = Builder(geometry, max_empty, max_positions)
+    for columns in games if games is not None else random_games(1000, geometry=geometry):
+        if not builder.add_game(columns):
+            break
+    if path is not None:
+        builder.write(path)
+    return len(builder.results), builder.size()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the endgame table the solver probes near a full board")
+    parser.add_argument("--path", default=TABLE_PATH)
+    parser.add_argument("--empty", type=int, default=6, help="Store positions with up to this many empty cells")
+    parser.add_argument("--games", help="File of stored games to take endgames from, one per line")
+    parser.add_argument("--random-games", type=int, default=1000, help="Random games to use without --games")
+    parser.add_argument("--max-positions", type=int, default=MAX_POSITIONS)
+    args = parser.parse_args()
+    # Build every size up to the requested one so the growth with K is visible
+    for max_empty in range(1, args.empty + 1):
+        games = read_games(args.games) if args.games else random_games(args.random_games)
+        path = args.path if max_empty == args.empty else None
+        started = time.perf_counter()
+        count, size = build_table(path, max_empty, games, args.max_positions)
+        elapsed = time.perf_counter() - started
+        print(f"K={max_empty}: {count:,} positions, {size:,} bytes, {elapsed:.2f} s")
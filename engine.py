@@ -0,0 +1,149 @@
+import random
+
+import rules
+import zobrist
+
+class Connect4Game:
+    def __init__(self, room_name, players, rows=rules.ROWS, columns=rules.COLUMNS, connect=rules.CONNECT):
+        self.room_name = room_name
+        self.players = players  # List of usernames
+        self.rules = rules.get_rules(rows, columns, connect)
+        self.ROWS = rows
+        self.COLUMNS = columns
+        self.CONNECT = connect
+        self.grid = [[None for i in range(self.COLUMNS)] for j in range(self.ROWS)]
+        self.current_player = 0
+        self.game_over = False
+        self.winner = None
+        self.winning_line = None  # Cells of the completed line once someone has won
+        self.move_count = 0  # Sequence number of the last accepted move
+        self.zobrist = zobrist.get_table(self.rules)
+        self.key = 0  # Zobrist key of the grid, kept up to date by add_chip
+        self.mirror_key = 0  # Key of the grid mirrored left to right
+        self.heights = [0] * self.COLUMNS  # Chips in each column
+        self.moves = []  # Columns played, in order; undo() pops from here
+        self.undone = []  # Columns taken back, most recent last; redo() pops from here
+        
+        # Randomly assign player IDs
+        random.shuffle(self.players)
+        print(f"Game started in room {room_name}: {self.players[0]} (Red) vs {self.players[1]} (Yellow)")
+
+    @classmethod
+    def from_state(cls, room_name, game_state):
+        """Rebuild a game from a get_game_state() snapshot, e.g. on the client"""
+        game = cls.__new__(cls)
+        game.room_name = room_name
+        game.players = list(game_state["players"])
+        game.ROWS = len(game_state["grid"])
+        game.COLUMNS = len(game_state["grid"][0])
+        game.CONNECT = game_state.get("connect", rules.CONNECT)
+        game.rules = rules.get_rules(game.ROWS, game.COLUMNS, game.CONNECT)
+        game.grid = [list(row) for row in game_state["grid"]]
+        game.current_player = game_state["current_player_id"]
+        game.game_over = game_state["game_over"]
+        game.winner = game_state["winner"]
+        game.winning_line = game_state.get("winning_line")
+        game.move_count = game_state["move_count"]
+        game.zobrist = zobrist.get_table(game.rules)
+        game.key, game.mirror_key = game.zobrist.keys(game.grid)
+        game.heights = [sum(row[col] is not None for row in game.grid) for col in range(game.COLUMNS)]
+        game.moves = []  # The snapshot has no history, so there is nothing to undo
+        game.undone = []
+        return game
+
+    def add_chip(self, player_username, column):
+        """Add a chip to the board and return the row it landed in, or -1 if invalid"""
+        if self.game_over:
+            return -1
+            
+        # Check if it's the correct player's turn
+        if self.players[self.current_player] != player_username:
+            return -1
+
+        if not 0 <= column < self.COLUMNS or self.heights[column] == self.ROWS:
+            return -1
+
+        self.undone.clear()  # A new move ends the redo history
+        return self.make_move(column)
+
+    def make_move(self, column):
+        """Drop the current player's chip into a column that has room; returns the row"""
+        player_id = self.current_player
+        row = self.heights[column]
+        self.grid[row][column] = player_id
+        self.heights[column] = row + 1
+        self.moves.append(column)
+        self.move_count += 1
+        index = row * self.COLUMNS + column
+        self.key ^= self.zobrist.cell_keys[player_id][index]
+        self.mirror_key ^= self.zobrist.mirror_keys[player_id][index]
+
+        # Only lines through the new chip can have been completed
+        self.winning_line = self.rules.winning_line(self.grid, row, column)
+        if self.winning_line is not None:
+            self.game_over = True
+            self.winner = self.players[player_id]
+        elif self.move_count == self.ROWS * self.COLUMNS:
+            # Board is full: a draw
+            self.game_over = True
+        else:
+            # Switch players
+            self.current_player = 1 - player_id
+        return row
+
+    def undo(self):
+        """Take back the last move; returns its column, or None if there is no history.
+
+        Clears the chip and restores the key, heights and turn in place,
+        without copying the grid.
+        """
+        if not self.moves:
+            return None
+        column = self.moves.pop()
+        # A finished game did not pass the turn, so the mover is still current
+        player_id = self.current_player if self.game_over else 1 - self.current_player
+        row = self.heights[column] - 1
+        self.grid[row][column] = None
+        self.heights[column] = row
+        self.move_count -= 1
+        index = row * self.COLUMNS + column
+        self.key ^= self.zobrist.cell_keys[player_id][index]
+        self.mirror_key ^= self.zobrist.mirror_keys[player_id][index]
+        self.current_player = player_id
+        self.game_over = False
+        self.winner = None
+        self.winning_line = None
+        self.undone.append(column)
+        return column
+
+    def redo(self):
+        """Replay the last move taken back; returns its row, or -1 if there is none"""
+        if not self.undone:
+            return -1
+        return self.make_move(self.undone.pop())
+
+    def position_key(self):
+        """Stable 64-bit Zobrist key of the current grid"""
+        return self.key
+
+    def canonical_key(self):
+        """Key shared by this position and its left-right mirror image"""
+        return zobrist.canonical_key(self.key, self.mirror_key)
+
+    def check_win(self, player_id):
+        """Check if the given player has won"""
+        return self.rules.check_win(self.grid, player_id)
+
+    def get_game_state(self):
+        """Return the current game state"""
+        return {
+            "grid": [list(row) for row in self.grid],
+            "connect": self.CONNECT,
+            "current_player": self.players[self.current_player] if not self.game_over else None,
+            "current_player_id": self.current_player,
+            "game_over": self.game_over,
+            "winner": self.winner,
+            "winning_line": self.winning_line,
+            "players": self.players,
+            "move_count": self.move_count
+        }
@@ -0,0 +1,296 @@
+import itertools
+import random
+import time
+
+import rules
+import zobrist
+
+WIN_SCORE = 1000000
+INFINITY = 10 * WIN_SCORE
+
+# Heuristic weights, in points for the side being scored
+THREE_SCORE = 50  # A line one chip short of complete, the rest empty
+TWO_SCORE = 5  # A line two chips short of complete, the rest empty
+CENTER_SCORE = 3  # Per chip in the center column
+PARITY_SCORE = 40  # Extra for a three whose empty cell is on the owner's good row parity
+
+# Search tiers: (max depth, time budget in seconds, random noise added to root scores)
+TIERS = {
+    "easy": (2, 0.001, 30),
+    "medium": (4, 0.005, 0),
+    "hard": (8, 0.050, 0),
+}
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class Tables:
+    """Per-geometry scoring tables, indexed by the sum of a window's cells.
+
+    Cells hold 0 when empty and rules.pieces[player] otherwise, so on the
+    standard board a window sum of 3 is three chips of player 0 and an empty
+    cell, 15 three of player 1, and 6 or 7 a mixed window nobody can complete.
+    """
+
+    def __init__(self, geometry):
+        self.rules = geometry
+        connect = geometry.connect
+        low, high = geometry.pieces
+        self.window_score = [0] * (connect * high + 1)  # window sum -> score for player 0
+        self.is_three = [False] * (connect * high + 1)
+        for player, piece, sign in ((0, low, 1), (1, high, -1)):
+            self.window_score[(connect - 2) * piece] += sign * TWO_SCORE
+            self.window_score[(connect - 1) * piece] += sign * THREE_SCORE
+            self.is_three[(connect - 1) * piece] = True
+        self.center = geometry.columns // 2
+        self.center_columns = (self.center,) if geometry.columns % 2 else (self.center - 1, self.center)
+
+
+_tables_cache = {}
+
+
+def get_tables(geometry):
+    tables = _tables_cache.get(geometry)
+    if tables is None:
+        tables = _tables_cache.setdefault(geometry, Tables(geometry))
+    return tables
+
+
+class Position:
+    """Mutable board for search: flat cells, column heights and the side to move"""
+
+    def __init__(self, cells=None, to_move=0, geometry=rules.STANDARD):
+        self.rules = geometry
+        self.tables = get_tables(geometry)
+        self.columns = geometry.columns
+        self.rows = geometry.rows
+        self.cells = cells if cells is not None else [0] * geometry.cells
+        self.heights = [0] * self.columns
+        for col in range(self.columns):
+            while self.heights[col] < self.rows and self.cells[self.heights[col] * self.columns + col]:
+                self.heights[col] += 1
+        self.to_move = to_move
+        self.move_count = sum(1 for cell in self.cells if cell)
+        self.zobrist = zobrist.get_table(geometry)
+        # Hot-path tables copied onto the position so play() and undo() avoid attribute chains
+        self.pieces = geometry.pieces
+        self.connect = geometry.connect
+        self.cell_windows = geometry.cell_windows
+        self.cell_keys = self.zobrist.cell_keys
+        self.mirror_keys = self.zobrist.mirror_keys
+        self.key = 0
+        self.mirror_key = 0
+        for index, cell in enumerate(self.cells):
+            if cell:
+                player_id = 0 if cell == geometry.pieces[0] else 1
+                self.key ^= self.zobrist.cell_keys[player_id][index]
+                self.mirror_key ^= self.zobrist.mirror_keys[player_id][index]
+
+    def copy(self):
+        return Position(list(self.cells), self.to_move, self.rules)
+
+    @classmethod
+    def from_game_state(cls, game_state):
+        grid = game_state["grid"]
+        geometry = rules.rules_for_grid(grid, game_state.get("connect", rules.CONNECT))
+        cells = [0 if cell is None else geometry.pieces[cell] for row in grid for cell in row]
+        return cls(cells, game_state["current_player_id"], geometry)
+
+    def canonical_key(self):
+        return zobrist.canonical_key(self.key, self.mirror_key)
+
+    def can_play(self, col):
+        return self.heights[col] < self.rows
+
+    def is_full(self):
+        return self.move_count == self.rules.cells
+
+    def play(self, col):
+        """Drop a chip for the side to move; returns True if it completes a line"""
+        heights = self.heights
+        player_id = self.to_move
+        row = heights[col]
+        index = row * self.columns + col
+        piece = self.pieces[player_id]
+        self.key ^= self.cell_keys[player_id][index]
+        self.mirror_key ^= self.mirror_keys[player_id][index]
+        cells = self.cells
+        cells[index] = piece
+        heights[col] = row + 1
+        self.move_count += 1
+        self.to_move = 1 - player_id
+        line = self.connect * piece
+        windows = self.cell_windows[index]
+        if self.connect == 4:
+            for a, b, c, d in windows:
+                if cells[a] + cells[b] + cells[c] + cells[d] == line:
+                    return True
+            return False
+        for window in windows:
+            if sum(map(cells.__getitem__, window)) == line:
+                return True
+        return False
+
+    def undo(self, col):
+        """Take back the last chip in a column, restoring key, heights and turn"""
+        row = self.heights[col] - 1
+        self.heights[col] = row
+        index = row * self.columns + col
+        self.cells[index] = 0
+        self.move_count -= 1
+        player_id = self.to_move = 1 - self.to_move
+        self.key ^= self.cell_keys[player_id][index]
+        self.mirror_key ^= self.mirror_keys[player_id][index]
+
+
+def window_sums(cells, geometry):
+    """Sum of the cells of every window, unrolled for the common line lengths"""
+    if geometry.connect == 4:
+        return [cells[a] + cells[b] + cells[c] + cells[d] for a, b, c, d in geometry.windows]
+    if geometry.connect == 5:
+        return [cells[a] + cells[b] + cells[c] + cells[d] + cells[e] for a, b, c, d, e in geometry.windows]
+    return [sum(map(cells.__getitem__, window)) for window in geometry.windows]
+
+
+def evaluate(position):
+    """Score the position for the side to move; positive is good for it"""
+    cells = position.cells
+    geometry = position.rules
+    tables = position.tables
+    totals = window_sums(cells, geometry)
+    score = sum(map(tables.window_score.__getitem__, totals))  # For player 0
+
+    # The first player wins zugzwang fights on odd rows (1st, 3rd, 5th from the
+    # bottom), the second player on even rows; count a three extra if its
+    # empty cell is not playable yet and sits on its owner's parity
+    heights = position.heights
+    columns = position.columns
+    low = geometry.pieces[0]
+    for window in itertools.compress(geometry.windows, map(tables.is_three.__getitem__, totals)):
+        player = 0 if cells[window[0]] + cells[window[1]] <= 2 * low else 1
+        empty = next(index for index in window if not cells[index])
+        row, col = divmod(empty, columns)
+        if row > heights[col] and row % 2 == player:
+            score += PARITY_SCORE if player == 0 else -PARITY_SCORE
+
+    for center in tables.center_columns:
+        for row in range(heights[center]):
+            score += CENTER_SCORE if cells[row * columns + center] == low else -CENTER_SCORE
+    return score if position.to_move == 0 else -score
+
+
+class Searcher:
+    """Depth-limited negamax with alpha-beta pruning and a deadline"""
+
+    def __init__(self, position, deadline=None):
+        self.position = position
+        self.deadline = deadline
+        self.nodes = 0
+
+    def negamax(self, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & 15 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        position = self.position
+        if position.is_full():
+            return 0
+        if depth == 0:
+            return evaluate(position)
+        best = -INFINITY
+        for col in position.rules.move_order:
+            if not position.can_play(col):
+                continue
+            if position.play(col):
+                position.undo(col)
+                return WIN_SCORE - ply  # Prefer the quickest win
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            position.undo(col)
+            if score > best:
+                best = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best
+
+    def root_scores(self, depth):
+        """Score every legal column at the given depth"""
+        position = self.position
+        scores = {}
+        for col in position.rules.move_order:
+            if not position.can_play(col):
+                continue
+            if position.play(col):
+                scores[col] = WIN_SCORE
+            else:
+                scores[col] = -self.negamax(depth - 1, -INFINITY, INFINITY, 1)
+            position.undo(col)
+        return scores
+
+
+def search(position, max_depth, budget=None, noise=0):
+    """Iterative deepening search; returns (column, score, depth reached, nodes)
+
+    Deepens until max_depth or until the time budget runs out, and answers
+    with the best move of the deepest completed iteration.
+    """
+    deadline = time.perf_counter() + budget if budget is not None else None
+    searcher = Searcher(position.copy(), deadline)  # A timeout may leave moves on the copy
+    best = None
+    depth_reached = 0
+    for depth in range(1, max_depth + 1):
+        try:
+            scores = searcher.root_scores(depth)
+        except SearchTimeout:
+            break
+        if noise:
+            scores = {col: score + random.randint(-noise, noise) for col, score in scores.items()}
+        best = max(scores.items(), key=lambda item: item[1])
+        depth_reached = depth
+        if best[1] >= WIN_SCORE - depth:
+            break  # A forced win was found; searching deeper cannot improve it
+    if best is None:
+        # Not even depth 1 finished; fall back to the most central legal column
+        best = (next(col for col in position.rules.move_order if position.can_play(col)), 0)
+    return best[0], best[1], depth_reached, searcher.nodes
+
+
+def choose_move(game_state, tier="medium"):
+    """Pick a column for the player to move in a get_game_state() snapshot"""
+    max_depth, budget, noise = TIERS[tier]
+    position = Position.from_game_state(game_state)
+    return search(position, max_depth, budget, noise)[0]
+
+
+def benchmark(tier, positions=50, seed=1, geometry=rules.STANDARD):
+    """Measure a tier on random mid-game positions; returns (nodes per second, average ms, worst ms)"""
+    rng = random.Random(seed)
+    max_depth, budget, noise = TIERS[tier]
+    total_nodes = 0
+    total_time = 0.0
+    worst = 0.0
+    for _ in range(positions):
+        position = Position(geometry=geometry)
+        for _ in range(rng.randint(0, 16)):
+            col = rng.choice([col for col in range(geometry.columns) if position.can_play(col)])
+            if position.play(col):
+                position.undo(col)
+                break
+        started = time.perf_counter()
+        nodes = search(position, max_depth, budget, noise)[3]
+        elapsed = time.perf_counter() - started
+        total_nodes += nodes
+        total_time += elapsed
+        worst = max(worst, elapsed)
+    return total_nodes / total_time, total_time / positions * 1000, worst * 1000
+
+
+if __name__ == "__main__":
+    for variant, geometry in rules.VARIANTS.items():
+        print(variant)
+        for name in TIERS:
+            nps, average, worst = benchmark(name, geometry=rules.get_rules(*geometry))
+            print(f"  {name}: {nps:,.0f} nodes/s, {average:.2f} ms average, {worst:.2f} ms worst "
+                  f"(budget {TIERS[name][1] * 1000:.0f} ms)")
@@ -1,5 +1,7 @@
 import pygame
 
+import rules
+
 class Player:
     def __init__(self, id):
         self._id = id
@@ -21,55 +23,54 @@ class Player:
 
 
 class Board:
-    def __init__(self):
-        self.ROWS = 6
-        self.COLUMNS = 7
+    def __init__(self, rows=rules.ROWS, columns=rules.COLUMNS, connect=rules.CONNECT):
+        self.ROWS = rows
+        self.COLUMNS = columns
+        self._rules = rules.get_rules(rows, columns, connect)
         self.clear()
 
     def clear(self):
         self._grid = [[None for i in range(self.COLUMNS)] for j in range(self.ROWS)]   
+        self._moves = []  # (row, column) of every chip, in order
+        self._undone = []  # Columns taken back, most recent last
 
     def check_player_wins(self, player):
-        id = player.get_id()
-        
-        # Check horizontal
-        for c in range(self.COLUMNS - 3):
-            for r in range(self.ROWS):
-                if (self._grid[r][c] == id and self._grid[r][c+1] == id and 
-                    self._grid[r][c+2] == id and self._grid[r][c+3] == id):
-                    return True
-
-        # Check vertical
-        for c in range(self.COLUMNS):
-            for r in range(self.ROWS - 3):
-                if (self._grid[r][c] == id and self._grid[r+1][c] == id and 
-                    self._grid[r+2][c] == id and self._grid[r+3][c] == id):
-                    return True
-
-        # Check positive diagonal
-        for c in range(self.COLUMNS - 3):
-            for r in range(self.ROWS - 3):
-                if (self._grid[r][c] == id and self._grid[r+1][c+1] == id and 
-                    self._grid[r+2][c+2] == id and self._grid[r+3][c+3] == id):
-                    return True
-
-        # Check negative diagonal
-        for c in range(self.COLUMNS - 3):
-            for r in range(3, self.ROWS):
-                if (self._grid[r][c] == id and self._grid[r-1][c+1] == id and 
-                    self._grid[r-2][c+2] == id and self._grid[r-3][c+3] == id):
-                    return True
-
-        return False
+        return self._rules.check_win(self._grid, player.get_id())
 
     def add_chip(self, player, column):
+        self._undone.clear()
+        return self._drop(player, column)
+
+    def _drop(self, player, column):
         for row in range(self.ROWS):
             cell_value = self._grid[row][column]
             if cell_value is None:
                 self._grid[row][column] = player.get_id()
+                self._moves.append((row, column))
                 return row
         return -1
 
+    def undo(self):
+        """Remove the last chip; returns its (row, column), or None if the board is empty"""
+        if not self._moves:
+            return None
+        row, column = self._moves.pop()
+        self._grid[row][column] = None
+        self._undone.append(column)
+        return row, column
+
+    def redo(self, player):
+        """Put back the last chip taken back; returns (row, column), or None if there is none"""
+        if not self._undone:
+            return None
+        column = self._undone.pop()
+        return self._drop(player, column), column
+
+    def chips(self):
+        """Yield (row, column, player id) for every chip on the board"""
+        for row, column in self._moves:
+            yield row, column, self._grid[row][column]
+
 
 class GameUI:
     def __init__(self, player):
@@ -78,6 +79,8 @@ class GameUI:
         self.CHIP_OFFSET = 20
         self.BOARD_HEIGHT = 600
         self.CHIP_RADIUS = int(self.CHIP_SIZE / 2)
+        self.ROWS = rules.ROWS
+        self.COLUMNS = rules.COLUMNS
 
         pygame.init()
         pygame.font.init()
@@ -102,6 +105,17 @@ class GameUI:
         self.draw_board()
         self.draw_player(player)  
         
+    def draw_position(self, board, players, player):
+        """Redraw every chip on the board, e.g. after a move was taken back"""
+        self._screen.fill((255, 255, 255))
+        for row, column, player_id in board.chips():
+            pygame.draw.circle(self._screen, players[player_id].get_color(),
+                (self.OFFSET + self.CHIP_RADIUS + self.CHIP_OFFSET * column + self.CHIP_SIZE * column,
+                 self.BOARD_HEIGHT - self.CHIP_SIZE * row - self.CHIP_OFFSET * row),
+                self.CHIP_RADIUS)
+        self.draw_board()
+        self.draw_player(player)
+
     def draw_player_won(self, player):
         pygame.draw.rect(self._screen, (255, 255, 255), [0, 0, 800, 50], 0)
         text = player.get_name() + " won! Restart (y | n)?"
@@ -171,7 +185,17 @@ class Game:
                     done = True
 
                 elif event.type == pygame.KEYUP:
-                    if player_won:
+                    # U key takes the last move back, R key plays it again
+                    if event.key == 117:
+                        if self.undo_move(player_won):
+                            player_won = False
+                    elif event.key == 114 and not player_won:
+                        move = self.redo_move()
+                        if move is not None:
+                            row, column = move
+                            player_won = self.check_player_wins(self.get_current_player())
+                            update_ui = True
+                    elif player_won:
                         # N key
                         if event.key == 110:
                             done = True
@@ -213,6 +237,18 @@ class Game:
         player = self.get_current_player()
         return self._board.add_chip(player, column)
 
+    def undo_move(self, player_won):
+        if self._board.undo() is None:
+            return False
+        # The winner's turn was never passed on, so only switch back otherwise
+        if not player_won:
+            self.switch_player()
+        self._gameUI.draw_position(self._board, self._players, self.get_current_player())
+        return True
+
+    def redo_move(self):
+        return self._board.redo(self.get_current_player())
+
     def check_player_wins(self, player):
         return self._board.check_player_wins(player)
 
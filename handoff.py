@@ -0,0 +1,136 @@
+"""Hands the listening socket from a running server to the server replacing it.
+
+The running server listens on a Unix socket. A new server started with
+--takeover connects to it; the old server stops accepting, saves its
+snapshot and sends the listening socket's file descriptor over the Unix
+socket. Clients that connect in between wait in the kernel's accept queue,
+so none of them is refused.
+
+The Unix connection stays open afterwards: results of the games the old
+server finishes while it drains are sent over it, so only the new server
+writes the ratings file.
+"""
+import os
+import socket
+import threading
+
+from protocol import encode_message, FrameDecoder, ProtocolError
+
+HANDOFF_PATH = "connect4.handoff"
+REQUEST = b"C4TO"  # Sent by a successor; a connection that sends anything else is only a probe
+READY = b"C4HO"
+
+
+def supported():
+    return hasattr(socket, "AF_UNIX") and hasattr(socket, "send_fds")
+
+
+class HandoffServer:
+    """Waits for one successor and gives it the listening socket.
+
+    prepare() is called when a successor connects and returns the listening
+    socket once the server is ready to let go of it; on_done(channel, ok) is
+    called after the descriptor was sent, or failed to be.
+    """
+
+    def __init__(self, path, prepare, on_done):
+        self.path = path
+        self.prepare = prepare
+        self.on_done = on_done
+        if os.path.exists(path):
+            if in_use(path):
+                raise OSError(f"Another server is already listening on {path}")
+            os.unlink(path)  # Left behind by a server that died without cleaning up
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen(1)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                channel, _ = self.socket.accept()
+            except OSError:
+                return  # Closed by shutdown
+            try:
+                channel.settimeout(5.0)
+                request = channel.recv(len(REQUEST))
+                channel.settimeout(None)
+            except OSError:
+                request = None
+            if request == REQUEST:
+                break
+            channel.close()  # A probe from a server checking whether this path is live
+        self.close()  # One handoff per server; the successor binds the path for the next one
+        try:
+            listener = self.prepare()
+            socket.send_fds(channel, [READY], [listener.fileno()])
+        except OSError as e:
+            print(f"Error handing off the listening socket: {e}")
+            channel.close()
+            self.on_done(None, False)
+            return
+        listener.close()  # The successor holds its own copy of the descriptor
+        self.on_done(channel, True)
+
+    def close(self):
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def in_use(path):
+    """True if a running server answers on the handoff path"""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+def take_over(path=HANDOFF_PATH, timeout=30.0):
+    """Ask the running server for its listening socket; returns (listener, channel)"""
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    channel.settimeout(timeout)
+    channel.connect(path)
+    channel.sendall(REQUEST)
+    message, fds, _, _ = socket.recv_fds(channel, len(READY), 1)
+    if message != READY or not fds:
+        channel.close()
+        raise OSError("The running server did not hand over its listening socket")
+    channel.settimeout(None)
+    return socket.socket(fileno=fds[0]), channel
+
+
+def send_result(channel, player_a, player_b, score_a):
+    """Forward a game result from the draining server to its successor"""
+    channel.sendall(encode_message({
+        "Command": "Game_Result",
+        "Player_A": player_a,
+        "Player_B": player_b,
+        "Score_A": score_a
+    }))
+
+
+def receive_results(channel, record_result):
+    """Record the predecessor's forwarded results until it closes the channel"""
+    decoder = FrameDecoder()
+    try:
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            for message in decoder.feed(data):
+                if message and message.get("Command") == "Game_Result":
+                    record_result(message["Player_A"], message["Player_B"], message["Score_A"])
+    except (OSError, ProtocolError) as e:
+        print(f"Error receiving results from the previous server: {e}")
+    channel.close()
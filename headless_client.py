@@ -0,0 +1,294 @@
+"""Headless Connect 4 client for bots, load tests and integration tests.
+
+Speaks the same framed protocol as client.py but imports no GUI toolkit.
+Every request is an awaitable method and every server message can be
+observed through callbacks registered with on(), so thousands of clients
+can share one asyncio event loop.
+"""
+import argparse
+import asyncio
+import inspect
+import functools
+import random
+
+import evaluation
+import rules
+from protocol import encode_message, FrameDecoder, ProtocolError
+
+REJECT_BACKOFF = 0.25  # Seconds play_game waits after a rejected move before trying again
+
+
+class HeadlessClient:
+    def __init__(self, host, port, username):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.callbacks = {}  # command -> list of callbacks, "*" for every message
+        self.waiters = []  # (command, predicate, future)
+        self.rooms = set()
+        self.games = {}  # room name -> latest Game_State
+        self.token = None  # Reconnect token from the last login
+        self.connected = False
+
+    # Events
+
+    def on(self, command, callback):
+        """Call callback(message) for every message with this command ("*" for all)"""
+        self.callbacks.setdefault(command, []).append(callback)
+
+    def wait_for(self, command, predicate=None, timeout=10.0):
+        """Wait for the next message with this command that satisfies predicate"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((command, predicate, future))
+        return asyncio.wait_for(future, timeout)
+
+    async def dispatch(self, message):
+        command = message.get("Command")
+        if command in ("Game_Start", "Game_Update", "Game_Over", "Move_Rejected", "Takeback"):
+            self.games[message["Room_Name"]] = message["Game_State"]
+        elif command == "Game_Restart":
+            self.games.pop(message["Room_Name"], None)
+
+        for waiter in list(self.waiters):
+            waiter_command, predicate, future = waiter
+            if waiter_command != command or future.done():
+                continue
+            if predicate is None or predicate(message):
+                future.set_result(message)
+                self.waiters.remove(waiter)
+        self.waiters = [waiter for waiter in self.waiters if not waiter[2].done()]
+
+        for callback in self.callbacks.get(command, []) + self.callbacks.get("*", []):
+            result = callback(message)
+            if inspect.isawaitable(result):
+                await result
+
+    async def read_loop(self):
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                for message in decoder.feed(data):
+                    if message:
+                        await self.dispatch(message)
+        except (ConnectionError, ProtocolError) as e:
+            print(f"{self.username}: connection error: {e}")
+        finally:
+            self.connected = False
+            for _, _, future in self.waiters:
+                if not future.done():
+                    future.set_exception(ConnectionError("Disconnected from server"))
+            self.waiters = []
+            await self.dispatch({"Command": "Disconnected"})
+
+    # Connection
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.connected = True
+        self.reader_task = asyncio.create_task(self.read_loop())
+
+    async def send(self, message):
+        message.setdefault("User_Name", self.username)
+        self.writer.write(encode_message(message))
+        await self.writer.drain()
+
+    async def request(self, message, command, predicate=None, timeout=10.0):
+        """Send a message and wait for the reply identified by command and predicate"""
+        reply = self.wait_for(command, predicate, timeout)
+        await self.send(message)
+        return await reply
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+        if self.reader_task is not None:
+            await asyncio.gather(self.reader_task, return_exceptions=True)
+
+    # Lobby
+
+    async def login(self, resume=False):
+        """Log in; with resume, present the last token to get our seats back after a server restart"""
+        message = {"Command": "Check_Username"}
+        if resume and self.token is not None:
+            message["Token"] = self.token
+        reply = await self.request(message, "Check_Username")
+        self.token = reply.get("Token")
+        if reply.get("Resumed"):
+            self.rooms.update(reply.get("Rooms", []))
+        return reply
+
+    async def room_state(self, room_name=""):
+        return await self.request({"Command": "Request_Room_State", "Room_Name": room_name}, "Room_State")
+
+    async def create_room(self, room_name, rows=rules.ROWS, columns=rules.COLUMNS, connect=rules.CONNECT):
+        await self.send({"Command": "Create_Room", "Room_Name": room_name,
+                         "Rows": rows, "Columns": columns, "Connect": connect})
+
+    async def join_room(self, room_name):
+        """Join a room and return the list of users in it"""
+        reply = await self.request({"Command": "Join_Room", "Room_Name": room_name}, "Join_Room",
+                                   lambda m: m["Room_Name"] == room_name and m["User_Name"] == self.username)
+        self.rooms.add(room_name)
+        return reply["Users_In_Room"]
+
+    async def leave_room(self, room_name):
+        await self.send_chat(room_name, f"{self.username} has left the room.")
+        self.rooms.discard(room_name)
+        self.games.pop(room_name, None)
+
+    async def send_chat(self, room_name, text):
+        await self.send({"Command": "Sending_Message", "Room_Name": room_name, "Text": text})
+
+    async def queue_for_match(self, timeout=60.0):
+        """Wait in the matchmaking queue and return the matched room's name"""
+        matched = self.wait_for("Queue_Status", lambda m: m["Status"] == "Matched", timeout)
+        await self.send({"Command": "Queue_For_Match"})
+        message = await matched
+        self.rooms.add(message["Room_Name"])
+        return message["Room_Name"]
+
+    async def leave_queue(self):
+        await self.send({"Command": "Leave_Queue"})
+
+    async def rating(self, player=None):
+        return await self.request({"Command": "Request_Rating", "Player": player or self.username}, "Rating")
+
+    async def leaderboard(self, count=10):
+        reply = await self.request({"Command": "Request_Leaderboard", "Count": count}, "Leaderboard")
+        return reply["Entries"]
+
+    # Game
+
+    async def set_ready(self, room_name, ready=True):
+        await self.send({"Command": "Ready_Status", "Room_Name": room_name, "Ready": ready})
+
+    async def wait_for_game_start(self, room_name, timeout=60.0):
+        message = await self.wait_for("Game_Start", lambda m: m["Room_Name"] == room_name, timeout)
+        return message["Game_State"]
+
+    async def play(self, room_name, column):
+        """Play a move; returns the new game state, or None if the server rejected it.
+
+        If the server's rate limiter drops the move, it is sent again once
+        the limiter says tokens are available.
+        """
+        state = self.games.get(room_name)
+        move_seq = state["move_count"] + 1 if state else None
+        while True:
+            replies = [
+                self.wait_for("Game_Update",
+                              lambda m: m["Room_Name"] == room_name and m["Move"]["player"] == self.username),
+                self.wait_for("Move_Rejected", lambda m: m["Room_Name"] == room_name),
+                self.wait_for("Rate_Limited",
+                              lambda m: m["Rejected_Command"] == "Game_Move" and m.get("Room_Name") == room_name),
+            ]
+            replies = [asyncio.ensure_future(reply) for reply in replies]
+            await self.send({"Command": "Game_Move", "Room_Name": room_name, "Column": column, "Move_Seq": move_seq})
+            done, pending = await asyncio.wait(replies, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            message = done.pop().result()
+            if message["Command"] != "Rate_Limited":
+                break
+            await asyncio.sleep(message["Retry_After"])
+        return message["Game_State"] if message["Command"] == "Game_Update" else None
+
+    async def add_bot(self, room_name, tier="medium"):
+        """Seat a server-side AI player in the room's free seat"""
+        await self.send({"Command": "Add_Bot", "Room_Name": room_name, "Tier": tier})
+
+    async def request_takeback(self, room_name):
+        """Ask the opponent to take back our last move; returns True if they agreed"""
+        reply = await self.request({"Command": "Request_Takeback", "Room_Name": room_name}, "Takeback",
+                                   lambda m: m["Room_Name"] == room_name and m["User_Name"] == self.username)
+        return reply["Accepted"]
+
+    async def answer_takeback(self, room_name, accept):
+        await self.send({"Command": "Takeback_Response", "Room_Name": room_name, "Accept": accept})
+
+    async def restart_game(self, room_name):
+        await self.send({"Command": "Restart_Game", "Room_Name": room_name})
+
+    def is_my_turn(self, room_name):
+        state = self.games.get(room_name)
+        return state is not None and not state["game_over"] and state["current_player"] == self.username
+
+    def legal_moves(self, room_name):
+        state = self.games.get(room_name)
+        if state is None:
+            return []
+        top_row = state["grid"][-1]
+        return [column for column, cell in enumerate(top_row) if cell is None]
+
+
+async def play_game(client, room_name, choose_move):
+    """Play the game in room_name to the end; choose_move(game_state) returns a column"""
+    game_over = client.wait_for("Game_Over", lambda m: m["Room_Name"] == room_name, timeout=None)
+    game_over = asyncio.ensure_future(game_over)
+    while not game_over.done():
+        if client.is_my_turn(room_name):
+            if await client.play(room_name, choose_move(client.games[room_name])) is None:
+                # Rejected; pause rather than resend at once if our view still says it is our turn
+                await asyncio.wait([game_over], timeout=REJECT_BACKOFF)
+        else:
+            turn = asyncio.ensure_future(
+                client.wait_for("Game_Update", lambda m: m["Room_Name"] == room_name, timeout=None))
+            await asyncio.wait([turn, game_over], return_when=asyncio.FIRST_COMPLETED)
+            turn.cancel()
+    return (await game_over)["Winner"]
+
+
+def random_move(game_state):
+    top_row = game_state["grid"][-1]
+    return random.choice([column for column, cell in enumerate(top_row) if cell is None])
+
+
+def tier_move(tier):
+    """Return a choose_move function that searches at one of evaluation.TIERS"""
+    return functools.partial(evaluation.choose_move, tier=tier)
+
+
+async def run_bot(host, port, username, games, queue_timeout=30.0, choose_move=random_move):
+    """Connect, then queue for and play the given number of matches"""
+    client = HeadlessClient(host, port, username)
+    await client.connect()
+    await client.login()
+    for _ in range(games):
+        try:
+            room_name = await client.queue_for_match(timeout=queue_timeout)
+        except asyncio.TimeoutError:
+            print(f"{username}: no opponent found")
+            await client.leave_queue()
+            break
+        if room_name not in client.games:
+            await client.wait_for_game_start(room_name)
+        winner = await play_game(client, room_name, choose_move)
+        print(f"{username}: game in {room_name} won by {winner}")
+        await client.leave_room(room_name)
+    await client.close()
+
+
+async def main(host, port, bots, games, tier="random"):
+    choose_move = random_move if tier == "random" else tier_move(tier)
+    await asyncio.gather(*(run_bot(host, port, f"bot{i}", games, choose_move=choose_move) for i in range(bots)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run headless Connect 4 bots against a server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--bots", type=int, default=2)
+    parser.add_argument("--games", type=int, default=1)
+    parser.add_argument("--tier", default="random", choices=["random"] + list(evaluation.TIERS))
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port, args.bots, args.games, args.tier))
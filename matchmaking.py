@@ -0,0 +1,145 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueueEntry:
+    def __init__(self, username, rating, queued_at):
+        self.username = username
+        self.rating = rating
+        self.queued_at = queued_at
+
+    def allowed_delta(self, now, base_range, widen_rate, max_range):
+        """Rating difference this player accepts after waiting until now"""
+        return min(max_range, base_range + widen_rate * (now - self.queued_at))
+
+
+class Matchmaker:
+    """Pairs queued players by rating in periodic batches.
+
+    Waiting players live in rating buckets (rating // bucket_width). Players
+    that land in the same bucket are always close enough to play, so after a
+    tick every bucket holds at most one player. A tick therefore only pairs
+    the buckets that received new players and then walks the (short) list of
+    non-empty buckets to join neighbours whose widened ranges overlap.
+    """
+
+    def __init__(self, on_match, bucket_width=50, base_range=100, widen_rate=25,
+                 max_range=800, tick_interval=0.25, max_queued=0):
+        self.on_match = on_match  # Called as on_match(entry_a, entry_b) with QueueEntry objects
+        self.bucket_width = bucket_width
+        self.base_range = base_range
+        self.widen_rate = widen_rate  # Rating points added per second of waiting
+        self.max_range = max_range
+        self.tick_interval = tick_interval
+        self.max_queued = max_queued  # 0 means the queue is unbounded
+        self.buckets = {}  # bucket id -> OrderedDict of username -> QueueEntry
+        self.bucket_ids = []  # Sorted ids of non-empty buckets
+        self.dirty_buckets = set()  # Buckets that received players since the last tick
+        self.entries = {}  # username -> QueueEntry
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """Start the periodic pairing thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        while not self.stopping.wait(self.tick_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error in matchmaking tick: {e}")
+
+    def bucket_of(self, rating):
+        return int(rating // self.bucket_width)
+
+    def enqueue(self, username, rating):
+        """Add a player to the queue (or update their rating). Returns queue size, or None if full."""
+        with self.lock:
+            if username in self.entries:
+                self._remove(username)
+            elif self.max_queued and len(self.entries) >= self.max_queued:
+                return None
+            entry = QueueEntry(username, rating, time.monotonic())
+            bucket_id = self.bucket_of(rating)
+            bucket = self.buckets.get(bucket_id)
+            if bucket is None:
+                bucket = self.buckets[bucket_id] = OrderedDict()
+                bisect.insort(self.bucket_ids, bucket_id)
+            bucket[username] = entry
+            self.entries[username] = entry
+            self.dirty_buckets.add(bucket_id)
+            return len(self.entries)
+
+    def dequeue(self, username):
+        """Remove a player from the queue. Returns True if they were queued."""
+        with self.lock:
+            if username not in self.entries:
+                return False
+            self._remove(username)
+            return True
+
+    def is_queued(self, username):
+        return username in self.entries
+
+    def queue_size(self):
+        return len(self.entries)
+
+    def _remove(self, username):
+        """Unlink a player from the index and return their entry"""
+        entry = self.entries.pop(username)
+        bucket_id = self.bucket_of(entry.rating)
+        bucket = self.buckets[bucket_id]
+        del bucket[username]
+        if not bucket:
+            del self.buckets[bucket_id]
+            index = bisect.bisect_left(self.bucket_ids, bucket_id)
+            del self.bucket_ids[index]
+            self.dirty_buckets.discard(bucket_id)
+        return entry
+
+    def tick(self):
+        """Pair as many waiting players as possible and report the matches."""
+        now = time.monotonic()
+        matches = []
+        with self.lock:
+            # Pair players sharing a bucket, oldest first
+            for bucket_id in list(self.dirty_buckets):
+                bucket = self.buckets.get(bucket_id)
+                while bucket is not None and len(bucket) >= 2:
+                    first = self._remove(next(iter(bucket)))
+                    second = self._remove(next(iter(bucket)))
+                    matches.append((first, second))
+                    bucket = self.buckets.get(bucket_id)
+            self.dirty_buckets.clear()
+
+            # Every bucket now holds at most one player; join neighbours in
+            # rating order when both of them accept the difference
+            previous = None
+            for bucket_id in list(self.bucket_ids):
+                entry = next(iter(self.buckets[bucket_id].values()))
+                if previous is not None:
+                    delta = entry.rating - previous.rating
+                    if (delta <= previous.allowed_delta(now, self.base_range, self.widen_rate, self.max_range) and
+                            delta <= entry.allowed_delta(now, self.base_range, self.widen_rate, self.max_range)):
+                        self._remove(previous.username)
+                        self._remove(entry.username)
+                        matches.append((previous, entry))
+                        previous = None
+                        continue
+                previous = entry
+
+        for first, second in matches:
+            try:
+                self.on_match(first, second)
+            except Exception as e:
+                print(f"Error starting match {first.username} vs {second.username}: {e}")
+        return matches
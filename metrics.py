@@ -0,0 +1,21 @@
+import threading
+
+
+class Metrics:
+    """Thread-safe named counters shared by the server components"""
+
+    def __init__(self):
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get(self, name):
+        return self.counters.get(name, 0)
+
+    def snapshot(self):
+        """Return a copy of all counters"""
+        with self.lock:
+            return dict(self.counters)
@@ -0,0 +1,118 @@
+"""Read-only opening book: canonical Zobrist key -> best column.
+
+The book is a sorted array of fixed-size records in one file. Readers map it
+with mmap, so every process that opens the same book shares the same pages
+and a lookup is a binary search without loading anything into Python objects.
+"""
+import argparse
+import mmap
+import os
+import struct
+
+import evaluation
+import rules
+import zobrist
+
+MAGIC = b"C4OB"
+HEADER = struct.Struct("<4sBBBxI")  # magic, rows, columns, connect, record count
+RECORD = struct.Struct("<QB")  # canonical key, best column in the canonical orientation
+BOOK_PATH = "opening_book.dat"
+
+
+class OpeningBook:
+    def __init__(self, path=BOOK_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, rows, columns, connect, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or len(self.data) != HEADER.size + self.count * RECORD.size:
+            self.data.close()
+            raise ValueError(f"{path} is not an opening book")
+        self.rules = rules.get_rules(rows, columns, connect)
+
+    def lookup(self, key, mirror_key):
+        """Return the book column for a position given its two keys, or None"""
+        canonical = zobrist.canonical_key(key, mirror_key)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, column = RECORD.unpack_from(self.data, HEADER.size + middle * RECORD.size)
+            if record_key < canonical:
+                low = middle + 1
+            elif record_key > canonical:
+                high = middle
+            else:
+                # The record is stored for the canonical orientation; mirror it back if needed
+                return column if canonical == key else self.rules.columns - 1 - column
+        return None
+
+    def move_for(self, position):
+        """Book column for an evaluation.Position, or None if it is not in the book"""
+        if position.rules is not self.rules:
+            return None
+        return self.lookup(position.key, position.mirror_key)
+
+    def close(self):
+        self.data.close()
+
+
+def load_book(path=BOOK_PATH):
+    """Open the book if it exists; a missing or broken book just means no book moves"""
+    if not os.path.exists(path):
+        return None
+    try:
+        return OpeningBook(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Error loading opening book {path}: {e}")
+        return None
+
+
+def build_book(path=BOOK_PATH, plies=2, depth=8, geometry=rules.STANDARD):
+    """Search every position up to plies moves deep and write the best moves to path"""
+    positions = {}  # canonical key -> position in the canonical orientation
+    frontier = [evaluation.Position(geometry=geometry)]
+    for ply in range(plies + 1):
+        next_frontier = []
+        for position in frontier:
+            canonical = position.canonical_key()
+            if canonical in positions:
+                continue
+            if position.key != canonical:
+                position = mirrored(position)
+            positions[canonical] = position
+            if ply == plies:
+                continue
+            for col in range(geometry.columns):
+                if position.can_play(col):
+                    child = position.copy()
+                    if not child.play(col) and not child.is_full():
+                        next_frontier.append(child)
+        frontier = next_frontier
+
+    records = []
+    for canonical, position in sorted(positions.items()):
+        column = evaluation.search(position, depth)[0]
+        records.append(RECORD.pack(canonical, column))
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, geometry.rows, geometry.columns, geometry.connect, len(records)))
+        f.write(b"".join(records))
+    os.replace(temp_path, path)
+    return len(records)
+
+
+def mirrored(position):
+    columns = position.columns
+    cells = [position.cells[(index // columns) * columns + columns - 1 - index % columns]
+             for index in range(len(position.cells))]
+    return evaluation.Position(cells, position.to_move, position.rules)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the opening book used by the AI workers")
+    parser.add_argument("--path", default=BOOK_PATH)
+    parser.add_argument("--plies", type=int, default=2, help="Book every position up to this many moves")
+    parser.add_argument("--depth", type=int, default=8, help="Search depth for each book move")
+    args = parser.parse_args()
+    count = build_book(args.path, args.plies, args.depth)
+    print(f"Wrote {count} positions to {args.path}")
@@ -0,0 +1,43 @@
+import pickle
+import struct
+
+# Every message on the wire is a 4-byte big-endian length followed by the
+# pickled message dict, so messages can be split or coalesced by TCP freely.
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 1048576
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_message(message):
+    """Serialize a message dict into one length-prefixed frame"""
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    return HEADER.pack(len(data)) + data
+
+
+class FrameDecoder:
+    """Reassembles frames from a byte stream"""
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """Add received bytes and return the list of complete messages"""
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer, offset)
+            if length > self.max_frame_size:
+                raise ProtocolError(f"Frame of {length} bytes exceeds limit of {self.max_frame_size}")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            messages.append(pickle.loads(self.buffer[offset + HEADER.size:end]))
+            offset = end
+        if offset:
+            del self.buffer[:offset]
+        return messages
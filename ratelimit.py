@@ -0,0 +1,87 @@
+import math
+import time
+
+# Limits are (tokens per second, burst size)
+DEFAULT_CONNECTION_LIMIT = (20.0, 40)
+DEFAULT_COMMAND_LIMITS = {
+    "Check_Username": (0.5, 3),
+    "Create_Room": (1.0, 3),
+    "Join_Room": (1.0, 3),
+    "Sending_Message": (2.0, 6),
+    "Ready_Status": (2.0, 4),
+    "Game_Move": (4.0, 8),
+    "Restart_Game": (1.0, 2),
+    "Add_Bot": (1.0, 3),
+    "Request_Takeback": (0.5, 2),
+    "Takeback_Response": (1.0, 3),
+    "Queue_For_Match": (1.0, 3),
+    "Leave_Queue": (1.0, 3),
+    "Request_Room_State": (5.0, 10),
+    "Request_Leaderboard": (1.0, 3),
+    "Request_Rating": (2.0, 5),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def consume(self, now, amount=1):
+        """Take tokens if available; returns True when the request may proceed"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def retry_after(self, amount=1):
+        """Seconds until enough tokens will have accumulated"""
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class ConnectionLimiter:
+    """Token buckets for one client connection.
+
+    Every message draws from the connection-wide bucket and from the bucket
+    for its command, so a flood of one command cannot starve the others and
+    the connection as a whole stays bounded.
+    """
+
+    def __init__(self, connection_limit=DEFAULT_CONNECTION_LIMIT, command_limits=None):
+        self.connection_bucket = TokenBucket(*connection_limit)
+        self.command_limits = DEFAULT_COMMAND_LIMITS if command_limits is None else command_limits
+        self.command_buckets = {}
+        self.next_notice = {}  # command -> time before which rejections stay silent
+
+    def allow(self, command):
+        """Return True if the command may be handled now"""
+        now = time.monotonic()
+        bucket = self.command_buckets.get(command)
+        if bucket is None:
+            limit = self.command_limits.get(command)
+            if limit is not None:
+                bucket = self.command_buckets[command] = TokenBucket(*limit)
+        if bucket is not None and not bucket.consume(now):
+            return False
+        if not self.connection_bucket.consume(now):
+            return False
+        return True
+
+    def should_notify(self, command):
+        """True at most once per retry window, so a flood gets one reply, not one per message"""
+        now = time.monotonic()
+        if now < self.next_notice.get(command, 0.0):
+            return False
+        self.next_notice[command] = now + self.retry_after(command)
+        return True
+
+    def retry_after(self, command):
+        bucket = self.command_buckets.get(command)
+        wait = self.connection_bucket.retry_after()
+        if bucket is not None:
+            wait = max(wait, bucket.retry_after())
+        return math.ceil(wait * 1000) / 1000  # Round up so retrying on time succeeds
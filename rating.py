@@ -0,0 +1,272 @@
+import math
+import os
+import queue
+import struct
+import threading
+import time
+from array import array
+
+DEFAULT_RATING = 1500.0
+DEFAULT_RD = 350.0
+MIN_RD = 30.0
+MAX_RATING = 4000  # Ratings are clamped to [0, MAX_RATING] in the rank index
+Q = math.log(10) / 400
+
+SNAPSHOT_MAGIC = b"C4RT"
+SNAPSHOT_HEADER = struct.Struct("<4sI")
+SNAPSHOT_ROW = struct.Struct("<ddI")
+
+
+class RankIndex:
+    """Fenwick tree over integer ratings, used as an order-statistics index.
+
+    Counting how many players sit above a rating and finding the k-th best
+    rating are both O(log MAX_RATING), so leaderboard reads never sort the
+    whole player table.
+    """
+
+    def __init__(self, size=MAX_RATING + 1):
+        self.size = size
+        self.tree = array('i', [0] * (size + 1))
+        self.members = {}  # integer rating -> set of player indexes
+        self.total = 0
+
+    def add(self, key, player, delta):
+        members = self.members.setdefault(key, set())
+        if delta > 0:
+            members.add(player)
+        else:
+            members.discard(player)
+            if not members:
+                del self.members[key]
+        self.total += delta
+        i = key + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def count_at_most(self, key):
+        """Number of players whose rating key is <= key"""
+        i = min(key, self.size - 1) + 1
+        count = 0
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+    def find_by_order(self, k):
+        """Smallest rating key whose prefix count reaches k (1-based, ascending)"""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = position + step
+            if nxt <= self.size and self.tree[nxt] < k:
+                position = nxt
+                k -= self.tree[nxt]
+            step >>= 1
+        return position  # Tree index position + 1 maps back to key position
+
+
+class RatingEngine:
+    """Glicko ratings updated in batches on a background thread.
+
+    Game results are queued by the request threads and applied once per
+    rating period, so a burst of finished games costs the request path only a
+    queue put. Ratings live in parallel arrays indexed by player number and
+    are written to disk periodically.
+    """
+
+    def __init__(self, snapshot_path="ratings.dat", period=2.0, snapshot_interval=60.0):
+        self.snapshot_path = snapshot_path
+        self.period = period
+        self.snapshot_interval = snapshot_interval
+        self.index_of = {}  # username -> player number
+        self.names = []
+        self.ratings = array('d')
+        self.rds = array('d')
+        self.games_played = array('I')
+        self.rank_index = RankIndex()
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.stopping = threading.Event()  # Wakes the batch thread, so stop() need not wait out a period
+        self.thread = None
+        self.load_snapshot()
+
+    def start(self):
+        """Start the batch update thread."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the update thread, applying pending results and saving a snapshot."""
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout=self.period + 1)
+        self.apply_pending()
+        self.save_snapshot()
+
+    def run(self):
+        last_snapshot = time.monotonic()
+        while not self.stopping.wait(self.period):
+            try:
+                self.apply_pending()
+                if self.dirty and time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    self.save_snapshot()
+                    last_snapshot = time.monotonic()
+            except Exception as e:
+                print(f"Error updating ratings: {e}")
+
+    def record_result(self, player_a, player_b, score_a):
+        """Queue a finished game. score_a is 1 for a win by player_a, 0.5 for a draw, 0 for a loss."""
+        self.pending.put((player_a, player_b, score_a))
+
+    def _player(self, username):
+        index = self.index_of.get(username)
+        if index is None:
+            index = len(self.names)
+            self.index_of[username] = index
+            self.names.append(username)
+            self.ratings.append(DEFAULT_RATING)
+            self.rds.append(DEFAULT_RD)
+            self.games_played.append(0)
+            self.rank_index.add(self._key(DEFAULT_RATING), index, 1)
+        return index
+
+    @staticmethod
+    def _key(rating):
+        return max(0, min(MAX_RATING, int(round(rating))))
+
+    def apply_pending(self):
+        """Apply every queued result as one Glicko rating period"""
+        results = []
+        while True:
+            try:
+                results.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if not results:
+            return 0
+
+        with self.lock:
+            games = {}  # player number -> list of (opponent number, score)
+            for player_a, player_b, score_a in results:
+                a = self._player(player_a)
+                b = self._player(player_b)
+                games.setdefault(a, []).append((b, score_a))
+                games.setdefault(b, []).append((a, 1 - score_a))
+
+            # Every update in the period uses the ratings from its start
+            updates = []
+            for player, played in games.items():
+                rating = self.ratings[player]
+                rd = self.rds[player]
+                d_inverse = 0.0
+                improvement = 0.0
+                for opponent, score in played:
+                    g = 1 / math.sqrt(1 + 3 * Q * Q * self.rds[opponent] ** 2 / math.pi ** 2)
+                    expected = 1 / (1 + 10 ** (-g * (rating - self.ratings[opponent]) / 400))
+                    d_inverse += Q * Q * g * g * expected * (1 - expected)
+                    improvement += g * (score - expected)
+                denominator = 1 / (rd * rd) + d_inverse
+                new_rating = rating + Q / denominator * improvement
+                new_rd = max(MIN_RD, math.sqrt(1 / denominator))
+                updates.append((player, new_rating, new_rd, len(played)))
+
+            for player, new_rating, new_rd, count in updates:
+                old_key = self._key(self.ratings[player])
+                new_key = self._key(new_rating)
+                if old_key != new_key:
+                    self.rank_index.add(old_key, player, -1)
+                    self.rank_index.add(new_key, player, 1)
+                self.ratings[player] = new_rating
+                self.rds[player] = new_rd
+                self.games_played[player] += count
+            self.dirty = True
+        return len(results)
+
+    def get_rating(self, username):
+        index = self.index_of.get(username)
+        return self.ratings[index] if index is not None else DEFAULT_RATING
+
+    def get_rank(self, username):
+        """1-based leaderboard position of a player, or None if they have no rating yet"""
+        with self.lock:
+            index = self.index_of.get(username)
+            if index is None:
+                return None
+            key = self._key(self.ratings[index])
+            return self.rank_index.total - self.rank_index.count_at_most(key) + 1
+
+    def top(self, count):
+        """Return [(rank, username, rating)] for the best `count` players"""
+        entries = []
+        with self.lock:
+            total = self.rank_index.total
+            remaining = min(count, total)
+            k = total  # Walk down from the highest rating
+            while remaining > 0 and k > 0:
+                key = self.rank_index.find_by_order(k)
+                players = sorted(self.rank_index.members[key], key=lambda p: -self.ratings[p])
+                rank = total - k + 1
+                for player in players[:remaining]:
+                    entries.append((rank, self.names[player], round(self.ratings[player])))
+                remaining -= min(len(players), remaining)
+                k -= len(players)
+        return entries
+
+    def total_players(self):
+        return len(self.names)
+
+    def save_snapshot(self):
+        """Write the rating table to disk atomically"""
+        with self.lock:
+            rows = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(self.names))]
+            for index, name in enumerate(self.names):
+                encoded = name.encode("utf-8")
+                rows.append(struct.pack("<H", len(encoded)) + encoded)
+                rows.append(SNAPSHOT_ROW.pack(self.ratings[index], self.rds[index], self.games_played[index]))
+            self.dirty = False
+        temp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(b"".join(rows))
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Error saving rating snapshot: {e}")
+
+    def load_snapshot(self):
+        """Load a previously saved rating table, if one exists"""
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            print(f"Error loading rating snapshot: {e}")
+            return
+
+        try:
+            magic, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+            if magic != SNAPSHOT_MAGIC:
+                print("Ignoring rating snapshot with unknown format")
+                return
+            offset = SNAPSHOT_HEADER.size
+            for _ in range(count):
+                (length,) = struct.unpack_from("<H", data, offset)
+                offset += 2
+                name = data[offset:offset + length].decode("utf-8")
+                offset += length
+                rating, rd, played = SNAPSHOT_ROW.unpack_from(data, offset)
+                offset += SNAPSHOT_ROW.size
+                index = self._player(name)
+                self.rank_index.add(self._key(self.ratings[index]), index, -1)
+                self.rank_index.add(self._key(rating), index, 1)
+                self.ratings[index] = rating
+                self.rds[index] = rd
+                self.games_played[index] = played
+        except (struct.error, UnicodeDecodeError) as e:
+            print(f"Error reading rating snapshot: {e}")
+            return
+        print(f"Loaded {len(self.names)} ratings from {self.snapshot_path}")
@@ -0,0 +1,151 @@
+import threading
+
+import rules
+
+
+class Room:
+    """Everything the server knows about one room.
+
+    players and spectators are dicts used as insertion-ordered sets
+    (username -> None), so membership tests, joins and leaves are O(1) while
+    users are still listed in the order they arrived. The first two users to
+    join are seated as players; everyone after them watches until a seat
+    frees up.
+    """
+    SEATS = 2
+
+    def __init__(self, name, geometry=None):
+        self.name = name
+        self.geometry = geometry or (rules.ROWS, rules.COLUMNS, rules.CONNECT)  # (rows, columns, connect)
+        self.players = {}
+        self.spectators = {}
+        self.ready = {}  # username -> ready flag, players only
+        self.bots = {}  # AI player name -> search tier; bots are always ready
+        self.game = None
+        self.takeback = None  # (requester, game, move count) while a takeback awaits an answer
+        self.lock = threading.RLock()  # Serializes game changes with their broadcasts
+
+    def __contains__(self, username):
+        return username in self.players or username in self.spectators
+
+    def __len__(self):
+        return len(self.players) + len(self.spectators)
+
+    def users(self):
+        """All users in the room, players first"""
+        return list(self.players) + list(self.spectators)
+
+    def add(self, username):
+        if username in self:
+            return False
+        if len(self.players) < self.SEATS:
+            self.players[username] = None
+            self.ready[username] = False
+        else:
+            self.spectators[username] = None
+        return True
+
+    def remove(self, username):
+        if username in self.players:
+            del self.players[username]
+            self.ready.pop(username, None)
+            # Seat the longest-waiting spectator
+            if self.spectators:
+                promoted = next(iter(self.spectators))
+                del self.spectators[promoted]
+                self.players[promoted] = None
+                self.ready[promoted] = False
+            return True
+        if username in self.spectators:
+            del self.spectators[username]
+            return True
+        return False
+
+    def reset_ready(self):
+        for username in self.ready:
+            self.ready[username] = username in self.bots
+
+    def all_ready(self):
+        return len(self.players) == self.SEATS and all(self.ready.values())
+
+
+class RoomRegistry:
+    """Connected clients, rooms and a reverse username -> rooms index.
+
+    The reverse index lets a disconnect find the user's rooms directly
+    instead of scanning every room on the server.
+    """
+
+    def __init__(self):
+        self.clients = {}  # username -> client socket
+        self.rooms = {}  # room name -> Room, in creation order
+        self.user_rooms = {}  # username -> dict of room names used as an ordered set
+        self.lock = threading.RLock()
+
+    def add_client(self, username, client_socket):
+        with self.lock:
+            self.clients[username] = client_socket
+
+    def remove_client(self, username):
+        """Forget a client and return the names of the rooms they were in"""
+        with self.lock:
+            self.clients.pop(username, None)
+            return list(self.user_rooms.get(username, ()))
+
+    def rooms_of(self, username):
+        with self.lock:
+            return list(self.user_rooms.get(username, ()))
+
+    def socket_of(self, username):
+        return self.clients.get(username)
+
+    def sockets(self):
+        with self.lock:
+            return list(self.clients.values())
+
+    def room_names(self):
+        with self.lock:
+            return list(self.rooms)
+
+    def get_room(self, room_name):
+        return self.rooms.get(room_name)
+
+    def users_in(self, room_name):
+        room = self.rooms.get(room_name)
+        return room.users() if room else []
+
+    def create_room(self, room_name, geometry=None):
+        """Return the named room, creating it with the given geometry if needed"""
+        with self.lock:
+            room = self.rooms.get(room_name)
+            if room is None:
+                room = self.rooms[room_name] = Room(room_name, geometry)
+            return room
+
+    def join(self, room_name, username):
+        """Add a user to a room (creating it if needed) and return the room"""
+        with self.lock:
+            room = self.create_room(room_name)
+            if room.add(username):
+                self.user_rooms.setdefault(username, {})[room_name] = None
+            return room
+
+    def leave(self, room_name, username):
+        """Remove a user from a room.
+
+        Returns (room, deleted): room is None if the user was not in it, and
+        deleted is True when the room became empty and was removed.
+        """
+        with self.lock:
+            room = self.rooms.get(room_name)
+            if room is None or not room.remove(username):
+                return None, False
+            memberships = self.user_rooms.get(username)
+            if memberships is not None:
+                memberships.pop(room_name, None)
+                if not memberships:
+                    del self.user_rooms[username]
+            if not room:
+                del self.rooms[room_name]
+                return room, True
+            return room, False
@@ -0,0 +1,142 @@
+"""Winning-line tables and bitboard layouts, built once per board geometry.
+
+Cells are addressed as (row, column) with row 0 at the bottom, or as a flat
+index row * columns + column. Bitboards are column-major with one spare bit
+on top of each column, so bit column * (rows + 1) + row is a cell and a line
+can be found with a few shifts in any direction.
+"""
+
+ROWS = 6
+COLUMNS = 7
+CONNECT = 4
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (-1, 1))  # Horizontal, vertical and both diagonals
+
+MIN_SIZE = 4
+MAX_ROWS = 9
+MAX_COLUMNS = 9  # Columns are picked with the number keys 1-9
+
+# Variants offered by the client: name -> (rows, columns, connect)
+VARIANTS = {
+    "Standard 7x6": (6, 7, 4),
+    "Large 8x7": (7, 8, 4),
+    "Wide 9x7": (7, 9, 4),
+    "Connect 5 (9x6)": (6, 9, 5),
+}
+
+
+def valid_geometry(rows, columns, connect):
+    return (isinstance(rows, int) and isinstance(columns, int) and isinstance(connect, int)
+            and MIN_SIZE <= rows <= MAX_ROWS and MIN_SIZE <= columns <= MAX_COLUMNS
+            and 3 <= connect <= max(rows, columns))
+
+
+def build_lines(rows, columns, connect):
+    """Return every winning line as a tuple of (row, column) cells"""
+    lines = []
+    for row in range(rows):
+        for col in range(columns):
+            for d_row, d_col in DIRECTIONS:
+                end_row = row + d_row * (connect - 1)
+                end_col = col + d_col * (connect - 1)
+                if 0 <= end_row < rows and 0 <= end_col < columns:
+                    lines.append(tuple((row + d_row * i, col + d_col * i) for i in range(connect)))
+    return lines
+
+
+class Rules:
+    """Line tables for one geometry; get one from get_rules() so it is built only once"""
+
+    def __init__(self, rows, columns, connect):
+        self.rows = rows
+        self.columns = columns
+        self.connect = connect
+        self.cells = rows * columns
+        self.height = rows + 1  # Bits per bitboard column, including the spare top bit
+
+        self.lines = build_lines(rows, columns, connect)  # 69 lines on the standard board
+        self.windows = [tuple(row * columns + col for row, col in line) for line in self.lines]
+        self.line_masks = [sum(1 << self.bit(row, col) for row, col in line) for line in self.lines]
+        # Flat cell index -> the lines through that cell, as (row, column) cells and as flat indices
+        self.cell_lines = [[] for _ in range(self.cells)]
+        self.cell_windows = [[] for _ in range(self.cells)]
+        for line, window in zip(self.lines, self.windows):
+            for index in window:
+                self.cell_lines[index].append(line)
+                self.cell_windows[index].append(window)
+        self.cell_lines = [tuple(lines) for lines in self.cell_lines]
+        self.cell_windows = [tuple(windows) for windows in self.cell_windows]
+
+        self.bottom_mask = sum(1 << (col * self.height) for col in range(columns))
+        self.board_mask = self.bottom_mask * ((1 << rows) - 1)
+        self.shifts = (self.height, 1, self.height + 1, self.height - 1)  # One per direction
+        self.move_order = sorted(range(columns), key=lambda col: abs(2 * col - (columns - 1)))  # Center first
+
+        # Sum encoding for search code: a cell holds 0, pieces[0] or pieces[1];
+        # pieces[1] is larger than a full line of pieces[0], so the sum of a
+        # window tells how many chips of each player it has
+        self.pieces = (1, connect + 1)
+
+    def bit(self, row, col):
+        return col * self.height + row
+
+    def bitboard(self, grid, player_id):
+        """Bitboard of the cells a player occupies"""
+        mask = 0
+        for row, cells in enumerate(grid):
+            for col, cell in enumerate(cells):
+                if cell == player_id:
+                    mask |= 1 << (col * self.height + row)
+        return mask
+
+    def has_line(self, bitboard):
+        """True if the bitboard contains connect chips in a row in any direction"""
+        for shift in self.shifts:
+            mask = bitboard
+            length = 1
+            # Doubling: after each step mask marks the starts of runs twice as long
+            while length * 2 <= self.connect:
+                mask &= mask >> (shift * length)
+                length *= 2
+            if length < self.connect:
+                # Overlap two runs of length to cover the whole line
+                mask &= mask >> (shift * (self.connect - length))
+            if mask:
+                return True
+        return False
+
+    def check_win(self, grid, player_id):
+        """Check the whole grid for a completed line of player_id"""
+        return self.has_line(self.bitboard(grid, player_id))
+
+    def winning_line(self, grid, row, col):
+        """Return the completed line through (row, col) for the chip there, or None
+
+        Only the lines through the last move can have been completed by it, so
+        this is all a move needs to check.
+        """
+        player_id = grid[row][col]
+        if player_id is None:
+            return None
+        for line in self.cell_lines[row * self.columns + col]:
+            if all(grid[r][c] == player_id for r, c in line):
+                return line
+        return None
+
+
+_rules_cache = {}
+
+
+def get_rules(rows=ROWS, columns=COLUMNS, connect=CONNECT):
+    """Return the shared Rules for a geometry, building its tables on first use"""
+    key = (rows, columns, connect)
+    rules = _rules_cache.get(key)
+    if rules is None:
+        rules = _rules_cache.setdefault(key, Rules(rows, columns, connect))
+    return rules
+
+
+def rules_for_grid(grid, connect=CONNECT):
+    return get_rules(len(grid), len(grid[0]), connect)
+
+
+STANDARD = get_rules()
@@ -1,441 +1,907 @@
+import argparse
+import selectors
+import signal
 import socket
 import threading
-import pickle
 import sys
-import random
-
-class Connect4Game:
-    def __init__(self, room_name, players):
-        self.room_name = room_name
-        self.players = players  # List of usernames
-        self.ROWS = 6
-        self.COLUMNS = 7
-        self.grid = [[None for i in range(self.COLUMNS)] for j in range(self.ROWS)]
-        self.current_player = 0
-        self.game_over = False
-        self.winner = None
-        
-        # Randomly assign player IDs
-        random.shuffle(self.players)
-        print(f"Game started in room {room_name}: {self.players[0]} (Red) vs {self.players[1]} (Yellow)")
-
-    def add_chip(self, player_username, column):
-        """Add a chip to the board and return the row it landed in, or -1 if invalid"""
-        if self.game_over:
-            return -1
-            
-        # Check if it's the correct player's turn
-        if self.players[self.current_player] != player_username:
-            return -1
-            
-        # Find the lowest available row in the column
-        for row in range(self.ROWS):
-            if self.grid[row][column] is None:
-                self.grid[row][column] = self.current_player
-                
-                # Check for win
-                if self.check_win(self.current_player):
-                    self.game_over = True
-                    self.winner = player_username
-                else:
-                    # Switch players
-                    self.current_player = (self.current_player + 1) % 2
-                    
-                return row
-        return -1  # Column is full
-
-    def check_win(self, player_id):
-        """Check if the given player has won"""
-        # Check horizontal
-        for c in range(self.COLUMNS - 3):
-            for r in range(self.ROWS):
-                if (self.grid[r][c] == player_id and self.grid[r][c+1] == player_id and 
-                    self.grid[r][c+2] == player_id and self.grid[r][c+3] == player_id):
-                    return True
-
-        # Check vertical
-        for c in range(self.COLUMNS):
-            for r in range(self.ROWS - 3):
-                if (self.grid[r][c] == player_id and self.grid[r+1][c] == player_id and 
-                    self.grid[r+2][c] == player_id and self.grid[r+3][c] == player_id):
-                    return True
-
-        # Check positive diagonal
-        for c in range(self.COLUMNS - 3):
-            for r in range(self.ROWS - 3):
-                if (self.grid[r][c] == player_id and self.grid[r+1][c+1] == player_id and 
-                    self.grid[r+2][c+2] == player_id and self.grid[r+3][c+3] == player_id):
-                    return True
-
-        # Check negative diagonal
-        for c in range(self.COLUMNS - 3):
-            for r in range(3, self.ROWS):
-                if (self.grid[r][c] == player_id and self.grid[r-1][c+1] == player_id and 
-                    self.grid[r-2][c+2] == player_id and self.grid[r-3][c+3] == player_id):
-                    return True
-
-        return False
-
-    def get_game_state(self):
-        """Return the current game state"""
-        return {
-            "grid": self.grid,
-            "current_player": self.players[self.current_player] if not self.game_over else None,
-            "current_player_id": self.current_player,
-            "game_over": self.game_over,
-            "winner": self.winner,
-            "players": self.players
-        }
+import time
+import itertools
+from engine import Connect4Game
+import rules
+from matchmaking import Matchmaker
+from rating import RatingEngine
+from registry import RoomRegistry
+from metrics import Metrics
+from ratelimit import ConnectionLimiter, DEFAULT_CONNECTION_LIMIT
+from protocol import encode_message, FrameDecoder
+from chat_history import ChatHistoryStore
+from ai_executor import AIExecutor
+from snapshot import SnapshotStore, restore_room, RESUME_GRACE
+from tracing import Tracer
+import handoff
+import config
+import evaluation
+
+DRAIN_SPREAD = 10.0  # Seconds over which idle users are moved to the new server
+DRAIN_TIMEOUT = 600.0  # Longest a draining server waits for its games to finish
+LISTEN_BACKLOG = socket.SOMAXCONN  # Pending connections the kernel queues during a login burst
 
 class ChatServer:
-    def __init__(self, host, port):
+    def __init__(self, host, port, connection_limit=DEFAULT_CONNECTION_LIMIT, command_limits=None,
+                 listener=None, predecessor=None, backlog=LISTEN_BACKLOG, settings=None):
         self.host = host
         self.port = port
+        self.connection_limit = connection_limit
+        self.command_limits = command_limits  # None uses ratelimit.DEFAULT_COMMAND_LIMITS
+        # Everything else tunable comes from config; host, port and limits above take precedence
+        self.settings = settings = config.defaults() if settings is None else settings
+        self.log_level = config.LOG_LEVELS[settings["server"]["log_level"]]
+        self.recv_buffer = settings["server"]["recv_buffer"]
+        self.max_frame_size = settings["server"]["max_frame_size"]
+        tracing_settings = settings["tracing"]
+        self.tracer = Tracer(tracing_settings["slow_request_ms"], tracing_settings["trace_path"],
+                             tracing_settings["trace_max_events"], log=lambda text: self.log(config.WARNING, text))
+        self.metrics = Metrics()
         self.server_socket = None
-        self.clients = {}  # Dictionary to store client sockets by username
-        self.rooms = {}   # Dictionary to store room names and their users
-        self.ready_users = {}  # Dictionary to store ready status by room
-        self.games = {}   # Dictionary to store active games by room
-        self.running = True  # Add this flag
+        self.registry = RoomRegistry()  # Clients, rooms, ready flags and games
+        self.chat_history = ChatHistoryStore(settings["persistence"]["chat_history_dir"])  # Recent chat per room, replayed to late joiners
+        self.send_locks = {}  # client socket -> lock so frames from different threads never interleave
+        self.backlog = backlog
+        self.running = True
+        self.stopped = threading.Event()  # Set once shutdown() has finished
+        self.shutdown_lock = threading.Lock()
+        # Writing a byte to the waker interrupts the accept loop's select()
+        self.waker, self.wake_receiver = socket.socketpair()
+        self.match_counter = itertools.count(1)
+        self.matchmaker = Matchmaker(on_match=self.start_matched_game, **settings["queue"])
+        persistence = settings["persistence"]
+        self.ratings = RatingEngine(persistence["ratings_path"], persistence["rating_period"],
+                                    persistence["rating_snapshot_interval"])
+        # AI opponents search in worker processes, never on client threads
+        self.ai = AIExecutor(settings["workers"]["ai_workers"], niceness=settings["workers"]["ai_niceness"],
+                             tiers=config.ai_tiers(settings))
+        # Rooms and games survive a restart
+        self.snapshots = SnapshotStore(persistence["snapshot_path"], persistence["snapshot_interval"])
+        self.away = set()  # Restored users whose seats are held until they reconnect
+        self.listener = listener  # Listening socket taken over from a previous server, if any
+        self.predecessor = predecessor  # Channel the previous server forwards game results on
+        self.successor = None  # Channel to the server that took our listening socket
+        self.draining = False
+        self.drained = threading.Event()  # Set when the last client leaves a draining server
+        self.handoff = None
+        self.restore_snapshot()
         self.init_server()
 
     def init_server(self):
         """Initialize the server socket and start listening for connections."""
-        try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            print(f"Server started on {self.host}:{self.port}")
-        except Exception as e:
-            print(f"Error starting server: {e}")
+        handoff_path = self.settings["server"]["handoff_path"]
+        if handoff.supported() and handoff.in_use(handoff_path):
+            # Probably a second server started by mistake; exit before touching the running one's files
+            self.log(config.ERROR, f"Another server is already running with handoff path {handoff_path}")
             sys.exit(1)
+        if self.listener is not None:
+            self.server_socket = self.listener
+            self.log(config.INFO, f"Server took over the listening socket on {self.server_socket.getsockname()}")
+        else:
+            try:
+                self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.server_socket.bind((self.host, self.port))
+                self.server_socket.listen(self.backlog)
+                self.log(config.INFO, f"Server started on {self.host}:{self.port}")
+            except Exception as e:
+                self.log(config.ERROR, f"Error starting server: {e}")
+                sys.exit(1)
 
         # Start accepting client connections
-        threading.Thread(target=self.accept_connections).start()
+        self.accept_thread = threading.Thread(target=self.accept_connections)
+        self.accept_thread.start()
+        self.matchmaker.start()
+        self.ratings.start()
+        self.snapshots.start(self.registry)
+        if self.predecessor is not None:
+            threading.Thread(target=handoff.receive_results, args=(self.predecessor, self.ratings.record_result),
+                             daemon=True).start()
+        if handoff.supported():
+            try:
+                self.handoff = handoff.HandoffServer(self.settings["server"]["handoff_path"], self.begin_drain,
+                                                     self.finish_handoff)
+            except OSError as e:
+                self.log(config.ERROR, f"Error starting handoff listener: {e}")
+
+    def restore_snapshot(self):
+        """Bring back the rooms and games saved by the previous run"""
+        for saved in self.snapshots.load():
+            room = restore_room(self.registry, saved)
+            self.away.update(user for user in room.users() if user not in room.bots)
+            with room.lock:
+                self.schedule_ai_move(room)
+        if self.away:
+            timer = threading.Timer(RESUME_GRACE, self.release_away)
+            timer.daemon = True
+            timer.start()
 
     def accept_connections(self):
-        """Accept incoming client connections in a separate thread."""
-        while self.running:  # Change from 'while True'
+        """Accept incoming client connections in a separate thread.
+
+        The thread sleeps in select() until a connection arrives or wake_acceptor()
+        is called, then accepts every pending connection before sleeping again.
+        """
+        self.server_socket.setblocking(False)
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.server_socket, selectors.EVENT_READ)
+            selector.register(self.wake_receiver, selectors.EVENT_READ)
+            while self.running and not self.draining:
+                try:
+                    events = selector.select()
+                except OSError as e:
+                    if self.running:
+                        self.log(config.ERROR, f"Error waiting for connections: {e}")
+                    break
+                for key, _ in events:
+                    if key.fileobj is self.wake_receiver:
+                        self.wake_receiver.recv(64)
+                    elif not self.accept_pending():
+                        return
+
+    def accept_pending(self):
+        """Accept connections until the queue is empty; returns False if the socket failed"""
+        while self.running and not self.draining:
             try:
-                self.server_socket.settimeout(1.0)  # Add timeout
                 client_socket, addr = self.server_socket.accept()
-                print(f"New connection from {addr}")
-                threading.Thread(target=self.handle_client, args=(client_socket, addr)).start()
-            except socket.timeout:
-                continue  # Expected timeout, just continue
-            except Exception as e:
-                if self.running:  # Only print error if still running
-                    print(f"Error accepting connection: {e}")
-                break
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                if self.running:
+                    self.log(config.ERROR, f"Error accepting connection: {e}")
+                return False
+            client_socket.setblocking(True)
+            self.log(config.INFO, f"New connection from {addr}")
+            threading.Thread(target=self.handle_client, args=(client_socket, addr)).start()
+        return True
+
+    def log(self, level, text):
+        if level >= self.log_level:
+            print(text)
+
+    def wake_acceptor(self):
+        try:
+            self.waker.send(b"\0")
+        except OSError:
+            pass
+
+    def begin_drain(self):
+        """Stop accepting and save state for the new server; returns the listening socket
+
+        Rooms without a game in progress reach the new server through the
+        snapshot. Games still being played finish here first.
+        """
+        self.log(config.INFO, "Draining: handing the listening socket to a new server")
+        self.draining = True
+        self.wake_acceptor()
+        self.accept_thread.join()
+        self.matchmaker.stop()
+        self.snapshots.stop(save=False)
+        self.snapshots.save(exclude=self.active_rooms())
+        self.ratings.stop()  # The new server loads the ratings saved here
+        return self.server_socket
+
+    def finish_handoff(self, channel, ok):
+        """Move idle users over once the new server has the socket, then wait for games to end"""
+        if not ok:
+            self.log(config.WARNING, "Handoff failed; accepting connections again")
+            self.draining = False
+            self.accept_thread = threading.Thread(target=self.accept_connections)
+            self.accept_thread.start()
+            self.matchmaker.start()
+            self.ratings.start()
+            self.snapshots.start(self.registry)
+            return
+        self.successor = channel
+        playing = {user for room_name in self.active_rooms() for user in self.registry.users_in(room_name)}
+        self.migrate_users([user for user in list(self.registry.clients) if user not in playing])
+        threading.Thread(target=self.wait_for_drain, daemon=True).start()
+
+    def active_rooms(self):
+        return [room.name for room in list(self.registry.rooms.values())
+                if room.game is not None and not room.game.game_over]
+
+    def migrate_users(self, usernames, spread=DRAIN_SPREAD):
+        """Ask users to reconnect to the new server, spread out so they do not all arrive at once"""
+        for i, username in enumerate(usernames):
+            client_socket = self.registry.socket_of(username)
+            if client_socket is not None:
+                self.send_message(client_socket, {
+                    "Command": "Server_Moving",
+                    "Delay": round(1.0 + spread * i / len(usernames), 2)
+                })
+
+    def wait_for_drain(self):
+        if self.registry.clients:
+            self.drained.wait(DRAIN_TIMEOUT)
+        self.log(config.INFO, "Drained; shutting down")
+        self.shutdown()
+
+    def record_result(self, player_a, player_b, score_a):
+        """Rate a finished game here, or on the new server once we have handed off"""
+        if self.successor is not None:
+            try:
+                handoff.send_result(self.successor, player_a, player_b, score_a)
+                return
+            except OSError as e:
+                self.log(config.ERROR, f"Error forwarding game result: {e}")
+        self.ratings.record_result(player_a, player_b, score_a)
 
     def handle_client(self, client_socket, addr):
         """Handle communication with a connected client."""
         username = None
+        limiter = ConnectionLimiter(self.connection_limit, self.command_limits)
+        decoder = FrameDecoder(self.max_frame_size)
         while True:
             try:
-                data = client_socket.recv(1048576)
+                data = client_socket.recv(self.recv_buffer)
                 if not data:
-                    print(f"Client {addr} disconnected")
+                    self.log(config.INFO, f"Client {addr} disconnected")
                     break
-                message = pickle.loads(data)
-                if not message:
-                    continue
-                print(f"Received from {addr}: {message}")
-
-                # Process client commands
-                if message["Command"] == "Check_Username":
-                    username = message["User_Name"]
-                    self.clients[username] = client_socket
-                    response = {
-                        "Command": "Check_Username",
-                        "Status": "Valid",
-                        "Users_In_Room": []
-                    }
-                    self.send_message(client_socket, response)
-                    self.broadcast_room_state()
-
-                elif message["Command"] == "Request_Room_State":
-                    self.send_message(client_socket, {
-                        "Command": "Room_State",
-                        "Available_Rooms": list(self.rooms.keys()),
-                        "Users_In_Room": self.rooms.get(message.get("Room_Name", ""), [])
-                    })
+                decode_start = time.perf_counter_ns()
+                messages = decoder.feed(data)
+                decode = (decode_start, time.perf_counter_ns())
+                for message in messages:
+                    if not message:
+                        continue
+                    # Reject over-limit traffic before doing any work for it
+                    command = message.get("Command")
+                    if not limiter.allow(command):
+                        self.metrics.increment("rate_limited")
+                        self.metrics.increment(f"rate_limited.{command}")
+                        if limiter.should_notify(command):
+                            notice = {
+                                "Command": "Rate_Limited",
+                                "Rejected_Command": command,
+                                "Retry_After": limiter.retry_after(command)
+                            }
+                            if command == "Game_Move":
+                                # Lets the client roll back the chip it predicted, without sending the board
+                                notice["Room_Name"] = message.get("Room_Name")
+                                notice["Move_Seq"] = message.get("Move_Seq")
+                            self.send_message(client_socket, notice)
+                        continue
+                    with self.tracer.request(command, decode, client=addr, user=username):
+                        decode = None  # Decoding is charged to the first message of the batch
+                        if self.log_level <= config.DEBUG:  # Skip formatting the message unless it is shown
+                            print(f"Received from {addr}: {message}")
+
+                        # Process client commands
+                        if message["Command"] == "Check_Username":
+                            username = message["User_Name"]
+                            # A user whose seats survived a restart gets them back with their token
+                            resumed = username in self.away and self.snapshots.check_token(username, message.get("Token"))
+                            self.registry.add_client(username, client_socket)
+                            if username in self.away:
+                                self.away.discard(username)
+                                if not resumed:
+                                    self.release_seats(username)
+                            if not resumed:
+                                self.snapshots.forget_token(username)  # Every fresh login gets a new token
+                            response = {
+                                "Command": "Check_Username",
+                                "Status": "Valid",
+                                "Users_In_Room": [],
+                                "Token": self.snapshots.issue_token(username),
+                                "Resumed": resumed
+                            }
+                            if resumed:
+                                response["Rooms"] = self.registry.rooms_of(username)
+                            self.send_message(client_socket, response)
+                            self.broadcast_room_state()
+                            if resumed:
+                                self.resume_rooms(username, client_socket)
+
+                        elif message["Command"] == "Request_Room_State":
+                            self.send_message(client_socket, {
+                                "Command": "Room_State",
+                                "Available_Rooms": self.registry.room_names(),
+                                "Users_In_Room": self.registry.users_in(message.get("Room_Name", ""))
+                            })
                     
-                elif message["Command"] == "Create_Room":
-                    room_name = message["Room_Name"]
-                    username = message["User_Name"]
-                    print(f"Creating room {room_name} for user {username}")
-                    self.create_room(room_name, username)
-                    self.broadcast_room_state()
-
-                elif message["Command"] == "Join_Room":
-                    room_name = message["Room_Name"]
-                    username = message["User_Name"]
-                    print(f"User {username} joining room {room_name}")
-                    self.join_room(room_name, username)
-                    response = {
-                        "Command": "Join_Room",
-                        "Room_Name": room_name,
-                        "User_Name": username,
-                        "Users_In_Room": self.rooms.get(room_name, [])
-                    }
-                    self.broadcast_to_room(room_name, response)
-                    self.broadcast_to_room(room_name, {
-                        "Command": "Room_State",
-                        "Available_Rooms": list(self.rooms.keys()),
-                        "Users_In_Room": self.rooms.get(room_name, [])
-                    })
-                    self.broadcast_to_room(room_name, {
-                        "Command": "Sending_Message",
-                        "Room_Name": room_name,
-                        "User_Name": username,
-                        "Text": f"{username} has joined the room."
-                    })
-
-                elif message["Command"] == "Sending_Message":
-                    room_name = message["Room_Name"]
-                    username = message["User_Name"]
-                    text = message["Text"]
-                    text_checker = f"{username} has left the room."
-                    if text == text_checker and room_name in self.rooms:
-                        if username in self.rooms[room_name]:
-                            self.rooms[room_name].remove(username)
-                            # Remove from ready users
-                            if room_name in self.ready_users and username in self.ready_users[room_name]:
-                                del self.ready_users[room_name][username]
-                            print(f"Removed {username} from room {room_name}")
-                            if not self.rooms[room_name]:
-                                del self.rooms[room_name]
-                                if room_name in self.ready_users:
-                                    del self.ready_users[room_name]
-                                if room_name in self.games:
-                                    del self.games[room_name]
-                                print(f"Deleted empty room {room_name}")
-                                self.broadcast_room_state()
-                            else:
-                                self.broadcast_to_room(room_name, {
-                                    "Command": "Room_State",
-                                    "Available_Rooms": list(self.rooms.keys()),
-                                    "Users_In_Room": self.rooms[room_name]
-                                })
-                                self.broadcast_to_room(room_name, {
-                                    "Command": "Sending_Message",
+                        elif message["Command"] == "Create_Room":
+                            room_name = message["Room_Name"]
+                            username = message["User_Name"]
+                            geometry = (message.get("Rows", rules.ROWS), message.get("Columns", rules.COLUMNS),
+                                        message.get("Connect", rules.CONNECT))
+                            if not rules.valid_geometry(*geometry):
+                                self.log(config.WARNING, f"Refusing room {room_name} with unsupported board {geometry}")
+                                continue
+                            self.log(config.INFO, f"Creating room {room_name} for user {username}")
+                            self.leave_match_queue(client_socket, username)
+                            self.create_room(room_name, username, geometry)
+                            self.broadcast_room_state()
+
+                        elif message["Command"] == "Join_Room":
+                            room_name = message["Room_Name"]
+                            username = message["User_Name"]
+                            self.log(config.INFO, f"User {username} joining room {room_name}")
+                            self.leave_match_queue(client_socket, username)
+                            self.join_room(room_name, username)
+                            response = {
+                                "Command": "Join_Room",
+                                "Room_Name": room_name,
+                                "User_Name": username,
+                                "Users_In_Room": self.registry.users_in(room_name)
+                            }
+                            self.broadcast_to_room(room_name, response)
+                            self.broadcast_to_room(room_name, {
+                                "Command": "Room_State",
+                                "Available_Rooms": self.registry.room_names(),
+                                "Users_In_Room": self.registry.users_in(room_name)
+                            })
+                            backlog = self.chat_history.backlog(room_name)
+                            if backlog:
+                                self.send_message(client_socket, {
+                                    "Command": "Chat_Backlog",
                                     "Room_Name": room_name,
-                                    "User_Name": username,
-                                    "Text": text
+                                    "Messages": backlog
                                 })
-                    else:
-                        self.broadcast_room_state()
-                        self.broadcast_to_room(room_name, {
-                            "Command": "Sending_Message",
-                            "Room_Name": room_name,
-                            "User_Name": username,
-                            "Text": text
-                        })
-
-                elif message["Command"] == "Ready_Status":
-                    room_name = message["Room_Name"]
-                    username = message["User_Name"]
-                    ready = message["Ready"]
-                    self.handle_ready_status(room_name, username, ready)
-
-                elif message["Command"] == "Game_Move":
-                    room_name = message["Room_Name"]
-                    username = message["User_Name"]
-                    column = message["Column"]
-                    self.handle_game_move(room_name, username, column)
-
-                elif message["Command"] == "Restart_Game":
-                    room_name = message["Room_Name"]
-                    username = message["User_Name"]
-                    self.handle_restart_game(room_name, username)
+                            self.post_chat(room_name, username, f"{username} has joined the room.")
+
+                        elif message["Command"] == "Sending_Message":
+                            room_name = message["Room_Name"]
+                            username = message["User_Name"]
+                            text = message["Text"]
+                            text_checker = f"{username} has left the room."
+                            if text == text_checker and self.registry.get_room(room_name) is not None:
+                                self.leave_room(room_name, username, text)
+                            else:
+                                self.broadcast_room_state()
+                                self.post_chat(room_name, username, text)
+
+                        elif message["Command"] == "Ready_Status":
+                            room_name = message["Room_Name"]
+                            username = message["User_Name"]
+                            ready = message["Ready"]
+                            self.handle_ready_status(room_name, username, ready)
+
+                        elif message["Command"] == "Game_Move":
+                            room_name = message["Room_Name"]
+                            username = message["User_Name"]
+                            column = message["Column"]
+                            self.handle_game_move(room_name, username, column, message.get("Move_Seq"))
+
+                        elif message["Command"] == "Restart_Game":
+                            room_name = message["Room_Name"]
+                            username = message["User_Name"]
+                            self.handle_restart_game(room_name, username)
+
+                        elif message["Command"] == "Add_Bot":
+                            room_name = message["Room_Name"]
+                            self.add_bot(room_name, message.get("Tier", "medium"))
+
+                        elif message["Command"] == "Request_Takeback":
+                            room_name = message["Room_Name"]
+                            username = message["User_Name"]
+                            self.handle_takeback_request(room_name, username)
+
+                        elif message["Command"] == "Takeback_Response":
+                            room_name = message["Room_Name"]
+                            username = message["User_Name"]
+                            self.handle_takeback_response(room_name, username, message.get("Accept", False))
+
+                        elif message["Command"] == "Queue_For_Match":
+                            username = message["User_Name"]
+                            rating = self.ratings.get_rating(username)
+                            queue_size = self.matchmaker.enqueue(username, rating)
+                            if queue_size is None:
+                                self.send_message(client_socket, {
+                                    "Command": "Queue_Status",
+                                    "Status": "Full",
+                                    "Queue_Size": self.matchmaker.queue_size()
+                                })
+                                continue
+                            self.send_message(client_socket, {
+                                "Command": "Queue_Status",
+                                "Status": "Queued",
+                                "Queue_Size": queue_size
+                            })
+
+                        elif message["Command"] == "Request_Leaderboard":
+                            self.send_message(client_socket, {
+                                "Command": "Leaderboard",
+                                "Entries": self.ratings.top(message.get("Count", 10)),
+                                "Total_Players": self.ratings.total_players()
+                            })
+
+                        elif message["Command"] == "Request_Rating":
+                            player = message.get("Player", message["User_Name"])
+                            self.send_message(client_socket, {
+                                "Command": "Rating",
+                                "User_Name": player,
+                                "Rating": round(self.ratings.get_rating(player)),
+                                "Rank": self.ratings.get_rank(player),
+                                "Total_Players": self.ratings.total_players()
+                            })
+
+                        elif message["Command"] == "Leave_Queue":
+                            username = message["User_Name"]
+                            self.matchmaker.dequeue(username)
+                            self.send_message(client_socket, {
+                                "Command": "Queue_Status",
+                                "Status": "Left",
+                                "Queue_Size": self.matchmaker.queue_size()
+                            })
                 
             except Exception as e:
-                print(f"Error handling client {addr}: {e}")
+                self.log(config.ERROR, f"Error handling client {addr}: {e}")
                 break
 
         # Cleanup when client disconnects
-        if username and username in self.clients:
-            print(f"Cleaning up for disconnected user {username}")
-            del self.clients[username]
-            for room_name, users in list(self.rooms.items()):
-                if username in users:
-                    users.remove(username)
-                    # Remove from ready users
-                    if room_name in self.ready_users and username in self.ready_users[room_name]:
-                        del self.ready_users[room_name][username]
-                    if not users:
-                        del self.rooms[room_name]
-                        if room_name in self.ready_users:
-                            del self.ready_users[room_name]
-                        if room_name in self.games:
-                            del self.games[room_name]
-                        print(f"Deleted empty room {room_name}")
-                        self.broadcast_room_state()
-                    else:
-                        self.broadcast_to_room(room_name, {
-                            "Command": "Join_Room",
-                            "Room_Name": room_name,
-                            "User_Name": username,
-                            "Users_In_Room": users
-                        })
-                        self.broadcast_to_room(room_name, {
-                            "Command": "Room_State",
-                            "Available_Rooms": list(self.rooms.keys()),
-                            "Users_In_Room": users
-                        })
-            if self.rooms:
+        if username:
+            self.matchmaker.dequeue(username)
+        if username and self.registry.socket_of(username) is client_socket and self.running:
+            # On shutdown the snapshot keeps the user's seats instead
+            self.log(config.INFO, f"Cleaning up for disconnected user {username}")
+            self.snapshots.forget_token(username)
+            for room_name in self.registry.remove_client(username):
+                self.leave_room(room_name, username)
+            if self.registry.rooms:
                 self.broadcast_room_state()
+            if self.draining and not self.registry.clients:
+                self.drained.set()
+        self.send_locks.pop(client_socket, None)
         try:
             client_socket.close()
         except:
             pass
 
-    def create_room(self, room_name, username):
+    def resume_rooms(self, username, client_socket):
+        """Send a reconnected user the state of every room they kept a seat in"""
+        for room_name in self.registry.rooms_of(username):
+            room = self.registry.get_room(room_name)
+            if room is None:
+                continue
+            with room.lock:
+                self.send_message(client_socket, {
+                    "Command": "Join_Room",
+                    "Room_Name": room_name,
+                    "User_Name": username,
+                    "Users_In_Room": room.users()
+                })
+                self.send_message(client_socket, {
+                    "Command": "Ready_Update",
+                    "Room_Name": room_name,
+                    "Ready_Users": room.ready
+                })
+                if room.game is not None:
+                    self.send_message(client_socket, {
+                        "Command": "Game_Start",
+                        "Room_Name": room_name,
+                        "Game_State": room.game.get_game_state()
+                    })
+
+    def release_seats(self, username):
+        """Give up every seat a user held, as if they had disconnected"""
+        for room_name in self.registry.rooms_of(username):
+            self.leave_room(room_name, username)
+
+    def release_away(self):
+        """Release the seats of restored users who did not come back in time"""
+        for username in list(self.away):
+            self.away.discard(username)
+            self.log(config.INFO, f"{username} did not reconnect; releasing their seats")
+            self.release_seats(username)
+
+    def create_room(self, room_name, username, geometry=None):
         """Create a new chat room without adding the user."""
-        if room_name not in self.rooms:
-            self.rooms[room_name] = []
-            self.ready_users[room_name] = {}
-            print(f"Created room {room_name} by user {username}")
+        if self.registry.get_room(room_name) is None:
+            self.registry.create_room(room_name, geometry)
+            self.log(config.INFO, f"Created room {room_name} by user {username}")
 
     def join_room(self, room_name, username):
         """Add a user to an existing chat room."""
-        if room_name not in self.rooms:
-            self.rooms[room_name] = []
-            self.ready_users[room_name] = {}
-        if username not in self.rooms[room_name]:
-            self.rooms[room_name].append(username)
-            self.ready_users[room_name][username] = False
+        return self.registry.join(room_name, username)
+
+    def leave_room(self, room_name, username, text=None):
+        """Remove a user from a room and tell the rest of the room.
+
+        text is the chat line announcing the departure; it is None when the
+        user disconnected without saying goodbye.
+        """
+        room, deleted = self.registry.leave(room_name, username)
+        if room is None:
+            return
+        self.log(config.INFO, f"Removed {username} from room {room_name}")
+        if not deleted and room.bots and all(user in room.bots for user in room.users()):
+            # Only AI players are left; they go with the last person
+            self.ai.cancel(room_name)
+            for bot in list(room.bots):
+                _, deleted = self.registry.leave(room_name, bot)
+            room.bots.clear()
+        if deleted:
+            self.chat_history.drop(room_name)
+            self.log(config.INFO, f"Deleted empty room {room_name}")
+            self.broadcast_room_state()
+            return
+
+        users = room.users()
+        if text is None:
+            self.broadcast_to_room(room_name, {
+                "Command": "Join_Room",
+                "Room_Name": room_name,
+                "User_Name": username,
+                "Users_In_Room": users
+            })
+        self.broadcast_to_room(room_name, {
+            "Command": "Room_State",
+            "Available_Rooms": self.registry.room_names(),
+            "Users_In_Room": users
+        })
+        if text is not None:
+            self.post_chat(room_name, username, text)
+
+    def post_chat(self, room_name, username, text):
+        """Record a chat line in the room's history and send it to the room"""
+        if self.registry.get_room(room_name) is not None:
+            self.chat_history.append(room_name, username, text)
+        self.broadcast_to_room(room_name, {
+            "Command": "Sending_Message",
+            "Room_Name": room_name,
+            "User_Name": username,
+            "Text": text
+        })
+
+    def start_matched_game(self, first_entry, second_entry):
+        """Create a room for two matched players and start their game right away"""
+        first, second = first_entry.username, second_entry.username
+        available = [entry for entry in (first_entry, second_entry)
+                     if self.registry.socket_of(entry.username) is not None
+                     and not self.registry.rooms_of(entry.username)]
+        if len(available) < 2:
+            # One of them left or took a seat elsewhere while waiting; put the other one back in line
+            for entry in available:
+                self.matchmaker.enqueue(entry.username, entry.rating)
+            return
+
+        room_name = f"Match {next(self.match_counter)}"
+        while self.registry.get_room(room_name) is not None:
+            room_name = f"Match {next(self.match_counter)}"
+        self.create_room(room_name, first)
+        self.join_room(room_name, first)
+        room = self.join_room(room_name, second)
+        with room.lock:  # Nobody may move before both players have Game_Start
+            room.game = Connect4Game(room_name, [first, second], *room.geometry)
+            self.log(config.INFO, f"Matched {first} and {second} in room {room_name}")
+
+            self.broadcast_to_room(room_name, {
+                "Command": "Queue_Status",
+                "Status": "Matched",
+                "Room_Name": room_name,
+                "Queue_Size": self.matchmaker.queue_size()
+            })
+            self.broadcast_to_room(room_name, {
+                "Command": "Join_Room",
+                "Room_Name": room_name,
+                "User_Name": second,
+                "Users_In_Room": room.users()
+            })
+            self.broadcast_room_state()
+            self.broadcast_to_room(room_name, {
+                "Command": "Game_Start",
+                "Room_Name": room_name,
+                "Game_State": room.game.get_game_state()
+            })
+
+    def reject_move(self, client_socket, room_name, move_seq):
+        """Send the authoritative game state so the client drops its predicted chip"""
+        room = self.registry.get_room(room_name)
+        if room is None:
+            return
+        with room.lock:
+            if room.game is None:
+                return
+            self.send_message(client_socket, {
+                "Command": "Move_Rejected",
+                "Room_Name": room_name,
+                "Move_Seq": move_seq,
+                "Game_State": room.game.get_game_state()
+            })
+
+    def leave_match_queue(self, client_socket, username):
+        """Take a player who picked a room themselves out of the match queue"""
+        if self.matchmaker.dequeue(username):
+            self.send_message(client_socket, {
+                "Command": "Queue_Status",
+                "Status": "Left",
+                "Queue_Size": self.matchmaker.queue_size()
+            })
 
     def handle_ready_status(self, room_name, username, ready):
         """Handle ready status changes and start game if all users ready"""
-        # Ensure the room exists and the user is in the room
-        if room_name in self.ready_users:
+        # Ensure the room exists and the user has a seat in it
+        room = self.registry.get_room(room_name)
+        if room is not None and username in room.players:
             #set the user's ready status
-            self.ready_users[room_name][username] = ready
+            room.ready[username] = ready
             
             # Broadcast ready status update
             self.broadcast_to_room(room_name, {
                 "Command": "Ready_Update",
                 "Room_Name": room_name,
-                "Ready_Users": self.ready_users[room_name]
+                "Ready_Users": room.ready
             })
             
-            # Check if we can start a game (exactly 2 players, both ready)
-            room_users = self.rooms.get(room_name, [])
-            if (len(room_users) == 2 and 
-                all(self.ready_users[room_name].get(user, False) for user in room_users)):
-                
-                # Start the game
-                self.games[room_name] = Connect4Game(room_name, room_users.copy())
-                
-                # Reset ready status
-                for user in room_users:
-                    self.ready_users[room_name][user] = False
+            # Check if we can start a game (both seats taken, both ready); a draining server starts none
+            if room.all_ready() and not self.draining:
                 
-                # Broadcast game start
-                self.broadcast_to_room(room_name, {
-                    "Command": "Game_Start",
-                    "Room_Name": room_name,
-                    "Game_State": self.games[room_name].get_game_state()
-                })
+                with room.lock:
+                    # Start the game
+                    room.game = Connect4Game(room_name, list(room.players), *room.geometry)
+                    
+                    # Reset ready status
+                    room.reset_ready()
+                    
+                    # Broadcast game start before any move can be broadcast
+                    self.broadcast_to_room(room_name, {
+                        "Command": "Game_Start",
+                        "Room_Name": room_name,
+                        "Game_State": room.game.get_game_state()
+                    })
+                    self.schedule_ai_move(room)
                 
-                print(f"Started Connect 4 game in room {room_name}")
+                self.log(config.INFO, f"Started Connect 4 game in room {room_name}")
 
-    def handle_game_move(self, room_name, username, column):
-        """Handle a game move from a player"""
-        if room_name not in self.games:
+    def handle_game_move(self, room_name, username, column, move_seq=None):
+        """Handle a game move from a player.
+
+        move_seq is the client's predicted sequence number for the move; it is
+        echoed back so the client can reconcile its local prediction.
+        """
+        room = self.registry.get_room(room_name)
+        if room is None or room.game is None:
             return
             
-        game = self.games[room_name] # Get the game instance for the room
-        row = game.add_chip(username, column) # Add the chip to the game board
+        # Hold the room lock so updates reach every client in move order
+        with room.lock:
+            game = room.game # Get the game instance for the room
+            with self.tracer.span("add_chip"):
+                row = game.add_chip(username, column) # Add the chip to the game board
         
-        if row != -1:  # Valid move
-            # Broadcast the move to all players in the room
-            self.broadcast_to_room(room_name, {
-                "Command": "Game_Update",
-                "Room_Name": room_name,
-                "Move": {
-                    "player": username,
-                    "column": column,
-                    "row": row
-                },
-                "Game_State": game.get_game_state()
-            })
-            #
-            #
-            #
-            #
-            #
-            #
-            #
-            #
-            # If game is over, send game over message
-            if game.game_over:
+            if row == -1:  # Invalid move, let the sender roll back its prediction
+                client_socket = self.registry.socket_of(username)
+                if client_socket is not None:
+                    self.reject_move(client_socket, room_name, move_seq)
+            else:  # Valid move
+                with self.tracer.span("get_game_state"):
+                    game_state = game.get_game_state()
+                # Broadcast the move to all players in the room
                 self.broadcast_to_room(room_name, {
-                    "Command": "Game_Over",
+                    "Command": "Game_Update",
                     "Room_Name": room_name,
-                    "Winner": game.winner,
-                    "Game_State": game.get_game_state()
+                    "Move": {
+                        "player": username,
+                        "column": column,
+                        "row": row,
+                        "seq": game.move_count
+                    },
+                    "Game_State": game_state
                 })
+                #
+                #
+                #
+                #
+                #
+                #
+                #
+                #
+                # If game is over, send game over message
+                if game.game_over:
+                    if any(player in room.bots for player in game.players):
+                        pass  # Games against the AI are not rated
+                    elif game.winner is not None:
+                        loser = game.players[1 - game.players.index(game.winner)]
+                        self.record_result(game.winner, loser, 1)
+                    else:
+                        self.record_result(game.players[0], game.players[1], 0.5)
+                    self.broadcast_to_room(room_name, {
+                        "Command": "Game_Over",
+                        "Room_Name": room_name,
+                        "Winner": game.winner,
+                        "Game_State": game.get_game_state()
+                    })
+                    if self.successor is not None:
+                        self.migrate_users(self.registry.users_in(room_name), spread=2.0)
+                else:
+                    self.schedule_ai_move(room)
 
     def handle_restart_game(self, room_name, username):
         """Handle game restart request"""
-        if room_name in self.games:
+        room = self.registry.get_room(room_name)
+        if room is None:
+            return
+        with room.lock:
+            if room.game is None:
+                return
             # Remove the current game
-            del self.games[room_name]
+            self.ai.cancel(room_name)
+            room.game = None
             
             # Reset ready status
-            if room_name in self.ready_users:
-                for user in self.ready_users[room_name]:
-                    self.ready_users[room_name][user] = False
+            room.reset_ready()
             
             # Broadcast restart
             self.broadcast_to_room(room_name, {
                 "Command": "Game_Restart",
                 "Room_Name": room_name,
-                "Ready_Users": self.ready_users.get(room_name, {})
+                "Ready_Users": room.ready
+            })
+
+    def handle_takeback_request(self, room_name, username):
+        """Ask a player's opponent to allow taking back the player's last move"""
+        room = self.registry.get_room(room_name)
+        if room is None:
+            return
+        with room.lock:
+            game = room.game
+            if game is None or game.game_over or username not in game.players:
+                return
+            # If the opponent has replied, their move goes back too
+            undo_count = 1 if game.players[game.current_player] != username else 2
+            if len(game.moves) < undo_count:
+                return
+            room.takeback = (username, game, game.move_count)
+            opponent = game.players[1 - game.players.index(username)]
+            if opponent in room.bots:
+                self.handle_takeback_response(room_name, opponent, True)
+                return
+            client_socket = self.registry.socket_of(opponent)
+            if client_socket is not None:
+                self.send_message(client_socket, {
+                    "Command": "Takeback_Request",
+                    "Room_Name": room_name,
+                    "User_Name": username
+                })
+
+    def handle_takeback_response(self, room_name, username, accept):
+        """Apply or refuse a pending takeback once the opponent answers"""
+        room = self.registry.get_room(room_name)
+        if room is None:
+            return
+        with room.lock:
+            if room.takeback is None:
+                return
+            requester, game, move_count = room.takeback
+            if username == requester or username not in game.players:
+                return
+            room.takeback = None
+            # The request is stale if the game or the position changed since it was made
+            if game is not room.game or game.move_count != move_count or game.game_over:
+                return
+            if accept:
+                self.ai.cancel(room_name)
+                undo_count = 1 if game.players[game.current_player] != requester else 2
+                for _ in range(undo_count):
+                    game.undo()
+            self.broadcast_to_room(room_name, {
+                "Command": "Takeback",
+                "Room_Name": room_name,
+                "User_Name": requester,
+                "Accepted": bool(accept),
+                "Game_State": game.get_game_state()
             })
+            self.schedule_ai_move(room)
+
+    def add_bot(self, room_name, tier):
+        """Seat an AI player in a free seat of a room that is not playing"""
+        if tier not in evaluation.TIERS:
+            return
+        room = self.registry.get_room(room_name)
+        if room is None:
+            return
+        bot = f"AI ({tier})"
+        with room.lock:
+            if room.game is not None or len(room.players) >= room.SEATS or bot in room:
+                return
+            self.registry.join(room_name, bot)
+            room.bots[bot] = tier
+            room.ready[bot] = True
+        users = self.registry.users_in(room_name)
+        self.broadcast_to_room(room_name, {
+            "Command": "Join_Room",
+            "Room_Name": room_name,
+            "User_Name": bot,
+            "Users_In_Room": users
+        })
+        self.broadcast_to_room(room_name, {
+            "Command": "Room_State",
+            "Available_Rooms": self.registry.room_names(),
+            "Users_In_Room": users
+        })
+        self.post_chat(room_name, bot, f"{bot} has joined the room.")
+        self.broadcast_to_room(room_name, {
+            "Command": "Ready_Update",
+            "Room_Name": room_name,
+            "Ready_Users": room.ready
+        })
+
+    def schedule_ai_move(self, room):
+        """Queue a search if it is an AI player's turn; called with the room lock held"""
+        game = room.game
+        if game is None or game.game_over:
+            return
+        tier = room.bots.get(game.players[game.current_player])
+        if tier is not None:
+            self.ai.submit(room.name, (game, game.move_count), game.get_game_state(), tier, self.play_ai_move)
+
+    def play_ai_move(self, room_name, token, column):
+        """Play a finished search's move unless the game moved on while it ran"""
+        game, move_count = token
+        room = self.registry.get_room(room_name)
+        if room is None:
+            return
+        with room.lock:
+            if room.game is not game or game.move_count != move_count or game.game_over:
+                return
+            self.handle_game_move(room_name, game.players[game.current_player], column)
 
     def send_message(self, client_socket, message):
         """Send a message to a specific client."""
-        print(f"Sending message: {message}")
+        if self.log_level <= config.DEBUG:
+            print(f"Sending message: {message}")
         try:
-            data = pickle.dumps(message)
-            client_socket.sendall(data)
+            with self.tracer.span("serialize", command=message.get("Command")):
+                data = encode_message(message)
+            with self.tracer.span("send", bytes=len(data)):
+                with self.send_locks.setdefault(client_socket, threading.Lock()):
+                    client_socket.sendall(data)
         except Exception as e:
-            print(f"Error sending message: {e}")
+            self.log(config.ERROR, f"Error sending message: {e}")
 
     def broadcast(self, message):
         """Broadcast a message to all connected clients."""
-        for client_socket in self.clients.values():
+        for client_socket in self.registry.sockets():
             self.send_message(client_socket, message)
 
     def broadcast_to_room(self, room_name, message):
         """Broadcast a message to all users in a specific room."""
-        if room_name in self.rooms:
-            for username in self.rooms[room_name]:
-                if username in self.clients:
-                    self.send_message(self.clients[username], message)
+        with self.tracer.span("broadcast_to_room", room=room_name):
+            for username in self.registry.users_in(room_name):
+                client_socket = self.registry.socket_of(username)
+                if client_socket is not None:
+                    self.send_message(client_socket, message)
 
     def broadcast_room_state(self):
         """Send the current list of available rooms to all clients."""
         response = {
             "Command": "Room_State",
-            "Available_Rooms": list(self.rooms.keys()),
+            "Available_Rooms": self.registry.room_names(),
             "Users_In_Room": []
         }
         self.broadcast(response)
 
     def shutdown(self):
-        """Shutdown the server and close all connections."""
-        print("Shutting down server...")
+        """Shutdown the server and close all connections; safe to call more than once."""
+        with self.shutdown_lock:
+            if self.stopped.is_set():
+                return
+            self._shutdown()
+            self.stopped.set()
+
+    def _shutdown(self):
+        self.log(config.INFO, "Shutting down server...")
         self.running = False  # Set flag to stop threads
+        self.wake_acceptor()
+        self.matchmaker.stop()
+        self.ai.stop()
+        if self.handoff is not None:
+            self.handoff.close()
+        if self.successor is None:
+            self.ratings.stop()
+            self.snapshots.stop()  # Saved before the sockets close, so every seat is kept
+        else:
+            self.successor.close()  # The new server owns the ratings and the snapshot now
         
-        # Close all client connections
-        for client_socket in self.clients.values():
+        # Close all client connections; shutdown() wakes the threads blocked in recv()
+        for client_socket in self.registry.sockets():
             try:
+                client_socket.shutdown(socket.SHUT_RDWR)
                 client_socket.close()
             except:
                 pass
@@ -447,11 +913,42 @@ class ChatServer:
             except:
                 pass
 
+        self.chat_history.close()
+
+        counters = self.metrics.snapshot()
+        if counters:
+            self.log(config.INFO, "Counters: " + ", ".join(f"{name}={count}" for name, count in sorted(counters.items())))
+
+        if self.tracer.trace_path:
+            try:
+                count = self.tracer.write()
+                self.log(config.INFO, f"Wrote {count} trace events to {self.tracer.trace_path}")
+            except OSError as e:
+                self.log(config.ERROR, f"Error writing trace: {e}")
+
 if __name__ == "__main__":
-    server = ChatServer("127.0.0.1", 12345)
+    parser = argparse.ArgumentParser(description="Connect 4 chat and game server")
+    parser.add_argument("--takeover", action="store_true",
+                        help="Take the listening socket over from the running server, which then drains")
+    config.add_arguments(parser)
+    args = parser.parse_args()
     try:
-        while True:
-            pass
-    except KeyboardInterrupt:
-        server.shutdown()  # Call shutdown method
-        sys.exit(0)
\ No newline at end of file
+        settings = config.load_config(args)
+    except config.ConfigError as e:
+        parser.error(str(e))
+    listener = predecessor = None
+    if args.takeover:
+        listener, predecessor = handoff.take_over(settings["server"]["handoff_path"])
+    server = ChatServer(settings["server"]["host"], settings["server"]["port"],
+                        connection_limit=config.connection_limit(settings),
+                        command_limits=settings["limits"]["commands"], listener=listener,
+                        predecessor=predecessor, backlog=settings["server"]["backlog"], settings=settings)
+
+    def request_shutdown(signum, frame):
+        # Shut down off the signal handler, so a second signal cannot re-enter shutdown()
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+    server.stopped.wait()  # Sleeps until a signal or a finished drain shuts the server down
+    sys.exit(0)
\ No newline at end of file
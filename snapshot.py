@@ -0,0 +1,253 @@
+"""Snapshots of live rooms so a restarted server can pick up where it stopped.
+
+A snapshot holds every room's members, ready flags, bots and game, the game
+stored as the columns played so it is rebuilt by replaying them, plus each
+logged-in user's reconnect token. A client that logs in again with its token
+gets its seats back.
+"""
+import os
+import secrets
+import struct
+import threading
+
+from engine import Connect4Game
+
+SNAPSHOT_PATH = "rooms.snapshot"
+SNAPSHOT_MAGIC = b"C4SN"
+SNAPSHOT_HEADER = struct.Struct("<4sII")  # magic, session count, room count
+GEOMETRY = struct.Struct("<BBB")
+COUNT = struct.Struct("<H")
+RESUME_GRACE = 60.0  # Seconds a restored user's seats are held for them to reconnect
+
+
+def pack_str(text):
+    encoded = text.encode("utf-8")
+    return COUNT.pack(len(encoded)) + encoded
+
+
+def unpack_str(data, offset):
+    (length,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+
+def pack_names(names):
+    return COUNT.pack(len(names)) + b"".join(pack_str(name) for name in names)
+
+
+def unpack_names(data, offset):
+    (count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    names = []
+    for _ in range(count):
+        name, offset = unpack_str(data, offset)
+        names.append(name)
+    return names, offset
+
+
+def room_signature(room):
+    """Cheap summary of a room's state; the room is encoded again only when it changes"""
+    game = room.game
+    game_part = (id(game), game.key, game.move_count, game.game_over) if game is not None else None
+    return (tuple(room.players), tuple(room.spectators), tuple(room.ready.items()),
+            tuple(room.bots.items()), game_part)
+
+
+def encode_room(room):
+    """Pack one room: members, ready flags, bots and its game as the list of columns played"""
+    parts = [pack_str(room.name), GEOMETRY.pack(*room.geometry),
+             pack_names(list(room.players)), pack_names(list(room.spectators)),
+             pack_names([user for user, ready in room.ready.items() if ready])]
+    parts.append(COUNT.pack(len(room.bots)))
+    for bot, tier in room.bots.items():
+        parts.append(pack_str(bot) + pack_str(tier))
+    game = room.game
+    if game is None:
+        parts.append(b"\0")
+    else:
+        parts.append(b"\1" + pack_names(game.players))
+        parts.append(COUNT.pack(len(game.moves)) + bytes(game.moves))
+    return b"".join(parts)
+
+
+def decode_room(data, offset):
+    """Unpack one room into a dict; returns (room dict, offset after it)"""
+    name, offset = unpack_str(data, offset)
+    geometry = GEOMETRY.unpack_from(data, offset)
+    offset += GEOMETRY.size
+    players, offset = unpack_names(data, offset)
+    spectators, offset = unpack_names(data, offset)
+    ready, offset = unpack_names(data, offset)
+    (bot_count,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    bots = {}
+    for _ in range(bot_count):
+        bot, offset = unpack_str(data, offset)
+        tier, offset = unpack_str(data, offset)
+        bots[bot] = tier
+    game = None
+    has_game = data[offset]
+    offset += 1
+    if has_game:
+        game_players, offset = unpack_names(data, offset)
+        (move_count,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        game = (game_players, list(data[offset:offset + move_count]))
+        offset += move_count
+    return {"name": name, "geometry": tuple(geometry), "players": players, "spectators": spectators,
+            "ready": ready, "bots": bots, "game": game}, offset
+
+
+class SnapshotStore:
+    """Periodic snapshots of live rooms and session tokens, written on a background thread.
+
+    Every interval the thread compares each room's signature with the last
+    one it saw and encodes only the rooms that changed; unchanged rooms reuse
+    their encoded bytes. Request threads never wait on the encoding or the
+    disk. The file is replaced atomically, so a crash leaves the previous
+    snapshot intact.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, interval=2.0):
+        self.path = path
+        self.interval = interval
+        self.tokens = {}  # username -> reconnect token
+        self.records = {}  # room name -> (signature, encoded room)
+        self.lock = threading.Lock()
+        self.tokens_changed = False
+        self.registry = None
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def issue_token(self, username):
+        """Return the user's reconnect token, creating one on first login"""
+        with self.lock:
+            token = self.tokens.get(username)
+            if token is None:
+                token = self.tokens[username] = secrets.token_hex(16)
+                self.tokens_changed = True
+            return token
+
+    def check_token(self, username, token):
+        with self.lock:
+            expected = self.tokens.get(username)
+        return expected is not None and token is not None and secrets.compare_digest(expected, str(token))
+
+    def forget_token(self, username):
+        with self.lock:
+            if self.tokens.pop(username, None) is not None:
+                self.tokens_changed = True
+
+    def start(self, registry):
+        """Start snapshotting the rooms of a registry."""
+        self.registry = registry
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, save=True):
+        """Stop the thread and, unless save is False, write a final snapshot."""
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout=self.interval + 1)
+        if save and self.registry is not None:
+            self.save()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                print(f"Error saving room snapshot: {e}")
+
+    def save(self, exclude=()):
+        """Encode the rooms that changed since the last save and write the snapshot if anything did
+
+        Rooms named in exclude are left out of the snapshot.
+        """
+        changed = self.tokens_changed
+        records = {}
+        for room in list(self.registry.rooms.values()):
+            if room.name in exclude:
+                continue
+            with room.lock:
+                signature = room_signature(room)
+                previous = self.records.get(room.name)
+                if previous is not None and previous[0] == signature:
+                    records[room.name] = previous
+                else:
+                    records[room.name] = (signature, encode_room(room))
+                    changed = True
+        if len(records) != len(self.records):
+            changed = True  # Rooms were deleted
+        self.records = records
+        if not changed:
+            return False
+        with self.lock:
+            tokens = list(self.tokens.items())
+            self.tokens_changed = False
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(tokens), len(records))]
+        parts.extend(pack_str(username) + pack_str(token) for username, token in tokens)
+        parts.extend(encoded for _, encoded in records.values())
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(b"".join(parts))
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving room snapshot: {e}")
+        return True
+
+    def load(self):
+        """Read the last snapshot; returns a list of room dicts and restores the tokens"""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        except OSError as e:
+            print(f"Error loading room snapshot: {e}")
+            return []
+
+        rooms = []
+        try:
+            magic, token_count, room_count = SNAPSHOT_HEADER.unpack_from(data, 0)
+            if magic != SNAPSHOT_MAGIC:
+                print("Ignoring room snapshot with unknown format")
+                return []
+            offset = SNAPSHOT_HEADER.size
+            tokens = {}
+            for _ in range(token_count):
+                username, offset = unpack_str(data, offset)
+                tokens[username], offset = unpack_str(data, offset)
+            for _ in range(room_count):
+                room, offset = decode_room(data, offset)
+                rooms.append(room)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            print(f"Error reading room snapshot: {e}")
+            return []
+        with self.lock:
+            self.tokens.update(tokens)
+        print(f"Loaded {len(rooms)} rooms from {self.path}")
+        return rooms
+
+
+def restore_room(registry, saved):
+    """Recreate a saved room in the registry, replaying its game move by move"""
+    room = registry.create_room(saved["name"], saved["geometry"])
+    for username in saved["players"] + saved["spectators"]:
+        registry.join(saved["name"], username)
+    room.bots.update(saved["bots"])
+    for username in room.ready:
+        room.ready[username] = username in saved["ready"] or username in room.bots
+    if saved["game"] is not None:
+        players, moves = saved["game"]
+        game = Connect4Game(room.name, list(players), *room.geometry)
+        game.players = players  # Keep the saved colors rather than the constructor's shuffle
+        for column in moves:
+            if game.add_chip(game.players[game.current_player], column) == -1:
+                print(f"Dropping unreplayable game in room {room.name}")
+                game = None
+                break
+        room.game = game
+    return room
@@ -0,0 +1,459 @@
+"""Exact solver for analysis positions, single process or spread across cores.
+
+Positions are bitboards in the rules module's column-major layout: current
+holds the chips of the side to move and mask every chip. Scores are from the
+side to move's point of view: 0 is a draw, a positive score a win and the
+sooner the win the larger the score, a negative score a loss.
+
+The transposition table stores upper bounds keyed by canonical Zobrist key.
+It can live in shared memory, where every worker process reads and writes it
+without locks: each slot holds key ^ value next to value, so a slot half
+written by one process while another reads it fails the key check and reads
+as a miss instead of a wrong bound.
+
+Parallel modes:
+- "lazy": every worker solves the whole position, each with its own move
+  order, sharing the table; the first answer stops the others.
+- "split": the root moves are handed out to the workers, each solves its
+  child exactly; this also gives a score for every column.
+"""
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import random
+import time
+from multiprocessing import shared_memory
+
+import endgame
+import rules
+import zobrist
+
+TABLE_SLOTS = 1 << 20  # Two 64-bit words per slot, so 16 MB
+CHECK_INTERVAL = 4095  # Nodes between checks of the shared stop flag
+
+
+class SolveStopped(Exception):
+    pass
+
+
+class TranspositionTable:
+    """Fixed-size table of upper bounds, in a bytearray or in shared memory.
+
+    Word 0 is the stop flag for parallel solves; slot i is words 2i+2 and 2i+3.
+    """
+
+    def __init__(self, slots=TABLE_SLOTS, name=None, create=False):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.slots = slots
+        self.index_mask = slots - 1
+        size = (slots + 1) * 16
+        self.shm = None
+        if name is None and not create:
+            self.data = memoryview(bytearray(size))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+            self.data = self.shm.buf[:size]
+            if create:
+                self.data[:] = bytes(size)
+        self.words = self.data.cast("Q")
+
+    @property
+    def name(self):
+        return self.shm.name if self.shm is not None else None
+
+    def get(self, key):
+        """The stored value for a canonical key, or 0 if there is none"""
+        slot = ((key & self.index_mask) + 1) * 2
+        value = self.words[slot + 1]
+        if value and self.words[slot] ^ value == key:
+            return value
+        return 0
+
+    def put(self, key, value):
+        slot = ((key & self.index_mask) + 1) * 2
+        self.words[slot] = key ^ value
+        self.words[slot + 1] = value
+
+    def clear(self):
+        self.data[:] = bytes(len(self.data))
+
+    def stop(self):
+        self.words[0] = 1
+
+    def stopped(self):
+        return self.words[0] != 0
+
+    def reset_stop(self):
+        self.words[0] = 0
+
+    def close(self, unlink=False):
+        self.words.release()
+        self.data.release()
+        if self.shm is not None:
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+
+
+class BitPosition:
+    """A position to solve; the search itself works on plain ints"""
+
+    def __init__(self, geometry=rules.STANDARD, current=0, mask=0, player_id=0):
+        self.rules = geometry
+        self.current = current
+        self.mask = mask
+        self.player_id = player_id  # Whose chips current holds
+        self.moves = bin(mask).count("1")
+        table = zobrist.get_table(geometry)
+        self.key = 0
+        self.mirror_key = 0
+        for row in range(geometry.rows):
+            for col in range(geometry.columns):
+                bit = 1 << geometry.bit(row, col)
+                if mask & bit:
+                    owner = player_id if current & bit else 1 - player_id
+                    index = row * geometry.columns + col
+                    self.key ^= table.cell_keys[owner][index]
+                    self.mirror_key ^= table.mirror_keys[owner][index]
+
+    @classmethod
+    def from_game_state(cls, game_state):
+        grid = game_state["grid"]
+        geometry = rules.rules_for_grid(grid, game_state.get("connect", rules.CONNECT))
+        player_id = game_state["current_player_id"]
+        current = geometry.bitboard(grid, player_id)
+        return cls(geometry, current, current | geometry.bitboard(grid, 1 - player_id), player_id)
+
+    @classmethod
+    def from_moves(cls, moves, geometry=rules.STANDARD):
+        """Position after a string of 1-based columns, e.g. "4453" """
+        position = cls(geometry)
+        for char in moves:
+            col = int(char) - 1
+            if not position.can_play(col) or position.is_winning_move(col):
+                raise ValueError(f"Invalid move sequence {moves}")
+            position = position.play(col)
+        return position
+
+    def column_mask(self, col):
+        return ((1 << self.rules.rows) - 1) << (col * self.rules.height)
+
+    def can_play(self, col):
+        return not self.mask & (1 << (self.rules.rows - 1 + col * self.rules.height))
+
+    def is_winning_move(self, col):
+        move = (self.mask + (1 << (col * self.rules.height))) & self.column_mask(col)
+        return self.rules.has_line(self.current | move)
+
+    def play(self, col):
+        """The position after the side to move plays col"""
+        mask = self.mask | (self.mask + (1 << (col * self.rules.height)))
+        return BitPosition(self.rules, self.current ^ self.mask, mask, 1 - self.player_id)
+
+
+class Solver:
+    """Alpha-beta solver with a transposition table; one per process"""
+
+    def __init__(self, geometry=rules.STANDARD, table=None, order=None, endgame_table=None):
+        self.rules = geometry
+        self.table = table if table is not None else TranspositionTable()
+        # Endgame results are probed once a position has few enough empty cells
+        if endgame_table is not None and endgame_table.rules is not geometry:
+            endgame_table = None
+        self.endgame = endgame_table
+        self.endgame_moves = endgame_table.min_moves if endgame_table is not None else geometry.cells + 1
+        self.order = order if order is not None else geometry.move_order
+        self.nodes = 0
+        columns, rows, height = geometry.columns, geometry.rows, geometry.height
+        self.cells = geometry.cells
+        self.bottom_mask = geometry.bottom_mask
+        self.board_mask = geometry.board_mask
+        self.column_masks = [((1 << rows) - 1) << (col * height) for col in range(columns)]
+        self.min_score = -(self.cells // 2) + 3
+        zobrist_table = zobrist.get_table(geometry)
+        self.cell_keys = zobrist_table.cell_keys
+        self.mirror_keys = zobrist_table.mirror_keys
+        if geometry.connect == 4:
+            self.winning_cells = self.winning_cells_4
+        else:
+            self.line_masks = geometry.line_masks
+            self.winning_cells = self.winning_cells_lines
+
+    def winning_cells_4(self, position, mask):
+        """Empty cells that would complete a line for the chips in position"""
+        height = self.rules.height
+        # Vertical: three stacked chips win on the cell above them
+        result = (position << 1) & (position << 2) & (position << 3)
+        for shift in (height, height - 1, height + 1):
+            pair = (position << shift) & (position << 2 * shift)
+            result |= pair & (position << 3 * shift)
+            result |= pair & (position >> shift)
+            pair = (position >> shift) & (position >> 2 * shift)
+            result |= pair & (position << shift)
+            result |= pair & (position >> 3 * shift)
+        return result & (self.board_mask ^ mask)
+
+    def winning_cells_lines(self, position, mask):
+        needed = self.rules.connect - 1
+        result = 0
+        for line in self.line_masks:
+            if (position & line).bit_count() == needed:
+                result |= line & ~position
+        return result & (self.board_mask ^ mask)
+
+    def can_win_next(self, current, mask):
+        return self.winning_cells(current, mask) & (mask + self.bottom_mask) & self.board_mask
+
+    def non_losing_moves(self, current, mask):
+        """Playable cells that do not hand the opponent an immediate win"""
+        possible = (mask + self.bottom_mask) & self.board_mask
+        opponent_wins = self.winning_cells(current ^ mask, mask)
+        forced = possible & opponent_wins
+        if forced:
+            if forced & (forced - 1):
+                return 0  # Two threats at once cannot both be blocked
+            possible = forced
+        return possible & ~(opponent_wins >> 1)  # Never play right under an opponent's winning cell
+
+    def negamax(self, current, mask, moves, player_id, key, mirror_key, alpha, beta):
+        """Score of a position where the side to move cannot win at once, within [alpha, beta]"""
+        self.nodes += 1
+        if not self.nodes & CHECK_INTERVAL and self.table.stopped():
+            raise SolveStopped()
+        cells = self.cells
+        candidates = self.non_losing_moves(current, mask)
+        if not candidates:
+            return -((cells - moves) // 2)
+        if moves >= cells - 2:
+            return 0
+        low = -((cells - 2 - moves) // 2)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta:
+                return alpha
+        high = (cells - 1 - moves) // 2
+        canonical = key if key < mirror_key else mirror_key
+        stored = self.table.get(canonical)
+        if stored:
+            high = stored + self.min_score - 1
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+        if moves >= self.endgame_moves:
+            result = self.endgame.probe(canonical)
+            if result == endgame.DRAW:
+                return 0
+            if result == endgame.WIN and alpha < 1:
+                alpha = 1
+                if alpha >= beta:
+                    return alpha
+            elif result == endgame.LOSS and beta > -1:
+                beta = -1
+                if alpha >= beta:
+                    return beta
+
+        # Try the moves that create the most threats first, center first among equals
+        ordered = []
+        column_masks = self.column_masks
+        for col in self.order:
+            move = candidates & column_masks[col]
+            if move:
+                ordered.append(((self.winning_cells(current | move, mask)).bit_count(), col, move))
+        ordered.sort(key=lambda item: item[0], reverse=True)
+
+        columns = self.rules.columns
+        cell_keys = self.cell_keys[player_id]
+        mirror_keys = self.mirror_keys[player_id]
+        for _, col, move in ordered:
+            index = (mask & column_masks[col]).bit_count() * columns + col
+            score = -self.negamax(current ^ mask, mask | move, moves + 1, 1 - player_id,
+                                  key ^ cell_keys[index], mirror_key ^ mirror_keys[index], -beta, -alpha)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        self.table.put(canonical, alpha - self.min_score + 1)
+        return alpha
+
+    def solve(self, position):
+        """Exact score of a BitPosition"""
+        current, mask, moves = position.current, position.mask, position.moves
+        cells = self.cells
+        if self.can_win_next(current, mask):
+            return (cells + 1 - moves) // 2
+        if moves == cells:
+            return 0
+        low = -((cells - moves) // 2)
+        high = (cells + 1 - moves) // 2
+        # Null-window searches narrow [low, high] down to the exact score,
+        # probing near zero first because most positions are close to a draw
+        while low < high:
+            middle = low + (high - low) // 2
+            if middle <= 0 and int(low / 2) < middle:
+                middle = int(low / 2)
+            elif middle >= 0 and int(high / 2) > middle:
+                middle = int(high / 2)
+            result = self.negamax(current, mask, moves, position.player_id,
+                                  position.key, position.mirror_key, middle, middle + 1)
+            if result <= middle:
+                high = result
+            else:
+                low = result
+        return low
+
+    def analyze(self, position):
+        """Score of every playable column, from the mover's point of view"""
+        scores = {}
+        for col in self.rules.move_order:
+            if position.can_play(col):
+                scores[col] = root_move_score(self, position, col)
+        return scores
+
+
+def root_move_score(solver, position, col):
+    if position.is_winning_move(col):
+        return (solver.cells + 1 - position.moves) // 2
+    return -solver.solve(position.play(col))
+
+
+_table = None  # The worker process's view of the shared table
+
+
+_endgame = None
+
+
+def _init_worker(table_name, slots, endgame_path):
+    global _table, _endgame
+    _table = TranspositionTable(slots, name=table_name)
+    if endgame_path is not None:
+        _endgame = endgame.load_table(endgame_path)
+
+
+def _lazy_job(geometry_key, current, mask, player_id, helper):
+    """Solve the whole position; helpers shuffle their move order so workers spread out"""
+    geometry = rules.get_rules(*geometry_key)
+    order = list(geometry.move_order)
+    if helper:
+        random.Random(helper).shuffle(order)
+    solver = Solver(geometry, _table, order, _endgame)
+    try:
+        score = solver.solve(BitPosition(geometry, current, mask, player_id))
+    except SolveStopped:
+        return None, solver.nodes
+    _table.stop()
+    return score, solver.nodes
+
+
+def _split_job(geometry_key, current, mask, player_id, col):
+    geometry = rules.get_rules(*geometry_key)
+    solver = Solver(geometry, _table, endgame_table=_endgame)
+    score = root_move_score(solver, BitPosition(geometry, current, mask, player_id), col)
+    return col, score, solver.nodes
+
+
+class ParallelSolver:
+    """A pool of worker processes sharing one transposition table in shared memory"""
+
+    def __init__(self, workers=None, slots=TABLE_SLOTS, endgame_path=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.table = TranspositionTable(slots, create=True)
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(self.table.name, slots, endgame_path))
+
+    def solve(self, position, mode="lazy"):
+        """Return (scores, nodes): scores is {None: score} for lazy, {column: score} for split"""
+        geometry = position.rules
+        geometry_key = (geometry.rows, geometry.columns, geometry.connect)
+        args = (geometry_key, position.current, position.mask, position.player_id)
+        self.table.reset_stop()
+        if mode == "split":
+            futures = [self.pool.submit(_split_job, *args, col)
+                       for col in geometry.move_order if position.can_play(col)]
+            scores = {}
+            nodes = 0
+            for future in futures:
+                col, score, job_nodes = future.result()
+                scores[col] = score
+                nodes += job_nodes
+            return scores, nodes
+        if mode != "lazy":
+            raise ValueError(f"Unknown mode {mode}")
+        futures = [self.pool.submit(_lazy_job, *args, helper) for helper in range(self.workers)]
+        score = None
+        nodes = 0
+        for future in futures:
+            result, job_nodes = future.result()
+            nodes += job_nodes
+            if result is not None:
+                score = result
+        return {None: score}, nodes
+
+    def close(self):
+        self.pool.shutdown()
+        self.table.close(unlink=True)
+
+
+def benchmark_positions(count=4, plies=14, seed=1, geometry=rules.STANDARD):
+    """Random mid-game positions with plies moves played and no immediate win for either side"""
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        position = BitPosition(geometry)
+        for _ in range(plies):
+            playable = [col for col in range(geometry.columns)
+                        if position.can_play(col) and not position.is_winning_move(col)]
+            if not playable:
+                break
+            position = position.play(rng.choice(playable))
+        else:
+            if not any(position.can_play(col) and position.is_winning_move(col) for col in range(geometry.columns)):
+                positions.append(position)
+    return positions
+
+
+def benchmark(worker_counts, mode="lazy", positions=None):
+    """Solve the same positions with each worker count; yields (workers, nodes per second, seconds)"""
+    positions = positions or benchmark_positions()
+    for workers in worker_counts:
+        if workers == 1 and mode == "lazy":
+            solver = None
+            table = TranspositionTable()
+        else:
+            solver = ParallelSolver(workers)
+        nodes = 0
+        started = time.perf_counter()
+        for position in positions:
+            if solver is None:
+                single = Solver(position.rules, table)
+                single.solve(position)
+                nodes += single.nodes
+                table.clear()
+            else:
+                nodes += solver.solve(position, mode)[1]
+                solver.table.clear()
+        elapsed = time.perf_counter() - started
+        if solver is not None:
+            solver.close()
+        yield workers, nodes / elapsed, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how the parallel solver scales with workers")
+    parser.add_argument("--mode", choices=("lazy", "split"), default="lazy")
+    parser.add_argument("--positions", type=int, default=4)
+    parser.add_argument("--plies", type=int, default=14, help="Moves played in each benchmark position")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    counts = [1]
+    while counts[-1] * 2 <= args.max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != args.max_workers:
+        counts.append(args.max_workers)
+    base = None
+    for workers, nps, elapsed in benchmark(counts, args.mode, benchmark_positions(args.positions, args.plies)):
+        base = base or elapsed
+        print(f"{workers:3d} workers: {nps:12,.0f} nodes/s, {elapsed:8.2f} s, {base / elapsed:5.2f}x speedup")
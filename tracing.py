@@ -0,0 +1,145 @@
+"""Per-request latency spans, a slow-request log and Chrome trace output.
+
+handle_client opens a request for every message it dispatches; code that
+runs inside it on the same thread (serializing and sending replies, game
+updates) records spans against that request through span(). Calls from
+other threads, such as AI callbacks, have no current request and cost only
+a thread-local lookup. Timestamps come from perf_counter_ns.
+
+A request slower than the threshold is logged with its breakdown. If a
+trace path is set, requests and spans are also kept as Chrome trace-event
+"complete" events and written as JSON on shutdown, ready to open in
+chrome://tracing or ui.perfetto.dev.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    __slots__ = ("request", "name", "args", "start")
+
+    def __init__(self, request, name, args):
+        self.request = request
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.request.spans.append((self.name, self.start, time.perf_counter_ns(), self.args))
+        return False
+
+
+class Request:
+    """One dispatched message: the context manager handle_client wraps its handling in"""
+
+    def __init__(self, tracer, name, args, decode):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.decode = decode  # (start, end) of decoding the frames this message arrived with, or None
+        self.spans = []  # (name, start ns, end ns, args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        self.tracer.local.request = self
+        return self
+
+    def __exit__(self, *exc_info):
+        self.end = time.perf_counter_ns()
+        self.tracer.local.request = None
+        self.tracer.finish(self)
+        return False
+
+
+class Tracer:
+    def __init__(self, slow_ms=50.0, trace_path=None, max_events=200000, log=print):
+        self.slow_ns = int(slow_ms * 1000000)  # 0 turns the slow log off
+        self.trace_path = trace_path or None
+        self.log = log
+        self.enabled = bool(self.slow_ns or self.trace_path)
+        self.events = deque(maxlen=max_events)  # Oldest events are dropped once full
+        self.local = threading.local()
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    def request(self, name, decode=None, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Request(self, name, args, decode)
+
+    def span(self, name, **args):
+        """Time a block as part of the current thread's request, if there is one"""
+        request = getattr(self.local, "request", None)
+        if request is None:
+            return NULL_SPAN
+        return Span(request, name, args)
+
+    def finish(self, request):
+        if self.trace_path:
+            self.record(request)
+        start = request.decode[0] if request.decode else request.start
+        if self.slow_ns and request.end - start >= self.slow_ns:
+            self.log(f"Slow {request.name} {format_args(request.args)}: {(request.end - start) / 1e6:.2f} ms "
+                     f"({breakdown(request)})")
+
+    def record(self, request):
+        tid = threading.get_ident()
+        if request.decode:
+            self.events.append(self.event("decode", request.decode[0], request.decode[1], tid, {}))
+        self.events.append(self.event(request.name, request.start, request.end, tid, request.args))
+        for name, start, end, args in request.spans:
+            self.events.append(self.event(name, start, end, tid, args))
+
+    def event(self, name, start, end, tid, args):
+        """A Chrome trace complete ("X") event; times are microseconds since the tracer started"""
+        return {"name": name, "ph": "X", "ts": (start - self.origin) / 1000, "dur": (end - start) / 1000,
+                "pid": self.pid, "tid": tid, "args": {key: str(value) for key, value in args.items()}}
+
+    def write(self, path=None):
+        """Write the recorded events as a Chrome trace JSON file; returns the event count"""
+        path = path or self.trace_path
+        if not path:
+            return 0
+        events = list(self.events)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        os.replace(temp_path, path)
+        return len(events)
+
+
+def format_args(args):
+    return " ".join(f"{key}={value}" for key, value in args.items())
+
+
+def breakdown(request):
+    """Milliseconds per span name, e.g. "decode 0.02, handle 3.10, send 2.90 x3" """
+    parts = []
+    if request.decode:
+        parts.append(f"decode {(request.decode[1] - request.decode[0]) / 1e6:.2f}")
+    parts.append(f"handle {(request.end - request.start) / 1e6:.2f}")
+    totals = {}  # Span name -> [total ns, count], in order of first appearance
+    for name, start, end, _ in request.spans:
+        total = totals.setdefault(name, [0, 0])
+        total[0] += end - start
+        total[1] += 1
+    for name, (total, count) in totals.items():
+        parts.append(f"{name} {total / 1e6:.2f}" + (f" x{count}" if count > 1 else ""))
+    return ", ".join(parts)
@@ -0,0 +1,72 @@
+"""Zobrist position keys shared by every cache, book and table in the project.
+
+Keys are unsigned 64-bit ints. The per-cell values are derived from a hash of
+the geometry and cell rather than from a random generator, so a key means
+the same position in every process, run and version of Python and can be
+stored on disk or sent between processes.
+
+A position's mirror key is the key of the same position reflected left to
+right. canonical_key() picks one of the pair, so a position and its mirror
+image share one entry.
+"""
+import hashlib
+import struct
+
+import rules
+
+KEY_BITS = 64
+_PARTS = struct.Struct("<8sBBBBH")
+
+
+def stable_key(rows, columns, connect, player_id, index):
+    """Deterministic 64-bit value for one (geometry, player, cell)"""
+    data = _PARTS.pack(b"c4zobrst", rows, columns, connect, player_id, index)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class ZobristTable:
+    """Per-geometry cell values; get one from get_table() so it is built only once"""
+
+    def __init__(self, geometry):
+        self.rules = geometry
+        rows, columns, connect = geometry.rows, geometry.columns, geometry.connect
+        # cell_keys[player][flat index]; mirror_keys holds the value of the reflected cell
+        self.cell_keys = [[stable_key(rows, columns, connect, player_id, index) for index in range(geometry.cells)]
+                          for player_id in (0, 1)]
+        self.mirror_keys = [[keys[(index // columns) * columns + columns - 1 - index % columns]
+                             for index in range(geometry.cells)]
+                            for keys in self.cell_keys]
+
+    def keys(self, grid):
+        """Compute (key, mirror key) of a grid from scratch"""
+        key = 0
+        mirror_key = 0
+        index = 0
+        for row in grid:
+            for cell in row:
+                if cell is not None:
+                    key ^= self.cell_keys[cell][index]
+                    mirror_key ^= self.mirror_keys[cell][index]
+                index += 1
+        return key, mirror_key
+
+
+_tables_cache = {}
+
+
+def get_table(geometry=rules.STANDARD):
+    table = _tables_cache.get(geometry)
+    if table is None:
+        table = _tables_cache.setdefault(geometry, ZobristTable(geometry))
+    return table
+
+
+def canonical_key(key, mirror_key):
+    """The key a position and its mirror image share"""
+    return min(key, mirror_key)
+
+
+def grid_keys(grid, connect=rules.CONNECT):
+    """Return (key, canonical key) for a grid of any geometry"""
+    key, mirror_key = get_table(rules.rules_for_grid(grid, connect)).keys(grid)
+    return key, canonical_key(key, mirror_key)